@@ -0,0 +1,312 @@
+"""
+冷热分层存储
+
+news_flash_36kr 只保留最近 HOT_DAYS 天的快讯（热表），更早的快讯按发布日期移入归档段：
+同一天的快讯整体序列化后用 zlib + 预置字典压缩，存入 archive_segment_36kr；
+news_archive_36kr 只保留去重、翻页与折叠所需的列。热表大小因此保持稳定，可以常驻 SQLite 页缓存。
+读取时按 id 定位归档段，解压后的段放在进程内 LRU 缓存中。
+
+用法: python kr36_service/archive.py --hot-days 30 [--retrain] [--vacuum]
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from sqlalchemy import select, insert, delete, func, text
+from sqlalchemy.orm import Session
+
+from models import NewsFlash, ArchiveDictionary, ArchiveSegment, ArchivedNews
+from database import ReadSessionLocal, engine, init_db
+from writer import write_queue
+
+HOT_DAYS = int(os.environ.get("KR36_HOT_DAYS", "30"))
+# zlib 的窗口只有 32KB，更大的字典用不上
+DICT_SIZE = 32 * 1024
+DICT_SAMPLE_ROWS = 2000
+# 全文索引无法处理的短关键词（如单个汉字）在归档中逐段解压匹配，最多扫描最近的这么多个段（每段一天）
+SCAN_DAYS = int(os.environ.get("KR36_ARCHIVE_SCAN_DAYS", "90"))
+
+# 归档段中每条快讯按以下顺序存成 JSON 数组
+FIELDS = ("id", "item_id", "title", "content", "publish_time", "created_at", "source_url", "simhash", "cluster_id")
+_TIME_FIELDS = {FIELDS.index("publish_time"), FIELDS.index("created_at")}
+
+_FRAGMENT_RE = re.compile(r"[^，。；：！？、,;:!?\s]+[，。；：！？、,;:!?]?")
+
+
+def train_dictionary(samples, size=DICT_SIZE):
+    """
+    从样本中挑出反复出现的片段拼成 zlib 预置字典（相当于简化版的 zstd 字典训练）。
+    按 出现次数 × 字节数 打分；zlib 引用越近的内容编码越短，所以得分高的片段放在末尾。
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(_FRAGMENT_RE.findall(sample)))
+    picked, total = [], 0
+    for fragment, count in sorted(counts.items(), key=lambda kv: kv[1] * len(kv[0].encode("utf-8")), reverse=True):
+        data = fragment.encode("utf-8")
+        if count < 2 or total + len(data) > size:
+            continue
+        picked.append(data)
+        total += len(data)
+    return b"".join(reversed(picked))
+
+
+def _encode_row(row):
+    return [value.isoformat() if i in _TIME_FIELDS and value is not None else value for i, value in enumerate(row)]
+
+
+def encode_rows(rows):
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(raw, dictionary=None):
+    compressor = zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress(data, dictionary=None):
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+class SegmentCache:
+    """解压后的归档段 LRU 缓存；以 (段 id, 行数) 校验，段被合并追加后自动失效"""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.dictionaries = {}  # 字典只增不改，可以一直缓存
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def dictionary(self, db: Session, dict_id):
+        if dict_id is None:
+            return None
+        data = self.dictionaries.get(dict_id)
+        if data is None:
+            data = db.execute(select(ArchiveDictionary.data).where(ArchiveDictionary.id == dict_id)).scalar_one()
+            self.dictionaries[dict_id] = data
+        return data
+
+    def get(self, db: Session, segment_id, keep=True):
+        """返回 {id: 行}；keep=False 时未命中的段解压后不放入缓存（一次性扫描用）"""
+        row_count, dict_id = db.execute(
+            select(ArchiveSegment.row_count, ArchiveSegment.dict_id).where(ArchiveSegment.id == segment_id)
+        ).one()
+        with self.lock:
+            entry = self.entries.get(segment_id)
+            if entry is not None and entry[0] == row_count:
+                self.entries.move_to_end(segment_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        data = db.execute(select(ArchiveSegment.data).where(ArchiveSegment.id == segment_id)).scalar_one()
+        rows = {row[0]: row for row in json.loads(decompress(data, self.dictionary(db, dict_id)))}
+        if not keep:
+            return rows
+        with self.lock:
+            self.entries[segment_id] = (row_count, rows)
+            self.entries.move_to_end(segment_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return rows
+
+    def stats(self):
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+segment_cache = SegmentCache()
+
+
+def to_values(row):
+    """归档段中的一行转为 {字段: 值}（不含 simhash），时间字段还原为 datetime"""
+    values = dict(zip(FIELDS, row))
+    values.pop("simhash")
+    for name in ("publish_time", "created_at"):
+        if values[name]:
+            values[name] = datetime.datetime.fromisoformat(values[name])
+    return values
+
+
+def load_values(db: Session, ids):
+    """按 id 从归档段读取快讯，返回 {id: {字段: 值}}；不在归档中的 id 被忽略"""
+    if not ids:
+        return {}
+    by_segment = defaultdict(list)
+    for news_id, segment_id in db.execute(
+        select(ArchivedNews.id, ArchivedNews.segment_id).where(ArchivedNews.id.in_(list(ids)))
+    ):
+        by_segment[segment_id].append(news_id)
+    result = {}
+    for segment_id, news_ids in by_segment.items():
+        rows = segment_cache.get(db, segment_id)
+        for news_id in news_ids:
+            if news_id in rows:
+                result[news_id] = to_values(rows[news_id])
+    return result
+
+
+def scan_keys(db: Session, q, since=None, until=None, collapse=False, max_segments=SCAN_DAYS):
+    """
+    在归档段中按子串匹配标题或正文（不区分大小写），返回按 (publish_time, id) 倒序的键列表。
+    只扫描 [since, until)（本地时间，不带时区）范围内最近的 max_segments 个段，更早的归档搜不到。
+    扫描的段不放入段缓存，避免挤掉翻页常用的段。
+    """
+    needle = q.lower()
+    query = select(ArchiveSegment.id)
+    if since:
+        query = query.where(ArchiveSegment.day >= since.date().isoformat())
+    if until:
+        query = query.where(ArchiveSegment.day <= until.date().isoformat())
+    segment_ids = db.execute(query.order_by(ArchiveSegment.day.desc()).limit(max_segments)).scalars().all()
+    keys = []
+    for segment_id in segment_ids:
+        for row in segment_cache.get(db, segment_id, keep=False).values():
+            values = dict(zip(FIELDS, row))
+            if collapse and values["cluster_id"] is not None:
+                continue
+            if needle not in (values["title"] or "").lower() and needle not in (values["content"] or "").lower():
+                continue
+            publish_time = datetime.datetime.fromisoformat(values["publish_time"])
+            if (since and publish_time < since) or (until and publish_time >= until):
+                continue
+            keys.append((publish_time, values["id"]))
+    keys.sort(reverse=True)
+    return keys
+
+
+def current_dictionary(db: Session, retrain=False):
+    """返回 (字典 id, 字典内容)；还没有字典或要求重新训练时，用热表中最新的快讯训练一个"""
+    if not retrain:
+        latest = db.execute(
+            select(ArchiveDictionary.id, ArchiveDictionary.data).order_by(ArchiveDictionary.id.desc()).limit(1)
+        ).first()
+        if latest:
+            return latest.id, latest.data
+    rows = db.execute(
+        select(*[getattr(NewsFlash, name) for name in FIELDS]).order_by(NewsFlash.id.desc()).limit(DICT_SAMPLE_ROWS)
+    ).all()
+    if not rows:
+        return None, None
+    samples = [encode_rows([_encode_row(row)]).decode("utf-8") for row in rows]
+    data = train_dictionary(samples)
+    dictionary = ArchiveDictionary(data=data, sample_count=len(rows))
+    db.add(dictionary)
+    db.flush()
+    print(f"归档字典 {dictionary.id} 训练完成: {len(rows)} 条样本, {len(data)} 字节")
+    return dictionary.id, data
+
+
+def archive_day(db: Session, day, retrain=False):
+    """
+    把发布日期为 day（YYYY-MM-DD）的热数据移入当天的归档段，返回移动的条数。
+    当天的段已存在时（如回填补抓了旧数据）解压合并后重新压缩。在写线程中调用，不要自行提交。
+    """
+    start = datetime.datetime.fromisoformat(day)
+    end = start + datetime.timedelta(days=1)
+    # SQLite 按热表 max(id) + 1 分配新 id，保留 id 最大的一条，避免新快讯复用已归档的 id
+    max_id = db.execute(select(func.max(NewsFlash.id))).scalar()
+    rows = db.execute(
+        select(*[getattr(NewsFlash, name) for name in FIELDS])
+        .where(NewsFlash.publish_time >= start, NewsFlash.publish_time < end, NewsFlash.id < max_id)
+        .order_by(NewsFlash.id)
+    ).all()
+    if not rows:
+        return 0
+
+    dict_id, dictionary = current_dictionary(db, retrain)
+    segment = db.execute(select(ArchiveSegment).where(ArchiveSegment.day == day)).scalar_one_or_none()
+    encoded = []
+    if segment is not None:
+        encoded = json.loads(decompress(segment.data, segment_cache.dictionary(db, segment.dict_id)))
+    else:
+        segment = ArchiveSegment(day=day)
+        db.add(segment)
+    encoded.extend(_encode_row(row) for row in rows)
+    raw = encode_rows(encoded)
+    segment.dict_id = dict_id
+    segment.row_count = len(encoded)
+    segment.raw_size = len(raw)
+    segment.data = compress(raw, dictionary)
+    segment.size = len(segment.data)
+    db.flush()
+
+    db.execute(insert(ArchivedNews), [
+        {"id": row.id, "item_id": row.item_id, "publish_time": row.publish_time,
+         "cluster_id": row.cluster_id, "segment_id": segment.id, "simhash": row.simhash}
+        for row in rows
+    ])
+    db.execute(delete(NewsFlash).where(NewsFlash.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+def pending_days(db: Session, hot_days=HOT_DAYS):
+    """热表中早于保留窗口的发布日期"""
+    cutoff = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=hot_days), datetime.time())
+    days = db.execute(
+        select(func.date(NewsFlash.publish_time)).where(NewsFlash.publish_time < cutoff).distinct()
+    ).scalars().all()
+    return sorted(str(day) for day in days)
+
+
+def run_archive(hot_days=HOT_DAYS, retrain=False):
+    """按天归档过期的热数据，每天一个事务，经写队列执行；返回归档条数"""
+    db = ReadSessionLocal()
+    try:
+        days = pending_days(db, hot_days)
+    finally:
+        db.close()
+    total = 0
+    for i, day in enumerate(days):
+        # 要求重新训练时只在第一段训练一次，之后的段沿用新字典
+        retrain_now = retrain and i == 0
+        moved = write_queue.submit(lambda db, day=day, retrain_now=retrain_now: archive_day(db, day, retrain_now)).result()
+        if moved:
+            total += moved
+            print(f"归档 {day}: {moved} 条")
+    return total
+
+
+def stats(db: Session):
+    row = db.execute(select(
+        func.count(ArchiveSegment.id), func.sum(ArchiveSegment.row_count),
+        func.sum(ArchiveSegment.raw_size), func.sum(ArchiveSegment.size),
+        func.min(ArchiveSegment.day), func.max(ArchiveSegment.day),
+    )).one()
+    segments, rows, raw_size, size, first_day, last_day = row
+    return {
+        "hot_days": HOT_DAYS,
+        "hot_rows": db.execute(select(func.count(NewsFlash.id))).scalar(),
+        "segments": segments,
+        "archived_rows": rows or 0,
+        "raw_bytes": raw_size or 0,
+        "compressed_bytes": size or 0,
+        "ratio": round(raw_size / size, 2) if size else None,
+        "first_day": first_day,
+        "last_day": last_day,
+        "cache": segment_cache.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把过期的快讯移入压缩归档段")
+    parser.add_argument("--hot-days", type=int, default=HOT_DAYS, help="热表保留的天数")
+    parser.add_argument("--retrain", action="store_true", help="重新训练压缩字典（只影响之后写入的段）")
+    parser.add_argument("--vacuum", action="store_true", help="归档后执行 VACUUM 收缩数据库文件")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"共归档 {run_archive(args.hot_days, args.retrain)} 条")
+    if args.vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    db = ReadSessionLocal()
+    try:
+        print(json.dumps(stats(db), ensure_ascii=False, indent=2))
+    finally:
+        db.close()
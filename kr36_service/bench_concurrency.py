@@ -0,0 +1,116 @@
+"""
+/api/news 并发基准测试
+
+在数据库副本中灌入大量模拟快讯后，并发发起昂贵的全表 LIKE 搜索，同时持续请求廉价的首页接口，
+统计廉价请求的 p50/p99 延迟。测试时关闭响应缓存，每次请求都真正执行查询。--blocking 模式下昂贵搜索走 async def 包装（旧写法，直接在事件循环里
+执行同步查询），用来对比优化前后的差异。
+用法: python kr36_service/bench_concurrency.py --db ./kr36_news.db --rows 200000 [--blocking]
+依赖: httpx
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def inflate(db_path, rows):
+    """向数据库副本中追加模拟快讯，让 LIKE 搜索足够慢"""
+    conn = sqlite3.connect(db_path)
+    start_id = conn.execute("SELECT coalesce(max(item_id), 0) FROM news_flash_36kr").fetchone()[0] + 1
+    conn.executemany(
+        "INSERT INTO news_flash_36kr (item_id, title, content, publish_time, created_at, source_url) "
+        "VALUES (?, ?, ?, datetime('now', ?), datetime('now'), '')",
+        (
+            (start_id + i, f"模拟快讯 {i}", "36氪获悉，" + "模拟快讯正文内容。" * 30, f"-{i} seconds")
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(app, blocking, searches, duration):
+    transport = httpx.ASGITransport(app=app)
+    search_path = "/bench/blocking-news" if blocking else "/api/news"
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        deadline = time.perf_counter() + duration
+
+        async def expensive():
+            count = 0
+            while time.perf_counter() < deadline:
+                await client.get(search_path, params={"q": "马", "limit": 50})
+                count += 1
+                # ASGITransport 不一定会真正挂起，主动让出事件循环
+                await asyncio.sleep(0)
+            return count
+
+        async def cheap():
+            latencies = []
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get("/api/news", params={"limit": 1, "with_total": False})
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+            return latencies
+
+        tasks = [asyncio.create_task(expensive()) for _ in range(searches)]
+        latencies = await cheap()
+        search_count = sum(await asyncio.gather(*tasks))
+    return latencies, search_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/news 并发基准测试")
+    parser.add_argument("--db", default="./kr36_news.db", help="作为初始数据的数据库文件（不会被修改）")
+    parser.add_argument("--rows", type=int, default=200000, help="追加的模拟快讯条数")
+    parser.add_argument("--searches", type=int, default=4, help="并发的昂贵搜索数")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--blocking", action="store_true", help="昂贵搜索走旧的阻塞写法")
+    args = parser.parse_args()
+
+    db_src = os.path.abspath(args.db)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        # database.py 使用相对路径 ./kr36_news.db，切换到临时目录后再导入服务
+        if os.path.exists(db_src):
+            shutil.copyfile(db_src, os.path.join(tmp, "kr36_news.db"))
+        os.chdir(tmp)
+        import main as service
+        from database import ReadSessionLocal, init_db
+
+        # ASGITransport 不会触发 lifespan，这里手动建表，也不会启动抓取任务
+        init_db()
+        inflate("kr36_news.db", args.rows)
+        # 关闭响应缓存，否则重复的搜索除第一次外都直接命中缓存，测不到查询本身
+        service.news_cache.maxsize = 0
+
+        @service.app.get("/bench/blocking-news")
+        async def blocking_news(q: str, limit: int = 50):
+            db = ReadSessionLocal()
+            try:
+                return service.query_news(db, q, limit, 0, None, True)
+            finally:
+                db.close()
+
+        latencies, search_count = asyncio.run(run(service.app, args.blocking, args.searches, args.duration))
+
+    mode = "blocking" if args.blocking else "threadpool"
+    print(f"[{mode}] 昂贵搜索完成 {search_count} 次, 廉价请求 {len(latencies)} 次")
+    print(f"廉价请求延迟 p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+save_items 入库基准测试
+
+在已有数据的 kr36_news.db 副本上，对比逐条查询/逐条 add 的旧写法与批量入库写法的 rows/sec。
+用法: python kr36_service/bench_save_items.py --db ./kr36_news.db --pages 200
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker, Session
+
+from models import NewsFlash
+from database import Base, add_missing_columns
+from fetcher import Kr36Fetcher
+import search
+import dedup
+
+
+def legacy_save_items(items, db: Session):
+    """优化前的 save_items：每条一次查询 + 一次 ORM add"""
+    new_count = 0
+    duplicate_count = 0
+    for item in items:
+        material = item.get("templateMaterial", {})
+        item_id = item.get("itemId")
+        if not item_id: continue
+        existing = db.query(NewsFlash).filter(NewsFlash.item_id == item_id).first()
+        if existing:
+            duplicate_count += 1
+            continue
+        pub_time_ms = material.get("publishTime")
+        pub_time = datetime.datetime.fromtimestamp(pub_time_ms / 1000) if pub_time_ms else datetime.datetime.now()
+        db.add(NewsFlash(
+            item_id=item_id,
+            title=material.get("widgetTitle"),
+            content=material.get("widgetContent"),
+            publish_time=pub_time,
+            source_url=material.get("sourceUrlRoute")
+        ))
+        new_count += 1
+    db.commit()
+    return new_count, duplicate_count
+
+
+def make_pages(existing_ids, pages, page_size=20, dup_ratio=0.25):
+    """生成模拟的 itemList 页面，按比例混入库中已有的 item_id"""
+    existing_ids = list(existing_ids)
+    next_id = max(existing_ids or [0]) + 1
+    now_ms = int(time.time() * 1000)
+    result = []
+    for p in range(pages):
+        items = []
+        for i in range(page_size):
+            if existing_ids and (p * page_size + i) % int(1 / dup_ratio) == 0:
+                item_id = existing_ids[(p * page_size + i) % len(existing_ids)]
+            else:
+                item_id = next_id
+                next_id += 1
+            items.append({
+                "itemId": item_id,
+                "templateMaterial": {
+                    "widgetTitle": f"基准测试快讯 {item_id}",
+                    "widgetContent": "36氪获悉，" + "模拟快讯正文内容。" * 20,
+                    "publishTime": now_ms - (p * page_size + i) * 1000,
+                    "sourceUrlRoute": "",
+                },
+            })
+        result.append(items)
+    return result
+
+
+def run(save, db_path, pages):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    search.init_search_index(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        existing_ids = db.execute(select(NewsFlash.item_id)).scalars().all()
+        # 预先加载近似重复索引（补算历史指纹），不计入计时
+        dedup.near_dup_index = dedup.NearDupIndex()
+        dedup.near_dup_index.ensure_loaded(db)
+        db.commit()
+        page_list = make_pages(existing_ids, pages)
+        rows = sum(len(items) for items in page_list)
+        new_total = dup_total = 0
+        start = time.perf_counter()
+        for items in page_list:
+            new_count, dup_count = save(items, db)
+            new_total += new_count
+            dup_total += dup_count
+        elapsed = time.perf_counter() - start
+        final = db.execute(select(func.count(NewsFlash.id))).scalar()
+    finally:
+        db.close()
+        engine.dispose()
+    return rows, elapsed, new_total, dup_total, final
+
+
+def main():
+    parser = argparse.ArgumentParser(description="save_items 入库基准测试")
+    parser.add_argument("--db", default="./kr36_news.db", help="作为初始数据的数据库文件（不会被修改）")
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    fetcher = Kr36Fetcher()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, save in (("legacy", legacy_save_items), ("bulk", fetcher.save_items)):
+            db_path = os.path.join(tmp, f"{name}.db")
+            if os.path.exists(args.db):
+                shutil.copyfile(args.db, db_path)
+            rows, elapsed, new_total, dup_total, final = run(save, db_path, args.pages)
+            results[name] = (new_total, dup_total, final)
+            print(f"{name:>6}: {rows} 条 / {elapsed:.3f}s = {rows / elapsed:,.0f} rows/sec "
+                  f"(新增 {new_total}, 重复 {dup_total}, 库内共 {final} 条)")
+
+    if results["legacy"] != results["bulk"]:
+        print("警告: 两种写法的新增/重复计数不一致", results)
+
+
+if __name__ == "__main__":
+    main()
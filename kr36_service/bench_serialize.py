@@ -0,0 +1,109 @@
+"""
+/api/news 序列化基准测试
+
+在数据库副本中灌入长正文的模拟快讯后，关闭响应缓存，单个进程内顺序请求 limit=200 的时间线页面
+（首页与游标翻页），比较每个 worker 的 requests/sec：
+  legacy   旧写法：查询 NewsFlash ORM 对象，jsonable_encoder 逐属性转换后 json.dumps
+  lean     新写法：只查询需要的列元组，直接由 orjson（未安装时为标准库 json）序列化为字节
+  preview  新写法 + preview=120，只返回正文前 120 个字符
+用法: python kr36_service/bench_serialize.py --db ./kr36_news.db --rows 20000
+依赖: httpx
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_concurrency import inflate
+
+
+async def run(app, params_list, duration):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        count = 0
+        size = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            response = await client.get("/api/news", params=params_list[count % len(params_list)])
+            response.raise_for_status()
+            size += len(response.content)
+            count += 1
+        elapsed = time.perf_counter() - started
+    return count / elapsed, size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/news 序列化基准测试")
+    parser.add_argument("--db", default="./kr36_news.db", help="作为初始数据的数据库文件（不会被修改）")
+    parser.add_argument("--rows", type=int, default=20000, help="追加的模拟快讯条数")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20, help="轮流请求的游标页数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每种写法的测试时长（秒）")
+    args = parser.parse_args()
+
+    db_src = os.path.abspath(args.db)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        if os.path.exists(db_src):
+            shutil.copyfile(db_src, os.path.join(tmp, "kr36_news.db"))
+        os.chdir(tmp)
+        from fastapi.encoders import jsonable_encoder
+        from sqlalchemy.orm import defer
+        import main as service
+        import serialize
+        from database import ReadSessionLocal, init_db
+        from models import NewsFlash
+
+        init_db()
+        inflate("kr36_news.db", args.rows)
+        # 每次请求都重新查询和序列化
+        service.news_cache.maxsize = 0
+
+        # 预先取出各页的游标
+        db = ReadSessionLocal()
+        try:
+            cursors = [None]
+            for _ in range(args.pages - 1):
+                page = service.query_news(db, None, args.limit, 0, cursors[-1], False)
+                if not page["next_cursor"]:
+                    break
+                cursors.append(page["next_cursor"])
+        finally:
+            db.close()
+        params_list = [{"limit": args.limit, "with_total": False, **({"cursor": c} if c else {})} for c in cursors]
+
+        lean_load_items, lean_dumps = service.load_items, serialize.dumps
+
+        def legacy_load_items(db, ids, preview=None):
+            # 旧写法：ORM 对象（归档部分在真实数据中同样构造为临时 NewsFlash 对象）
+            rows = {news.id: news for news in db.query(NewsFlash).options(defer(NewsFlash.simhash))
+                    .filter(NewsFlash.id.in_(ids)).all()}
+            rows.update({news_id: NewsFlash(**values) for news_id, values in service.archive.load_values(
+                db, [news_id for news_id in ids if news_id not in rows]).items()})
+            return [rows[news_id] for news_id in ids if news_id in rows]
+
+        def legacy_dumps(data):
+            return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        results = {}
+        service.load_items, serialize.dumps = legacy_load_items, legacy_dumps
+        results["legacy"] = asyncio.run(run(service.app, params_list, args.duration))
+        service.load_items, serialize.dumps = lean_load_items, lean_dumps
+        results["lean"] = asyncio.run(run(service.app, params_list, args.duration))
+        preview_params = [{**params, "preview": 120} for params in params_list]
+        results["preview"] = asyncio.run(run(service.app, preview_params, args.duration))
+
+    print(f"limit={args.limit}, {len(params_list)} 页轮流请求, json 实现: {'orjson' if serialize.orjson else 'json'}")
+    base = results["legacy"][0]
+    for name, (rps, size) in results.items():
+        print(f"{name:<8} {rps:8.1f} req/s  ({rps / base:.2f}x)  平均响应 {size / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
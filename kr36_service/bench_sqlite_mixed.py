@@ -0,0 +1,130 @@
+"""
+SQLite 读写混合基准测试
+
+模拟 fetch_history 持续写入的同时，多个读线程不断查询首页，对比两种模式下读请求的延迟：
+  legacy: 默认 rollback 日志，读写共用一个连接池，每页单独提交
+  tuned : WAL + 调优 pragma，只读/写入连接池分离，写入经单写线程合并提交
+用法: python kr36_service/bench_sqlite_mixed.py --db ./kr36_news.db --duration 10
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, create_engines, add_missing_columns
+from models import NewsFlash
+from fetcher import Kr36Fetcher
+from writer import WriteQueue
+import search
+import dedup
+
+
+def make_page(start_id, page_size=20):
+    now_ms = int(time.time() * 1000)
+    return [
+        {
+            "itemId": start_id + i,
+            "templateMaterial": {
+                "widgetTitle": f"基准测试快讯 {start_id + i}",
+                "widgetContent": "36氪获悉，" + "模拟快讯正文内容。" * 40,
+                "publishTime": now_ms - (start_id + i) % 10000000,
+                "sourceUrlRoute": "",
+            },
+        }
+        for i in range(page_size)
+    ]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(mode, db_path, duration, readers, pages_per_second):
+    url = f"sqlite:///{db_path}"
+    if mode == "tuned":
+        write_engine, read_engine = create_engines(url)
+    else:
+        write_engine = read_engine = create_engine(url, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=write_engine)
+    add_missing_columns(write_engine)
+    # 每种模式使用独立的数据库副本，近似重复索引也要重新加载
+    dedup.near_dup_index = dedup.NearDupIndex()
+    search.init_search_index(write_engine)
+    WriteSession = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+    ReadSession = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+    write_queue = WriteQueue(WriteSession) if mode == "tuned" else None
+
+    fetcher = Kr36Fetcher()
+    deadline = time.perf_counter() + duration
+    latencies = []
+    written = [0]
+
+    def writer():
+        next_id = 9000000000000000
+        db = WriteSession()
+        try:
+            while time.perf_counter() < deadline:
+                items = make_page(next_id)
+                next_id += len(items)
+                if write_queue:
+                    write_queue.submit(lambda db, items=items: fetcher.save_items(items, db, commit=False)).result()
+                else:
+                    fetcher.save_items(items, db)
+                written[0] += len(items)
+                time.sleep(1 / pages_per_second)
+        finally:
+            db.close()
+
+    def reader():
+        local = []
+        while time.perf_counter() < deadline:
+            db = ReadSession()
+            start = time.perf_counter()
+            try:
+                db.query(NewsFlash).order_by(NewsFlash.publish_time.desc(), NewsFlash.id.desc()).limit(50).all()
+                db.query(func.count(NewsFlash.id)).scalar()
+            finally:
+                db.close()
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    write_engine.dispose()
+    read_engine.dispose()
+    return latencies, written[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 读写混合基准测试")
+    parser.add_argument("--db", default="./kr36_news.db", help="作为初始数据的数据库文件（不会被修改）")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--pages-per-second", type=float, default=20.0, help="写线程每秒写入的页数")
+    args = parser.parse_args()
+
+    # 副本放在原库同一文件系统上，fsync 开销与线上一致
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(args.db))) as tmp:
+        for mode in ("legacy", "tuned"):
+            db_path = os.path.join(tmp, f"{mode}.db")
+            if os.path.exists(args.db):
+                shutil.copyfile(args.db, db_path)
+            latencies, written = run(mode, db_path, args.duration, args.readers, args.pages_per_second)
+            print(f"{mode:>6}: 写入 {written} 条, 读请求 {len(latencies)} 次, "
+                  f"p50={statistics.median(latencies) * 1000:.1f}ms "
+                  f"p99={percentile(latencies, 0.99) * 1000:.1f}ms "
+                  f"max={max(latencies) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+抓取与查询基准测试套件
+
+在数据库副本上依次运行三个场景，全部针对本地模拟网关（gateway_stub.py），不访问 gateway.36kr.com：
+  ingest    无延迟网关 + 不限速抓取，统计入库速度（条/秒）
+  backfill  带延迟、抖动、随机错误与限流的网关上回填 --backfill-days 天，统计耗时与 429/5xx 次数
+  api       uvicorn 子进程（lifespan=off，不启动定时任务）上并发请求 /api/news（首页、游标翻页、
+            关键词搜索、offset 翻页混合），统计 p50/p99 延迟与吞吐。这几种请求预热后全部命中响应缓存，
+            所以参与比较的指标在关闭缓存的服务上测量；开启缓存的结果另起一行（api_cached）仅供参考
+结果以 JSON 写入 --output（默认 bench_results/<git sha>.json），--compare 与之前的结果比较，
+任一指标退化超过 --threshold 时以非零状态退出，便于在提交之间发现性能回退。
+
+用法:
+    python kr36_service/bench_suite.py --db ./kr36_news.db
+    python kr36_service/bench_suite.py --compare bench_results/<上一次的 sha>.json
+依赖: httpx, uvicorn
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 指标名 -> 数值越大越好（True）还是越小越好（False）
+METRICS = {
+    "ingest_rows_per_sec": True,
+    "backfill_seconds": False,
+    "api_requests_per_sec": True,
+    "api_p50_ms": False,
+    "api_p99_ms": False,
+}
+
+
+def git_sha():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def latency_summary(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+def bench_ingest(gateway_stub, Kr36Fetcher, items, rate):
+    """从空白的合成网关抓取 items 条全新快讯，全部走正常的入库路径（去重、全文索引、聚类、标注、热词）"""
+    server, url = gateway_stub.start(items=items, interval=60, start_id=3000000000000000)
+    try:
+        fetcher = Kr36Fetcher(url=url, latest_rate=rate)
+        started = time.perf_counter()
+        total = asyncio.run(fetcher.fetch_latest_async())
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+    return {
+        "rows": total,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(total / elapsed, 1) if elapsed else None,
+        "gateway": dict(server.faults.stats),
+    }
+
+
+def bench_backfill(gateway_stub, Kr36Fetcher, args):
+    """回填任务在有延迟、错误和限流的网关上的总耗时；时间间隔使 --backfill-days 天约对应 --backfill-items 条"""
+    interval = int(args.backfill_days * 86400 / args.backfill_items)
+    server, url = gateway_stub.start(
+        items=int(args.backfill_items * 1.2), interval=interval, start_id=4000000000000000,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, seed=args.seed,
+    )
+    try:
+        fetcher = Kr36Fetcher(url=url, backfill_rate=args.backfill_rate)
+        job_id = fetcher.create_backfill(args.backfill_days)
+        started = time.perf_counter()
+        total = fetcher.run_backfill(job_id)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+    return {
+        "rows": total,
+        "seconds": round(elapsed, 3),
+        "gateway": dict(server.faults.stats),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def api_load(base_url, concurrency, duration):
+    """concurrency 个客户端循环请求，按请求类型分别统计延迟"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=30,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        first = (await client.get("/api/news", params={"limit": 20, "with_total": False})).json()
+        cursor = first.get("next_cursor")
+        requests = [
+            ("first_page", {"limit": 20, "with_total": False}),
+            ("cursor", {"limit": 20, "with_total": False, "cursor": cursor} if cursor else {"limit": 20}),
+            ("search", {"q": "融资", "limit": 20}),
+            ("offset", {"limit": 20, "offset": 2000}),
+        ]
+        latencies = {name: [] for name, _ in requests}
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker(index):
+            nonlocal errors
+            i = index
+            while time.perf_counter() < deadline:
+                name, params = requests[i % len(requests)]
+                i += 1
+                started = time.perf_counter()
+                response = await client.get("/api/news", params=params)
+                if response.status_code == 200:
+                    latencies[name].append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def bench_api(workdir, args, cache_size=0):
+    """cache_size 为服务端响应缓存的条数，0 表示关闭缓存"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    # 独立进程运行服务，客户端与服务端不争用同一个 GIL
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", HERE, "--host", "127.0.0.1",
+         "--port", str(port), "--lifespan", "off", "--no-access-log", "--log-level", "warning"],
+        cwd=workdir, env={**os.environ, "KR36_NEWS_CACHE_SIZE": str(cache_size)},
+    )
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/api/news", params={"limit": 1}, timeout=1)
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("uvicorn 未能启动")
+        latencies, errors, elapsed = asyncio.run(api_load(base_url, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+    merged = [value for values in latencies.values() for value in values]
+    result = latency_summary(merged)
+    result.update({
+        "errors": errors,
+        "requests_per_sec": round(len(merged) / elapsed, 1),
+        "by_kind": {name: latency_summary(values) for name, values in latencies.items() if values},
+    })
+    return result
+
+
+def compare(current, previous, threshold):
+    """打印各指标的变化，返回退化超过 threshold 的指标名"""
+    regressions = []
+    print(f"与 {previous.get('git_sha')}（{previous.get('timestamp')}）比较:")
+    changed = sorted(key for key, value in current["params"].items() if previous.get("params", {}).get(key) != value)
+    if changed:
+        print(f"  注意: 两次运行的参数不同（{', '.join(changed)}），结果不能直接比较")
+    for name, higher_is_better in METRICS.items():
+        new, old = current["metrics"].get(name), previous.get("metrics", {}).get(name)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  <-- 退化"
+        print(f"  {name:<22} {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抓取与查询基准测试套件")
+    parser.add_argument("--db", default="./kr36_news.db", help="作为初始数据的数据库文件（不会被修改）")
+    parser.add_argument("--scenarios", default="ingest,backfill,api", help="要运行的场景，逗号分隔")
+    parser.add_argument("--ingest-items", type=int, default=4000, help="入库场景抓取的快讯条数")
+    parser.add_argument("--ingest-rate", type=float, default=1000, help="入库场景每秒请求数上限")
+    parser.add_argument("--backfill-days", type=float, default=10)
+    parser.add_argument("--backfill-items", type=int, default=1000, help="回填范围内的快讯条数")
+    parser.add_argument("--backfill-rate", type=float, default=20, help="回填每秒请求数上限")
+    parser.add_argument("--latency", type=float, default=0.05, help="回填场景网关延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="回填场景网关延迟抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="回填场景网关返回 500 的比例")
+    parser.add_argument("--rate-limit", type=float, default=10, help="回填场景网关每秒允许的请求数")
+    parser.add_argument("--seed", type=int, default=36, help="网关随机数种子")
+    parser.add_argument("--concurrency", type=int, default=16, help="查询场景并发客户端数")
+    parser.add_argument("--duration", type=float, default=10.0, help="查询场景持续时间（秒）")
+    parser.add_argument("--output", help="结果 JSON 路径，默认 bench_results/<git sha>.json")
+    parser.add_argument("--compare", help="与之前的结果 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退化的相对变化幅度")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    db_src = os.path.abspath(args.db)
+    output = os.path.abspath(args.output or os.path.join("bench_results", f"{git_sha()}.json"))
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    sys.path.insert(0, HERE)
+    results = {}
+    metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # database.py 使用相对路径 ./kr36_news.db，切换到临时目录后再导入服务
+        if os.path.exists(db_src):
+            shutil.copyfile(db_src, os.path.join(tmp, "kr36_news.db"))
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            import gateway_stub
+            from database import init_db
+            from fetcher import Kr36Fetcher
+
+            init_db()
+            if "ingest" in scenarios:
+                results["ingest"] = bench_ingest(gateway_stub, Kr36Fetcher, args.ingest_items, args.ingest_rate)
+                metrics["ingest_rows_per_sec"] = results["ingest"]["rows_per_sec"]
+                print(f"[ingest] {json.dumps(results['ingest'], ensure_ascii=False)}")
+            if "backfill" in scenarios:
+                results["backfill"] = bench_backfill(gateway_stub, Kr36Fetcher, args)
+                metrics["backfill_seconds"] = results["backfill"]["seconds"]
+                print(f"[backfill] {json.dumps(results['backfill'], ensure_ascii=False)}")
+            # 抓取协程等待写队列提交后才返回，此时入库数据已全部落盘，可以启动查询服务
+            if "api" in scenarios:
+                results["api"] = bench_api(tmp, args)
+                metrics.update({
+                    "api_requests_per_sec": results["api"]["requests_per_sec"],
+                    "api_p50_ms": results["api"]["p50_ms"],
+                    "api_p99_ms": results["api"]["p99_ms"],
+                })
+                print(f"[api] {json.dumps(results['api'], ensure_ascii=False)}")
+                results["api_cached"] = bench_api(tmp, args, cache_size=256)
+                print(f"[api_cached] {json.dumps(results['api_cached'], ensure_ascii=False)}")
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "git_sha": git_sha(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "metrics": metrics,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if previous is not None and compare(report, previous, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
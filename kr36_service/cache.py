@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from models import DataVersion
+
+
+def current_version(db: Session):
+    return db.execute(select(DataVersion.version).where(DataVersion.id == 1)).scalar() or 0
+
+
+def bump_version(db: Session):
+    """在入库事务中调用，与新数据一起提交"""
+    db.execute(update(DataVersion).where(DataVersion.id == 1).values(version=DataVersion.version + 1))
+
+
+def init_version(db: Session):
+    if db.get(DataVersion, 1) is None:
+        db.add(DataVersion(id=1, version=0))
+        db.commit()
+
+
+class ResponseCache:
+    """
+    进程内 LRU 响应缓存，保存已序列化好的 JSON 字节和 ETag。
+    条目记录生成时的数据版本号，版本号变化（有新数据入库）后自动失效。
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, body: bytes):
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        with self.lock:
+            self.entries[key] = (version, body, etag)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return body, etag
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 兼容弱校验标签 W/"..."
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
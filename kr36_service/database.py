@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -8,15 +8,91 @@ from sqlalchemy.orm import sessionmaker
 # 本地开发使用 SQLite:
 SQLALCHEMY_DATABASE_URL = "sqlite:///./kr36_news.db"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in SQLALCHEMY_DATABASE_URL else {}
-)
+# SQLite 生产模式：WAL 日志让读写互不阻塞；synchronous=NORMAL 在 WAL 下仍保证崩溃一致性
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # 约 64MB 页缓存
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+def _apply_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return on_connect
+
+def create_engines(url):
+    """返回 (写引擎, 只读引擎)。SQLite 下只读引擎以 mode=ro 打开，与写连接分属不同的连接池"""
+    if not url.startswith("sqlite"):
+        engine = create_engine(url)
+        return engine, engine
+
+    writer = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(writer, "connect", _apply_pragmas(SQLITE_PRAGMAS))
+
+    path = url[len("sqlite:///"):]
+    reader = create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False},
+        pool_size=10,
+        max_overflow=20,
+    )
+    # journal_mode 由写连接设置并持久化在文件中，只读连接不能修改
+    reader_pragmas = {k: v for k, v in SQLITE_PRAGMAS.items() if k not in ("journal_mode", "synchronous")}
+    event.listen(reader, "connect", _apply_pragmas(reader_pragmas))
+    return writer, reader
+
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 def get_db():
-    db = SessionLocal()
+    """接口查询使用只读连接池"""
+    db = ReadSessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def add_missing_columns(engine):
+    """create_all 不会修改已存在的表，这里为旧库补上模型中新增的列及其索引"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                if column.index:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ({column.name})"
+                    ))
+                print(f"数据表 {table.name} 新增列 {column.name}")
+
+def init_db():
+    """建表、补齐全文索引、热词聚合与近似重复指纹并初始化数据版本号；多进程部署时由调用方保证只有一个进程同时执行"""
+    import models  # noqa: F401  注册模型
+    import search
+    import cache
+    import trends
+    import dedup
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    search.init_search_index(engine)
+    trends.init_trends()
+    dedup.init_near_dup_index()
+    db = SessionLocal()
+    try:
+        cache.init_version(db)
+    finally:
+        db.close()
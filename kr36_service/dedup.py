@@ -0,0 +1,239 @@
+import re
+import hashlib
+from collections import deque
+from sqlalchemy import event, select, update, union_all
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import NewsFlash, ArchivedNews
+import archive
+
+# 近似重复检测：对标题+正文的字符 3-gram 计算 64 位 SimHash，
+# 分成 4 段各 16 位做分桶索引。海明距离 <= 3 的两个指纹至少有一段完全相同（抽屉原理），
+# 所以只需比较同桶的候选。
+SHINGLE = 3
+BANDS = 4
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+MAX_DISTANCE = 3
+# Session.info 中保存本事务待提交指纹的键
+PENDING_KEY = "near_dup_pending"
+
+_NOISE_RE = re.compile(r"[\W_]+")
+_MASK64 = (1 << 64) - 1
+
+
+def simhash(text):
+    """
+    64 位 SimHash。用位切片计数代替逐位累加：planes[j] 的第 k 位是第 k 个比特位上 1 的个数的第 j 位，
+    每个特征的哈希按二进制加法逐层进位，最后用位切片比较选出 1 的个数超过半数的比特位。
+    """
+    text = _NOISE_RE.sub("", (text or "").lower())
+    if not text:
+        return 0
+    shingles = {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+    planes = []
+    for shingle in shingles:
+        carry = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for j, plane in enumerate(planes):
+            planes[j] = plane ^ carry
+            carry &= plane
+            if not carry:
+                break
+        else:
+            if carry:
+                planes.append(carry)
+
+    # 逐位比较 count > threshold，从最高位到最低位
+    threshold = len(shingles) // 2
+    greater, equal = 0, _MASK64
+    for j in reversed(range(max(len(planes), threshold.bit_length()))):
+        plane = planes[j] if j < len(planes) else 0
+        if threshold >> j & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane & _MASK64
+    return greater
+
+
+def to_signed(value):
+    """SQLite INTEGER 是有符号 64 位"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDupIndex:
+    """
+    内存中的 SimHash 分桶索引，只在抓取主进程的写线程中使用。
+    init_db 时从数据库加载已有指纹，并为缺少指纹的历史数据补算并聚类。
+    事务中新加入的指纹先记在该会话的待提交索引中，提交后才并入本索引，回滚则丢弃，
+    避免索引中留下未入库（id 之后会被复用）的指纹。
+    """
+
+    def __init__(self, max_items=200000):
+        self.max_items = max_items
+        self.buckets = [dict() for _ in range(BANDS)]
+        self.items = deque()  # (id, 指纹, cluster_id)，超出 max_items 时淘汰最早的
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def _bands(self, fp):
+        return [(fp >> (b * BAND_BITS)) & BAND_MASK for b in range(BANDS)]
+
+    def add(self, news_id, fp, cluster_id):
+        entry = (news_id, fp, cluster_id)
+        for b, key in enumerate(self._bands(fp)):
+            self.buckets[b].setdefault(key, []).append(entry)
+        self.items.append(entry)
+        while len(self.items) > self.max_items:
+            self._evict(self.items.popleft())
+
+    def _evict(self, entry):
+        for b, key in enumerate(self._bands(entry[1])):
+            bucket = self.buckets[b].get(key)
+            if bucket:
+                bucket.remove(entry)
+                if not bucket:
+                    del self.buckets[b][key]
+
+    def nearest(self, fp, exclude_id=None):
+        """返回海明距离最近且不超过阈值的 (距离, id, cluster_id)，不会返回 id 为 exclude_id 的条目；没有则返回 None"""
+        best = None
+        for b, key in enumerate(self._bands(fp)):
+            for news_id, other, cluster_id in self.buckets[b].get(key, ()):
+                if news_id == exclude_id:
+                    continue
+                distance = bin(fp ^ other).count("1")
+                if distance <= MAX_DISTANCE and (best is None or distance < best[0]):
+                    best = (distance, news_id, cluster_id)
+        return best
+
+    def match(self, fp, exclude_id=None):
+        """返回海明距离最近且不超过阈值的 (id, cluster_id)，没有则返回 None"""
+        found = self.nearest(fp, exclude_id)
+        return found[1:] if found else None
+
+    def reset(self):
+        """清空索引，下次使用时重新从数据库加载（如其他进程写入过数据后本进程接管抓取）"""
+        self.buckets = [dict() for _ in range(BANDS)]
+        self.items.clear()
+        self.loaded = False
+
+    def assign(self, db: Session, rows):
+        """
+        为新入库的快讯计算指纹并归入簇，rows 为按入库顺序排列的 (id, title, content)。
+        cluster_id 为空表示该条是簇内第一条（代表），重复的快讯指向代表的 id。
+        """
+        self.ensure_loaded(db, exclude=[news_id for news_id, _, _ in rows])
+        self._assign(db, rows)
+
+    def _pending(self, db: Session):
+        return db.info.setdefault(PENDING_KEY, {}).setdefault(self, NearDupIndex(max_items=float("inf")))
+
+    def _assign(self, db: Session, rows):
+        pending = self._pending(db)
+        updates = []
+        for news_id, title, content in rows:
+            fp = simhash(f"{title or ''}{content or ''}")
+            # 同时比较已提交的索引与本事务中先前加入的指纹
+            candidates = [found for found in (self.nearest(fp, news_id), pending.nearest(fp, news_id)) if found]
+            found = min(candidates) if candidates else None
+            cluster_id = (found[2] or found[1]) if found else None
+            pending.add(news_id, fp, cluster_id)
+            updates.append({"id": news_id, "simhash": to_signed(fp), "cluster_id": cluster_id})
+        if updates:
+            # 按主键批量更新
+            db.execute(update(NewsFlash), updates)
+
+    def ensure_loaded(self, db: Session, exclude=()):
+        if not self.loaded:
+            self.load(db, exclude)
+
+    def load(self, db: Session, exclude=()):
+        """
+        从数据库加载已有指纹，并为缺少指纹的数据补算并聚类（在 db 的事务中，由调用方提交），返回补算条数。
+        exclude 为本事务中刚插入、稍后由调用方 assign 的 id，不参与补算。
+        """
+        self.reset()
+        try:
+            backfill_archived(db)
+            # 已归档的快讯也载入，新抓到的旧闻转载仍能归入原来的簇
+            both = union_all(
+                select(NewsFlash.id, NewsFlash.simhash, NewsFlash.cluster_id).where(NewsFlash.simhash.is_not(None)),
+                select(ArchivedNews.id, ArchivedNews.simhash, ArchivedNews.cluster_id)
+                .where(ArchivedNews.simhash.is_not(None)),
+            ).subquery()
+            loaded = db.execute(select(both).order_by(both.c.id.desc()).limit(self.max_items)).all()
+            for news_id, fp, cluster_id in reversed(loaded):
+                self.add(news_id, to_unsigned(fp), cluster_id)
+            query = select(NewsFlash.id, NewsFlash.title, NewsFlash.content).where(NewsFlash.simhash.is_(None))
+            if exclude:
+                query = query.where(NewsFlash.id.not_in(list(exclude)))
+            missing = db.execute(query.order_by(NewsFlash.id)).all()
+            self._assign(db, missing)
+        except Exception:
+            # 加载失败（事务会被回滚）时清空，下次重新加载
+            self.reset()
+            raise
+        self.loaded = True
+        if missing:
+            print(f"近似重复索引补算 {len(missing)} 条数据")
+        return len(missing)
+
+
+def backfill_archived(db: Session):
+    """为归档目录中还没有指纹的快讯（新增该列之前归档的）补上指纹：取归档段中保存的，没有则按正文计算"""
+    by_segment = {}
+    for news_id, segment_id in db.execute(
+        select(ArchivedNews.id, ArchivedNews.segment_id).where(ArchivedNews.simhash.is_(None))
+    ):
+        by_segment.setdefault(segment_id, []).append(news_id)
+    updates = []
+    for segment_id, news_ids in by_segment.items():
+        rows = archive.segment_cache.get(db, segment_id, keep=False)
+        for news_id in news_ids:
+            row = rows.get(news_id)
+            if row is None:
+                continue
+            values = dict(zip(archive.FIELDS, row))
+            fp = values["simhash"]
+            if fp is None:
+                fp = to_signed(simhash(f"{values['title'] or ''}{values['content'] or ''}"))
+            updates.append({"id": news_id, "simhash": fp})
+    if updates:
+        db.execute(update(ArchivedNews), updates)
+        print(f"归档快讯补充指纹 {len(updates)} 条")
+    return len(updates)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session):
+    for index, pending in session.info.pop(PENDING_KEY, {}).items():
+        for news_id, fp, cluster_id in pending.items:
+            index.add(news_id, fp, cluster_id)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session, transaction):
+    # 回滚（或未提交就关闭）时丢弃本事务加入的指纹；提交时已由 _apply_pending 取走
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
+
+
+def init_near_dup_index():
+    """加载近似重复索引并补算历史数据的指纹"""
+    db = SessionLocal()
+    try:
+        near_dup_index.load(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+near_dup_index = NearDupIndex()
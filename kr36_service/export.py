@@ -0,0 +1,162 @@
+"""
+批量导出：按 (publish_time, id) 升序流式输出指定时间范围内的快讯，热表与归档段归并后依次写出，
+内存占用与导出范围大小无关。中断后可以用最后导出的 (publish_time, id) 作为 after 参数续传。
+"""
+import csv
+import heapq
+import io
+import json
+from sqlalchemy import select, tuple_
+
+from models import NewsFlash, ArchivedNews
+from database import ReadSessionLocal
+import archive
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet 导出是可选功能
+    pa = pq = None
+
+COLUMNS = ("id", "item_id", "title", "content", "publish_time", "created_at", "source_url", "cluster_id")
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+# 服务端游标每次取的行数，也是每次写出的批大小
+BATCH_SIZE = 500
+
+
+def _conditions(table, since, until, after):
+    conditions = []
+    if since:
+        conditions.append(table.publish_time >= since)
+    if until:
+        conditions.append(table.publish_time < until)
+    if after:
+        conditions.append(tuple_(table.publish_time, table.id) > after)
+    return conditions
+
+
+def iter_rows(db, since=None, until=None, after=None):
+    """按 (publish_time, id) 升序逐行产出 COLUMNS 顺序的元组，热表与归档目录都用服务端游标分批读取"""
+    hot = db.execute(
+        select(*[getattr(NewsFlash, name) for name in COLUMNS])
+        .where(*_conditions(NewsFlash, since, until, after))
+        .order_by(NewsFlash.publish_time, NewsFlash.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    archived = db.execute(
+        select(ArchivedNews.publish_time, ArchivedNews.id, ArchivedNews.segment_id)
+        .where(*_conditions(ArchivedNews, since, until, after))
+        .order_by(ArchivedNews.publish_time, ArchivedNews.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+
+    def archived_rows():
+        # 同一天的快讯在同一个段中，按时间顺序读取时段号连续相同，只在段号变化时取一次段
+        current_id, rows = None, {}
+        for publish_time, news_id, segment_id in archived:
+            if segment_id != current_id:
+                current_id, rows = segment_id, archive.segment_cache.get(db, segment_id)
+            row = rows.get(news_id)
+            if row is not None:
+                values = archive.to_values(row)
+                yield tuple(values[name] for name in COLUMNS)
+
+    time_index = COLUMNS.index("publish_time")
+    yield from heapq.merge(hot, archived_rows(), key=lambda row: (row[time_index], row[0]))
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def ndjson_chunks(rows):
+    for batch in _batches(rows):
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, map(_plain, row))), ensure_ascii=False, separators=(",", ":")) + "\n"
+            for row in batch
+        ).encode("utf-8")
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 带 BOM，Excel 打开时能正确识别 UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(COLUMNS)
+    for batch in _batches(rows):
+        writer.writerows([tuple(map(_plain, row)) for row in batch])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """ParquetWriter 的输出目标，写入的字节暂存起来，每写完一个 row group 取走一次"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(rows):
+    schema = pa.schema([
+        ("id", pa.int64()), ("item_id", pa.int64()), ("title", pa.string()), ("content", pa.string()),
+        ("publish_time", pa.timestamp("ms")), ("created_at", pa.timestamp("ms")),
+        ("source_url", pa.string()), ("cluster_id", pa.int64()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    # 每批一个 row group，写完即可把已生成的字节发给客户端；文件尾部的元数据在最后写出
+    for batch in _batches(rows):
+        writer.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, row)) for row in batch], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {"ndjson": ndjson_chunks, "csv": csv_chunks, "parquet": parquet_chunks}
+
+
+def stream_export(fmt, since=None, until=None, after=None):
+    """
+    生成器：自己管理只读 Session，响应发送完毕（或客户端断开）时才关闭。
+    整个导出在同一个读事务中完成，WAL 模式下看到的是开始导出时的一致快照。
+    """
+    db = ReadSessionLocal()
+    try:
+        yield from WRITERS[fmt](iter_rows(db, since, until, after))
+    finally:
+        db.close()
@@ -1,17 +1,50 @@
-import requests
+import asyncio
+import httpx
 import json
+import os
 import time
 import datetime
+from sqlalchemy import select, insert
 from sqlalchemy.orm import Session
-from models import NewsFlash
-from database import SessionLocal, engine, Base
+from models import NewsFlash, BackfillJob, ArchivedNews
+from database import SessionLocal, ReadSessionLocal, init_db
+from writer import write_queue
+import search
+import cache
+import dedup
+import trends
+import symbols
 
-# 初始化数据库表
-Base.metadata.create_all(bind=engine)
+class TokenBucket:
+    """令牌桶限流：平均每秒 rate 个请求，允许 capacity 个突发"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
 class Kr36Fetcher:
-    def __init__(self):
-        self.url = "https://gateway.36kr.com/api/mis/nav/newsflash/list"
+    def __init__(self, url=None, queue_size=2, latest_rate=2, backfill_rate=1, retries=2):
+        # 可通过环境变量指向本地模拟网关（见 gateway_stub.py）
+        self.url = url or os.environ.get("KR36_GATEWAY_URL", "https://gateway.36kr.com/api/mis/nav/newsflash/list")
+        # 抓取与入库之间的缓冲页数，抓取最多领先入库 queue_size 页
+        self.queue_size = queue_size
+        # 每秒请求数（令牌桶速率），压测时可以调高
+        self.latest_rate = latest_rate
+        self.backfill_rate = backfill_rate
+        # 429 / 5xx / 网络异常时的重试次数，429 优先按 Retry-After 等待
+        self.retries = retries
         self.headers = {
             "accept": "*/*",
             "content-type": "application/json",
@@ -36,124 +69,288 @@ class Kr36Fetcher:
             payload["param"]["pageCallback"] = page_callback
         return payload
 
-    def fetch_page(self, page_callback=None):
+    def client(self):
+        """带连接池的 keep-alive 客户端，一次抓取任务内复用 TLS 连接"""
+        return httpx.AsyncClient(
+            headers=self.headers,
+            timeout=10,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+        )
+
+    async def fetch_page(self, client: httpx.AsyncClient, page_callback=None):
         payload = self._get_payload(page_callback)
-        try:
-            response = requests.post(self.url, headers=self.headers, data=json.dumps(payload), timeout=10)
-            if response.status_code == 200:
-                return response.json()
-            return None
-        except Exception as e:
-            print(f"请求异常: {e}")
-            return None
-
-    def save_items(self, items, db: Session):
-        new_count = 0
+        for attempt in range(self.retries + 1):
+            delay = 2 ** attempt * 0.5
+            try:
+                response = await client.post(self.url, content=json.dumps(payload))
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code != 429 and response.status_code < 500:
+                    return None
+                try:
+                    delay = max(delay, float(response.headers.get("retry-after", 0)))
+                except ValueError:
+                    pass
+                print(f"请求失败: HTTP {response.status_code}")
+            except Exception as e:
+                print(f"请求异常: {e}")
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        return None
+
+    def _parse_item(self, item):
+        material = item.get("templateMaterial", {})
+        pub_time_ms = material.get("publishTime")
+        pub_time = datetime.datetime.fromtimestamp(pub_time_ms / 1000) if pub_time_ms else datetime.datetime.now()
+        return {
+            "item_id": item.get("itemId"),
+            "title": material.get("widgetTitle"),
+            "content": material.get("widgetContent"),
+            "publish_time": pub_time,
+            "source_url": material.get("sourceUrlRoute"),
+            "created_at": datetime.datetime.now(),
+        }
+
+    def save_items(self, items, db: Session, commit=True):
+        """批量入库：每页一次 IN 查询去重 + 一次 executemany 插入，返回 (新增数, 重复数)。
+        通过写队列调用时 commit=False，由写线程合并提交"""
+        rows = {}
         duplicate_count = 0
         for item in items:
-            material = item.get("templateMaterial", {})
             item_id = item.get("itemId")
             if not item_id: continue
-
-            # 检查是否已存在
-            existing = db.query(NewsFlash).filter(NewsFlash.item_id == item_id).first()
-            if existing:
+            # 同一页内重复出现的 item_id 也计为重复
+            if item_id in rows:
                 duplicate_count += 1
                 continue
+            rows[item_id] = self._parse_item(item)
 
-            pub_time_ms = material.get("publishTime")
-            pub_time = datetime.datetime.fromtimestamp(pub_time_ms / 1000) if pub_time_ms else datetime.datetime.now()
+        if not rows:
+            return 0, duplicate_count
 
-            news = NewsFlash(
-                item_id=item_id,
-                title=material.get("widgetTitle"),
-                content=material.get("widgetContent"),
-                publish_time=pub_time,
-                source_url=material.get("sourceUrlRoute")
+        # 一次查询找出已存在的记录
+        existing = set(
+            db.execute(select(NewsFlash.item_id).where(NewsFlash.item_id.in_(list(rows)))).scalars()
+        )
+        remaining = [item_id for item_id in rows if item_id not in existing]
+        if remaining:
+            # 已移入归档的旧快讯也算重复（回填可能再次抓到）
+            existing.update(
+                db.execute(select(ArchivedNews.item_id).where(ArchivedNews.item_id.in_(remaining))).scalars()
             )
-            db.add(news)
-            new_count += 1
-        
-        db.commit()
-        return new_count, duplicate_count
+        duplicate_count += len(existing)
+        new_rows = [row for item_id, row in rows.items() if item_id not in existing]
+
+        if new_rows:
+            inserted = db.execute(
+                insert(NewsFlash).returning(NewsFlash.id, sort_by_parameter_order=True), new_rows
+            ).scalars().all()
+            # 同一事务内增量更新全文索引
+            search.index_rows(db, [
+                (news_id, row["title"], row["content"]) for news_id, row in zip(inserted, new_rows)
+            ])
+            # 近似重复聚类，写入 simhash 与 cluster_id
+            dedup.near_dup_index.assign(db, [
+                (news_id, row["title"], row["content"]) for news_id, row in zip(inserted, new_rows)
+            ])
+            # 标注快讯提及的证券
+            symbols.tagger.tag(db, [
+                (news_id, row["title"], row["content"], row["publish_time"]) for news_id, row in zip(inserted, new_rows)
+            ])
+            # 按小时/按天增量更新发稿量与热词
+            trends.record(db, [(row["publish_time"], row["title"], row["content"]) for row in new_rows])
+            # 数据版本号加一，使各进程的响应缓存失效
+            cache.bump_version(db)
+        if commit:
+            db.commit()
+        return len(new_rows), duplicate_count
+
+    async def write(self, fn):
+        """把 fn(db) 交给单写线程执行，等待其所在批次提交后返回结果"""
+        return await asyncio.wrap_future(write_queue.submit(fn))
+
+    async def crawl(self, handle_page, rate, last_page=None, page_callback=None):
+        """
+        流水线抓取：生产者按令牌桶限速逐页抓取放入有界队列，消费者经写队列入库，
+        第 N+1 页的网络请求与第 N 页的数据库提交重叠进行。
+        协程 handle_page(res_data) 返回 False 时停止；此时已预取的页（最多 queue_size 页）会被丢弃。
+        last_page(res_data) 返回 True 时生产者不再预取后续页面。
+        page_callback 指定从哪一页开始抓取（用于断点续抓）。
+        请求失败导致中断时返回 False，正常结束返回 True。
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        stop = asyncio.Event()
+        bucket = TokenBucket(rate)
+        failed = False
+
+        async def produce(client):
+            nonlocal failed
+            current_callback = page_callback
+            try:
+                while not stop.is_set():
+                    await bucket.acquire()
+                    if stop.is_set():
+                        break
+                    data = await self.fetch_page(client, current_callback)
+                    if not data or data.get("code") != 0:
+                        failed = True
+                        break
 
-    def fetch_latest(self):
+                    res_data = data.get("data", {})
+                    if not res_data.get("itemList"):
+                        break
+                    await queue.put(res_data)
+                    if last_page and last_page(res_data):
+                        break
+
+                    current_callback = res_data.get("pageCallback")
+                    if not current_callback or not res_data.get("hasNextPage"):
+                        break
+            finally:
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                res_data = await queue.get()
+                if res_data is None:
+                    return
+                if stop.is_set():
+                    continue
+                if not await handle_page(res_data):
+                    stop.set()
+
+        async with self.client() as client:
+            await asyncio.gather(produce(client), consume())
+        return not failed
+
+    async def fetch_latest_async(self, watermark=None):
+        """抓取最新快讯；传入 watermark（库中最新的发布时间）时，抓到不晚于它的条目即停止翻页"""
         print(f"[{datetime.datetime.now()}] 开始抓取最新快讯...")
-        db = SessionLocal()
         total_new = 0
-        current_callback = None
-        
+        watermark_ms = watermark.timestamp() * 1000 if watermark else None
+
+        def reached_watermark(res_data):
+            return watermark_ms is not None and any(
+                (item.get("templateMaterial", {}).get("publishTime") or 0) <= watermark_ms
+                for item in res_data.get("itemList", [])
+            )
+
+        async def handle_page(res_data):
+            nonlocal total_new
+            items = res_data.get("itemList", [])
+            new_count, dup_count = await self.write(lambda db: self.save_items(items, db, commit=False))
+            total_new += new_count
+            print(f"本页抓取: {len(items)} 条, 新增: {new_count} 条, 重复: {dup_count} 条")
+            # 如果本页出现了重复项，说明已经接上了之前的记录，停止抓取
+            return dup_count == 0
+
+        await self.crawl(handle_page, rate=self.latest_rate, last_page=reached_watermark)
+        print(f"抓取完成，共计新增 {total_new} 条数据")
+        return total_new
+
+    def create_backfill(self, days=10):
+        db = SessionLocal()
         try:
-            while True:
-                data = self.fetch_page(current_callback)
-                if not data or data.get("code") != 0:
-                    break
-                
-                res_data = data.get("data", {})
-                items = res_data.get("itemList", [])
-                if not items:
-                    break
-                
-                new_count, dup_count = self.save_items(items, db)
-                total_new += new_count
-                
-                print(f"本页抓取: {len(items)} 条, 新增: {new_count} 条, 重复: {dup_count} 条")
-                
-                # 如果本页出现了重复项，说明已经接上了之前的记录，停止抓取
-                if dup_count > 0:
-                    break
-                
-                current_callback = res_data.get("pageCallback")
-                if not current_callback or not res_data.get("hasNextPage"):
-                    break
-                
-                time.sleep(0.5)
-            
-            print(f"抓取完成，共计新增 {total_new} 条数据")
-            return total_new
+            job = BackfillJob(target_date=datetime.datetime.now() - datetime.timedelta(days=days), status="pending")
+            db.add(job)
+            db.commit()
+            return job.id
         finally:
             db.close()
 
-    def fetch_history(self, days=10):
-        print(f"开始抓取过去 {days} 天的历史快讯...")
+    def pending_backfill(self):
+        """返回最早一个未完成（含上次中断）的回填任务 id"""
+        db = ReadSessionLocal()
+        try:
+            return db.execute(
+                select(BackfillJob.id).where(BackfillJob.status.in_(["pending", "running", "failed"]))
+                .order_by(BackfillJob.id).limit(1)
+            ).scalar()
+        finally:
+            db.close()
+
+    async def run_backfill_async(self, job_id):
+        """执行回填任务，每入库一页就把下一页的 pageCallback 与计数写回任务表，重启后从断点继续"""
         db = SessionLocal()
-        target_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        
-        current_callback = None
+        try:
+            job = db.get(BackfillJob, job_id)
+            if job is None or job.status == "done":
+                return 0
+            target_date = job.target_date
+            start_callback = job.page_callback
+            job.status = "running"
+            job.error = None
+            db.commit()
+        finally:
+            db.close()
+
+        print(f"开始回填历史快讯（任务 {job_id}），目标: {target_date}" + ("，从断点继续" if start_callback else ""))
         total_new = 0
-        
-        while True:
-            data = self.fetch_page(current_callback)
-            if not data or data.get("code") != 0:
-                break
-            
-            res_data = data.get("data", {})
+        reached = False
+
+        def page_reaches_target(res_data):
+            last_item_ms = res_data.get("itemList", [])[-1].get("templateMaterial", {}).get("publishTime")
+            return bool(last_item_ms) and datetime.datetime.fromtimestamp(last_item_ms / 1000) < target_date
+
+        async def handle_page(res_data):
+            nonlocal total_new, reached
             items = res_data.get("itemList", [])
-            if not items:
-                break
-            
-            new_count, _ = self.save_items(items, db)
-            total_new += new_count
-            
-            # 检查最后一条的时间
             last_item_ms = items[-1].get("templateMaterial", {}).get("publishTime")
-            if last_item_ms:
-                last_date = datetime.datetime.fromtimestamp(last_item_ms / 1000)
+            last_date = datetime.datetime.fromtimestamp(last_item_ms / 1000) if last_item_ms else None
+            page_done = page_reaches_target(res_data) or not res_data.get("hasNextPage")
+
+            def save_with_checkpoint(db):
+                # 检查点：与本页数据在同一事务中提交
+                job = db.get(BackfillJob, job_id)
+                new_count, dup_count = self.save_items(items, db, commit=False)
+                job.page_callback = res_data.get("pageCallback")
+                job.pages += 1
+                job.new_count += new_count
+                job.duplicate_count += dup_count
+                if last_date:
+                    job.last_publish_time = last_date
+                if page_done:
+                    job.status = "done"
+                return new_count
+
+            total_new += await self.write(save_with_checkpoint)
+            if last_date:
                 print(f"当前抓取到: {last_date}, 目标: {target_date}")
-                if last_date < target_date:
-                    print("已达到目标日期，停止历史抓取")
-                    break
-            
-            current_callback = res_data.get("pageCallback")
-            if not current_callback or not res_data.get("hasNextPage"):
-                break
-            
-            time.sleep(1)  # 稍微限制频率
-            
-        db.close()
+            reached = page_done
+            if reached:
+                print("已达到目标日期，停止历史抓取")
+            return not reached
+
+        ok = await self.crawl(handle_page, rate=self.backfill_rate, last_page=page_reaches_target, page_callback=start_callback)
+
+        if not reached:
+            db = SessionLocal()
+            try:
+                job = db.get(BackfillJob, job_id)
+                job.status = "done" if ok else "failed"
+                if not ok:
+                    job.error = "请求失败，已保存断点，可稍后继续"
+                db.commit()
+            finally:
+                db.close()
         print(f"历史数据抓取完成，共计入库 {total_new} 条数据")
         return total_new
 
+    async def fetch_history_async(self, days=10):
+        """继续未完成的回填任务，没有则新建一个回溯 days 天的任务"""
+        job_id = self.pending_backfill() or self.create_backfill(days)
+        return await self.run_backfill_async(job_id)
+
+    def fetch_latest(self, watermark=None):
+        return asyncio.run(self.fetch_latest_async(watermark))
+
+    def fetch_history(self, days=10):
+        return asyncio.run(self.fetch_history_async(days))
+
+    def run_backfill(self, job_id):
+        return asyncio.run(self.run_backfill_async(job_id))
+
 if __name__ == "__main__":
+    init_db()
     fetcher = Kr36Fetcher()
     fetcher.fetch_latest()
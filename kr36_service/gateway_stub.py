@@ -0,0 +1,252 @@
+"""
+36Kr 快讯网关本地模拟
+
+按 /api/mis/nav/newsflash/list 的接口约定（itemList / pageCallback / hasNextPage）返回合成数据或回放录制的数据，
+用于在不访问 gateway.36kr.com 的情况下调试和压测 Kr36Fetcher。可以模拟网络延迟、随机错误和限流（429）。
+用法:
+    python kr36_service/gateway_stub.py --port 8099 --items 5000 --latency 0.2
+    python kr36_service/gateway_stub.py --replay ./kr36_news.db --error-rate 0.05 --rate-limit 5
+    KR36_GATEWAY_URL=http://127.0.0.1:8099/api/mis/nav/newsflash/list python kr36_service/fetcher.py
+"""
+import argparse
+import base64
+import datetime
+import json
+import random
+import sqlite3
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PATH = "/api/mis/nav/newsflash/list"
+STATS_PATH = "/stats"
+
+
+class FeedData:
+    """合成快讯：最新一条为启动时刻，之后每条间隔 interval 秒"""
+
+    def __init__(self, items=5000, interval=300, start_id=3000000000000000):
+        self.items = items
+        self.interval = interval
+        self.start_id = start_id
+        self.now_ms = int(time.time() * 1000)
+
+    def item(self, index):
+        item_id = self.start_id + self.items - index
+        return {
+            "itemId": item_id,
+            "templateMaterial": {
+                "itemId": item_id,
+                "widgetTitle": f"模拟快讯 {item_id}",
+                "widgetContent": f"36氪获悉，这是第 {index} 条模拟快讯的正文内容。",
+                "publishTime": self.now_ms - index * self.interval * 1000,
+                "sourceUrlRoute": "",
+            },
+        }
+
+    def page(self, offset, page_size):
+        end = min(offset + page_size, self.items)
+        return {
+            "itemList": [self.item(i) for i in range(offset, end)],
+            "pageCallback": encode_callback(end),
+            "hasNextPage": 1 if end < self.items else 0,
+        }
+
+
+class RecordedFeed(FeedData):
+    """
+    回放录制的快讯，按发布时间倒序分页。支持：
+      .db            本服务的 SQLite 数据库（news_flash_36kr 表）
+      .ndjson/.jsonl /api/news/export 导出的数据，或每行一条网关原始 item
+    shift_to_now 为 True 时整体平移发布时间，使最新一条为当前时刻（便于按天数回填）。
+    """
+
+    def __init__(self, path, shift_to_now=True):
+        if path.endswith(".db"):
+            conn = sqlite3.connect(path)
+            try:
+                rows = conn.execute(
+                    "SELECT item_id, title, content, publish_time, source_url FROM news_flash_36kr"
+                ).fetchall()
+            finally:
+                conn.close()
+            records = [_record(*row) for row in rows]
+        else:
+            records = []
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    data = json.loads(line)
+                    if "templateMaterial" in data:
+                        records.append(data)
+                    else:
+                        records.append(_record(data["item_id"], data["title"], data["content"],
+                                               data["publish_time"], data.get("source_url")))
+        records.sort(key=lambda item: item["templateMaterial"]["publishTime"], reverse=True)
+        if shift_to_now and records:
+            delta = int(time.time() * 1000) - records[0]["templateMaterial"]["publishTime"]
+            for item in records:
+                item["templateMaterial"]["publishTime"] += delta
+        self.records = records
+        self.items = len(records)
+
+    def item(self, index):
+        return self.records[index]
+
+
+def _record(item_id, title, content, publish_time, source_url):
+    if isinstance(publish_time, str):
+        publish_time = datetime.datetime.fromisoformat(publish_time)
+    return {
+        "itemId": item_id,
+        "templateMaterial": {
+            "itemId": item_id,
+            "widgetTitle": title,
+            "widgetContent": content,
+            "publishTime": int(publish_time.timestamp() * 1000),
+            "sourceUrlRoute": source_url or "",
+        },
+    }
+
+
+def encode_callback(offset):
+    return base64.b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def decode_callback(callback):
+    if not callback:
+        return 0
+    return int(json.loads(base64.b64decode(callback))["offset"])
+
+
+class Faults:
+    """故障注入：固定延迟 + 随机抖动、按比例返回错误、令牌桶限流；同时统计请求情况"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, burst=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst or max(1, int(rate_limit or 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "throttled": 0}
+
+    def admit(self):
+        """返回 None 表示放行，否则返回需要等待的秒数（用于 Retry-After）"""
+        if not self.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            return (1 - self.tokens) / self.rate_limit
+
+    def delay(self):
+        with self.lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        return self.latency + extra
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def count(self, key):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[key] += 1
+
+
+def make_handler(feed, latency=0.0, faults=None):
+    faults = faults or Faults(latency=latency)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+        def do_GET(self):
+            if self.path == STATS_PATH:
+                self.send_json(faults.stats)
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            if self.path != PATH:
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            wait = faults.admit()
+            if wait is not None:
+                faults.count("throttled")
+                self.send_json({"code": 429, "msg": "too many requests"}, status=429,
+                               headers={"Retry-After": f"{wait:.3f}"})
+                return
+            delay = faults.delay()
+            if delay:
+                time.sleep(delay)
+            if faults.should_fail():
+                faults.count("errors")
+                self.send_json({"code": 500, "msg": "injected error"}, status=500)
+                return
+            param = json.loads(body or b"{}").get("param", {})
+            data = feed.page(decode_callback(param.get("pageCallback")), int(param.get("pageSize", 20)))
+            faults.count("ok")
+            self.send_json({"code": 0, "data": data})
+
+        def send_json(self, payload, status=200, headers=None):
+            raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, burst=None,
+          seed=None, replay=None, **feed_options):
+    """在后台线程中启动模拟网关，返回 (server, url)；server.faults.stats 为请求统计"""
+    feed = RecordedFeed(replay) if replay else FeedData(**feed_options)
+    faults = Faults(latency, jitter, error_rate, rate_limit, burst, seed)
+    server = ThreadingHTTPServer((host, port), make_handler(feed, faults=faults))
+    server.daemon_threads = True
+    server.faults = faults
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="36Kr 快讯网关本地模拟")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--items", type=int, default=5000, help="合成快讯总条数")
+    parser.add_argument("--interval", type=int, default=300, help="相邻两条快讯的发布时间间隔（秒）")
+    parser.add_argument("--replay", help="回放录制的数据（.db 或 .ndjson），指定后忽略 --items/--interval")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求附加的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="在延迟之上再附加 0~jitter 秒的随机抖动")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 的比例")
+    parser.add_argument("--rate-limit", type=float, help="每秒允许的请求数，超出返回 429")
+    parser.add_argument("--burst", type=int, help="限流允许的突发请求数")
+    parser.add_argument("--seed", type=int, help="随机数种子，便于复现")
+    args = parser.parse_args()
+
+    feed = RecordedFeed(args.replay) if args.replay else FeedData(items=args.items, interval=args.interval)
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.rate_limit, args.burst, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(feed, faults=faults))
+    print(f"模拟网关已启动: http://{args.host}:{args.port}{PATH}（{feed.items} 条快讯）")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+class FileLock:
+    """
+    基于 flock 的进程间文件锁。进程退出（包括崩溃）时由操作系统自动释放，
+    用于在 uvicorn --workers N 的多个进程中选出唯一的抓取进程。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    @property
+    def held(self):
+        return self.fd is not None
+
+    def acquire(self, blocking=True):
+        if self.fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # 记录持有者 pid，便于排查
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    @contextmanager
+    def hold(self):
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
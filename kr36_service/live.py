@@ -0,0 +1,105 @@
+import asyncio
+import json
+from sqlalchemy import select, func
+
+from models import NewsFlash
+from database import ReadSessionLocal
+import cache
+
+# 每次检查最多读取的新快讯条数，积压更多时分多次检查推送完
+PAGE_SIZE = 500
+
+
+class Subscriber:
+    def __init__(self, keywords=None, maxsize=100):
+        self.keywords = [k.lower() for k in keywords or [] if k]
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def accepts(self, text):
+        return not self.keywords or any(k in text for k in self.keywords)
+
+
+class BroadcastHub:
+    """
+    进程内广播：每个进程一个后台任务盯着数据版本号，有新数据入库时只查一次库，
+    再把序列化好的消息分发给所有订阅者的有界队列。订阅者消费过慢时丢弃最旧的消息。
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.subscribers = set()
+        self.last_id = None
+        self.version = None
+
+    def subscribe(self, keywords=None):
+        subscriber = Subscriber(keywords)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, rows):
+        # 每条快讯只序列化一次，分发时只复制引用
+        messages = [
+            (f"{news['title'] or ''}\n{news['content'] or ''}".lower(),
+             json.dumps(news, ensure_ascii=False, separators=(",", ":")))
+            for news in rows
+        ]
+        for subscriber in list(self.subscribers):
+            for text, message in messages:
+                if not subscriber.accepts(text):
+                    continue
+                if subscriber.queue.full():
+                    subscriber.queue.get_nowait()
+                    subscriber.dropped += 1
+                subscriber.queue.put_nowait(message)
+
+    def _check(self):
+        """
+        版本号未变时只有一次主键查询；有变化才读取新增的快讯。
+        一次最多读取 PAGE_SIZE 条，读满时不记下版本号，下次检查继续读取剩余的，直到积压读完。
+        """
+        db = ReadSessionLocal()
+        try:
+            version = cache.current_version(db)
+            if version == self.version:
+                return []
+            if self.last_id is None or not self.subscribers:
+                self.version = version
+                self.last_id = db.execute(select(func.max(NewsFlash.id))).scalar() or 0
+                return []
+            rows = db.execute(
+                select(NewsFlash).where(NewsFlash.id > self.last_id).order_by(NewsFlash.id).limit(PAGE_SIZE)
+            ).scalars().all()
+            if len(rows) < PAGE_SIZE:
+                self.version = version
+            if rows:
+                self.last_id = rows[-1].id
+            return [news_to_dict(news) for news in rows]
+        finally:
+            db.close()
+
+    async def run(self):
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._check)
+                if rows:
+                    # 按发布时间先旧后新推送，前端依次插入顶部
+                    self.publish(sorted(rows, key=lambda news: news["publish_time"] or ""))
+            except Exception as e:
+                print(f"推送检查异常: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+def news_to_dict(news):
+    return {
+        "id": news.id,
+        "item_id": news.item_id,
+        "title": news.title,
+        "content": news.content,
+        "publish_time": news.publish_time.isoformat() if news.publish_time else None,
+        "created_at": news.created_at.isoformat() if news.created_at else None,
+        "source_url": news.source_url,
+    }
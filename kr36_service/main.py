@@ -1,23 +1,139 @@
-from fastapi import FastAPI, Depends, Query
+from fastapi import FastAPI, Depends, Query, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import select, or_, tuple_, exists
 from typing import List, Optional
 import uvicorn
 import os
+import json
+import base64
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from contextlib import asynccontextmanager
+import threading
+import asyncio
+import heapq
 
-from database import get_db, SessionLocal, engine, Base
-from models import NewsFlash
+from database import get_db, ReadSessionLocal, init_db
+from models import NewsFlash, BackfillJob, ArchivedNews, NewsSymbol
 from fetcher import Kr36Fetcher
+from poller import AdaptivePoller
+from leader import FileLock
+from live import BroadcastHub
+import search
+import cache
+import archive
+import export
+import trends
+import symbols
+import dedup
+import serialize
+from cache import ResponseCache
+
+# 多进程部署（uvicorn --workers N）时：建表由 init 锁串行化，抓取由 ingest 锁选出唯一的主进程，其余进程只读
+INIT_LOCK_PATH = os.environ.get("KR36_INIT_LOCK", "./kr36_init.lock")
+INGEST_LOCK_PATH = os.environ.get("KR36_INGEST_LOCK", "./kr36_ingest.lock")
+LEADER_RETRY_SECONDS = 30
+
+fetcher = Kr36Fetcher()
+
+# 定时任务：自适应轮询第一页，有新快讯时加快、无新内容时退避
+poller = AdaptivePoller(fetcher)
+
+scheduler = BackgroundScheduler()
+ingest_lock = FileLock(INGEST_LOCK_PATH)
+shutdown_event = threading.Event()
+
+backfill_lock = threading.Lock()
 
-# 初始化数据库
-Base.metadata.create_all(bind=engine)
+# 新快讯推送：每个进程一个广播中心
+hub = BroadcastHub()
 
-app = FastAPI(title="36Kr News Flash Service")
+def run_pending_backfills():
+    """依次执行所有未完成的回填任务（含重启前中断的任务），同一时间只有一个线程在回填"""
+    if not backfill_lock.acquire(blocking=False):
+        return
+    try:
+        while True:
+            job_id = fetcher.pending_backfill()
+            if job_id is None:
+                break
+            fetcher.run_backfill(job_id)
+            db = ReadSessionLocal()
+            try:
+                # 请求失败的任务保留断点，等下次启动或手动触发再继续
+                if db.get(BackfillJob, job_id).status == "failed":
+                    break
+            finally:
+                db.close()
+    finally:
+        backfill_lock.release()
+
+def initial_fetch():
+    # 首次启动检查：有未完成的回填任务则从断点继续；库里没数据或数据较少则新建回填任务抓取过去 10 天的
+    db = ReadSessionLocal()
+    try:
+        count = db.query(NewsFlash).count()
+    finally:
+        db.close()
+    if fetcher.pending_backfill():
+        print("存在未完成的回填任务，从断点继续...")
+    elif count < 100:
+        print("数据量较少，开始异步抓取历史数据...")
+        fetcher.create_backfill(days=10)
+    else:
+        print("已有足够数据，抓取最新快讯...")
+        fetcher.fetch_latest()
+    run_pending_backfills()
+
+def try_become_leader():
+    """抢到 ingest 锁的进程负责全部抓取任务"""
+    if not ingest_lock.acquire(blocking=False):
+        return False
+    print(f"[pid {os.getpid()}] 成为抓取主进程")
+    poller.attach(scheduler)
+    # 其他进程通过接口新建的回填任务由主进程定期接手
+    scheduler.add_job(run_pending_backfills, IntervalTrigger(minutes=1), id="kr36_backfill",
+                      max_instances=1, coalesce=True, replace_existing=True)
+    # 过期的快讯定期移入压缩归档，热表大小保持稳定
+    scheduler.add_job(archive.run_archive, IntervalTrigger(hours=6), id="kr36_archive",
+                      max_instances=1, coalesce=True, replace_existing=True)
+    scheduler.add_job(trends.run_prune, IntervalTrigger(hours=6), id="kr36_trends_prune",
+                      max_instances=1, coalesce=True, replace_existing=True)
+    # 证券列表每天更新一次，启动时立即执行；有变化时重建自动机并重新标注历史快讯
+    scheduler.add_job(symbols.refresh, IntervalTrigger(hours=24), id="kr36_symbols",
+                      max_instances=1, coalesce=True, replace_existing=True, next_run_time=datetime.now())
+    scheduler.start()
+    # 使用线程运行，避免阻塞启动导致服务无法启动
+    threading.Thread(target=initial_fetch, daemon=True).start()
+    return True
+
+def wait_for_leadership():
+    # 主进程退出后锁由系统释放，只读进程定期重试接管
+    while not shutdown_event.wait(LEADER_RETRY_SECONDS):
+        # 启动时加载的近似重复索引已过时（期间由其他进程写入），接管后重新加载
+        dedup.near_dup_index.reset()
+        if try_become_leader():
+            return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with FileLock(INIT_LOCK_PATH).hold():
+        init_db()
+    if not try_become_leader():
+        print(f"[pid {os.getpid()}] 只读模式，抓取由其他进程负责")
+        threading.Thread(target=wait_for_leadership, daemon=True).start()
+    hub_task = asyncio.create_task(hub.run())
+    yield
+    hub_task.cancel()
+    shutdown_event.set()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    ingest_lock.release()
+
+app = FastAPI(title="36Kr News Flash Service", lifespan=lifespan)
 
 # 配置 CORS
 app.add_middleware(
@@ -28,70 +144,332 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-fetcher = Kr36Fetcher()
+@app.get("/api/admin/backfills")
+def list_backfills(limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_db)):
+    """回填任务列表及进度"""
+    return db.query(BackfillJob).order_by(BackfillJob.id.desc()).limit(limit).all()
 
-# 定时任务：每天晚上 10 点抓取
-def scheduled_fetch():
-    print(f"[{datetime.now()}] 执行定时抓取任务...")
-    fetcher.fetch_latest()
+@app.get("/api/admin/backfills/{job_id}")
+def get_backfill(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(BackfillJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="回填任务不存在")
+    return job
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(scheduled_fetch, CronTrigger(hour=22, minute=0))
-scheduler.start()
+@app.post("/api/admin/backfills")
+def create_backfill(days: int = Query(10, ge=1, le=365), db: Session = Depends(get_db)):
+    """新建回填任务；由抓取主进程在后台线程中执行"""
+    job_id = fetcher.create_backfill(days=days)
+    if ingest_lock.held:
+        threading.Thread(target=run_pending_backfills, daemon=True).start()
+    return db.get(BackfillJob, job_id)
 
-import threading
+@app.get("/api/admin/archive")
+def archive_stats(db: Session = Depends(get_db)):
+    """归档段数量、压缩比与段缓存命中情况"""
+    return archive.stats(db)
+
+def to_local(value: Optional[datetime]) -> Optional[datetime]:
+    """带时区的时间转为本地时间并去掉时区，与库中（本地时间、不带时区）的 publish_time 比较"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-# ... existing code ...
+def decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError(cursor)
+        return data
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的翻页游标")
 
-@app.on_event("startup")
-async def startup_event():
-    # 首次启动检查：如果库里没数据或数据较少，异步抓取过去 10 天的
-    def initial_fetch():
-        db = SessionLocal()
+def query_news(db: Session, q, limit, offset, cursor, with_total, collapse=False, since=None, until=None, secids=None,
+               preview=None):
+    match = search.build_match(q) if q and search.is_enabled(db) else None
+    if match and secids is None:
+        # 走 FTS5 全文索引，按相关度排序；相关度排序无法按时间定位，游标中记录偏移量
+        if cursor:
+            try:
+                offset = int(decode_cursor(cursor).get("offset", 0))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="无效的翻页游标")
+        total, ids = search.search_ids(db, match, limit + 1, offset, with_total, heads_only=collapse,
+                                       since=since, until=until)
+        return {
+            "total": total,
+            "items": load_items(db, ids[:limit], preview),
+            "next_cursor": encode_cursor({"offset": offset + limit}) if len(ids) > limit else None
+        }
+
+    last_key = None
+    if cursor:
+        # 按 (publish_time, id) 定位，直接在索引上 seek，翻页成本与页码无关
+        data = decode_cursor(cursor)
         try:
-            count = db.query(NewsFlash).count()
-            if count < 100:
-                print("数据量较少，开始异步抓取历史数据...")
-                fetcher.fetch_history(days=10)
-            else:
-                print("已有足够数据，抓取最新快讯...")
-                fetcher.fetch_latest()
-        finally:
-            db.close()
-    
-    # 使用线程运行，避免阻塞 startup 事件导致服务无法启动
-    threading.Thread(target=initial_fetch, daemon=True).start()
+            last_key = (datetime.fromisoformat(data["t"]), int(data["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="无效的翻页游标")
+        offset = 0
+    size = offset + limit + 1
 
-@app.get("/api/news")
-async def get_news(
-    q: Optional[str] = Query(None, description="关键词搜索"),
-    limit: int = Query(50, ge=1, le=200),
-    offset: int = 0,
-    db: Session = Depends(get_db)
-):
-    query = db.query(NewsFlash)
+    if secids is not None:
+        # 按证券筛选：在 news_symbol_36kr 的 (secid, publish_time, news_id) 索引上按时间倒序翻页，热数据与归档一视同仁
+        key_query = db.query(NewsSymbol.publish_time, NewsSymbol.news_id).filter(NewsSymbol.secid.in_(secids))
+        if len(secids) > 1:
+            key_query = key_query.distinct()
+        if collapse:
+            key_query = key_query.filter(
+                ~exists().where(NewsFlash.id == NewsSymbol.news_id, NewsFlash.cluster_id.is_not(None)),
+                ~exists().where(ArchivedNews.id == NewsSymbol.news_id, ArchivedNews.cluster_id.is_not(None)),
+            )
+        if since:
+            key_query = key_query.filter(NewsSymbol.publish_time >= since)
+        if until:
+            key_query = key_query.filter(NewsSymbol.publish_time < until)
+        if match:
+            key_query = key_query.filter(NewsSymbol.news_id.in_(search.matching_ids(match)))
+        elif q:
+            archived_ids = [news_id for _, news_id in archive.scan_keys(db, q, since, until, collapse)]
+            key_query = key_query.filter(or_(
+                exists().where(
+                    NewsFlash.id == NewsSymbol.news_id,
+                    or_(NewsFlash.title.ilike(f"%{q}%"), NewsFlash.content.ilike(f"%{q}%")),
+                ),
+                NewsSymbol.news_id.in_(archived_ids),
+            ))
+        total = key_query.count() if with_total else None
+        if last_key:
+            key_query = key_query.filter(tuple_(NewsSymbol.publish_time, NewsSymbol.news_id) < last_key)
+        keys = (key_query.order_by(NewsSymbol.publish_time.desc(), NewsSymbol.news_id.desc())
+                .offset(offset).limit(limit + 1).all())
+        return load_page(db, keys, limit, total, preview)
+
+    # 时间线：热表与归档目录各自按 (publish_time, id) 取出当前页范围内的键再归并，
+    # 只有落在当前页的归档快讯才需要解压对应的归档段
+    hot_query = db.query(NewsFlash.publish_time, NewsFlash.id)
+    archive_query = db.query(ArchivedNews.publish_time, ArchivedNews.id)
+    if collapse:
+        # 每个近似重复簇只保留代表（最先入库的一条）
+        hot_query = hot_query.filter(NewsFlash.cluster_id.is_(None))
+        archive_query = archive_query.filter(ArchivedNews.cluster_id.is_(None))
+    if since:
+        hot_query = hot_query.filter(NewsFlash.publish_time >= since)
+        archive_query = archive_query.filter(ArchivedNews.publish_time >= since)
+    if until:
+        hot_query = hot_query.filter(NewsFlash.publish_time < until)
+        archive_query = archive_query.filter(ArchivedNews.publish_time < until)
     if q:
-        query = query.filter(
+        hot_query = hot_query.filter(
             or_(
                 NewsFlash.title.ilike(f"%{q}%"),
                 NewsFlash.content.ilike(f"%{q}%")
             )
         )
-    
-    total = query.count()
-    items = query.order_by(NewsFlash.publish_time.desc()).offset(offset).limit(limit).all()
+        # 归档段是压缩存储的，无法做 LIKE 查询；这类关键词（单个汉字）解压最近的归档段逐条匹配
+        archived_keys = archive.scan_keys(db, q, since, until, collapse)
+        archive_query = None
+
+    total = None
+    if with_total:
+        total = hot_query.count() + (archive_query.count() if archive_query is not None else len(archived_keys))
+    if last_key:
+        hot_query = hot_query.filter(tuple_(NewsFlash.publish_time, NewsFlash.id) < last_key)
+        if archive_query is not None:
+            archive_query = archive_query.filter(tuple_(ArchivedNews.publish_time, ArchivedNews.id) < last_key)
+        else:
+            archived_keys = [key for key in archived_keys if key < last_key]
+
+    keys = hot_query.order_by(NewsFlash.publish_time.desc(), NewsFlash.id.desc()).limit(size).all()
+    if archive_query is not None:
+        archived_keys = archive_query.order_by(ArchivedNews.publish_time.desc(), ArchivedNews.id.desc()).limit(size).all()
+    keys = list(heapq.merge(keys, archived_keys[:size], key=tuple, reverse=True))
+    return load_page(db, keys[offset:size], limit, total, preview)
+
+def load_items(db: Session, ids, preview=None):
+    """
+    按 ids 的顺序读取快讯，返回 dict 列表。热表只查询 NEWS_COLUMNS 这几列的元组，不构造 ORM 对象；
+    不在热表中的从归档段读取。preview 不为空时正文截断为前 preview 个字符，并标记 truncated。
+    """
+    if not ids:
+        return []
+    rows = {
+        row[0]: dict(zip(serialize.NEWS_COLUMNS, row))
+        for row in db.execute(
+            select(*[getattr(NewsFlash, name) for name in serialize.NEWS_COLUMNS]).where(NewsFlash.id.in_(ids))
+        )
+    }
+    rows.update(archive.load_values(db, [news_id for news_id in ids if news_id not in rows]))
+    items = [rows[news_id] for news_id in ids if news_id in rows]
+    if preview:
+        for item in items:
+            item["content"], item["truncated"] = serialize.preview(item["content"], preview)
+    return items
+
+def load_page(db: Session, keys, limit, total, preview=None):
+    """keys 为当前页（多取一条用于判断是否还有下一页）的 (publish_time, id)，从热表与归档段读取快讯"""
+    items = load_items(db, [news_id for _, news_id in keys[:limit]], preview)
+
+    next_cursor = None
+    if len(keys) > limit:
+        last_time, last_id = keys[limit - 1]
+        next_cursor = encode_cursor({"t": last_time.isoformat(), "id": last_id})
     
     return {
         "total": total,
-        "items": items
+        "items": items,
+        "next_cursor": next_cursor
     }
 
+# 缓存的响应条数，设为 0 关闭缓存（基准测试中测量查询本身）
+news_cache = ResponseCache(maxsize=int(os.environ.get("KR36_NEWS_CACHE_SIZE", "256")))
+
+# 同步 SQLAlchemy Session 会阻塞事件循环，这里声明为普通函数，由 FastAPI 放到线程池中执行
+@app.get("/api/news")
+def get_news(
+    q: Optional[str] = Query(None, description=f"关键词搜索；单个汉字等过短的关键词在归档中只搜索最近 {archive.SCAN_DAYS} 天"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="翻页游标，传入上一页返回的 next_cursor"),
+    with_total: bool = Query(True, description="是否返回精确总数，游标翻页时可关闭以省去 count 查询"),
+    collapse: bool = Query(False, description="折叠近似重复的快讯，每组只返回一条"),
+    since: Optional[datetime] = Query(None, description="发布时间下限（含）"),
+    until: Optional[datetime] = Query(None, description="发布时间上限（不含）"),
+    symbol: Optional[str] = Query(None, description="只返回提及该证券的快讯，secid（1.600519）或代码（600519、AAPL）"),
+    preview: Optional[int] = Query(None, ge=1, le=2000, description="正文只返回前 N 个字符，完整正文按 id 读取"),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    # 带时区的时间先换算为本地时间，+08:00 与 Z 表示的是不同的时刻
+    since, until = to_local(since), to_local(until)
+    # 缓存命中时只需一次主键查询读取数据版本号，直接返回序列化好的字节
+    version = cache.current_version(db)
+    key = (q, limit, offset, cursor, with_total, collapse, since, until, symbol, preview)
+    entry = news_cache.get(key, version)
+    if entry is None:
+        secids = symbols.resolve(db, symbol) if symbol else None
+        data = query_news(db, q, limit, offset, cursor, with_total, collapse, since, until, secids, preview)
+        entry = news_cache.put(key, version, serialize.dumps(data))
+    body, etag = entry
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cache.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/news/export")
+def export_news(
+    since: Optional[datetime] = Query(None, alias="from", description="发布时间下限（含）"),
+    until: Optional[datetime] = Query(None, alias="to", description="发布时间上限（不含）"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    after_time: Optional[datetime] = Query(None, description="续传：上次导出的最后一条的 publish_time"),
+    after_id: Optional[int] = Query(None, description="续传：上次导出的最后一条的 id"),
+):
+    """按发布时间升序流式导出，内存占用与时间范围大小无关"""
+    if format == "parquet" and export.pq is None:
+        raise HTTPException(status_code=501, detail="parquet 导出需要安装 pyarrow")
+    if (after_time is None) != (after_id is None):
+        raise HTTPException(status_code=400, detail="after_time 与 after_id 需要同时提供")
+    since, until, after_time = to_local(since), to_local(until), to_local(after_time)
+    after = (after_time, after_id) if after_time is not None else None
+    name = "_".join(["kr36_news"] + [value.strftime("%Y%m%d") for value in (since, until) if value])
+    return StreamingResponse(
+        export.stream_export(format, since, until, after),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
+
+@app.get("/api/news/histogram")
+def news_histogram(
+    since: Optional[datetime] = Query(None, description="起始时间，默认为 until 之前 24 小时"),
+    until: Optional[datetime] = Query(None, description="结束时间（不含），默认为当前时间"),
+    bucket: str = Query("hour", pattern="^(hour|day)$"),
+    db: Session = Depends(get_db)
+):
+    """每小时/每天的快讯数量，直接读取预聚合的计数"""
+    since, until = to_local(since), to_local(until)
+    until = until or datetime.now()
+    since = since or until - timedelta(hours=24)
+    step = timedelta(hours=1) if bucket == "hour" else timedelta(days=1)
+    if since >= until or (until - since) / step > 24 * 366:
+        raise HTTPException(status_code=400, detail="时间范围无效或过大")
+    return {"bucket": bucket, "items": trends.histogram(db, since, until, bucket[0])}
+
+@app.get("/api/news/trending")
+def news_trending(
+    hours: int = Query(24, ge=1, le=24 * 90, description="统计窗口（小时），超过小时桶保留期时按天统计"),
+    limit: int = Query(20, ge=1, le=200),
+    by: str = Query("surge", pattern="^(surge|count)$", description="surge 按环比涨幅，count 按出现次数"),
+    until: Optional[datetime] = Query(None, description="窗口结束时间，默认为当前时间"),
+    db: Session = Depends(get_db)
+):
+    """最近一段时间的热词，由预聚合的词摘要合并得到"""
+    until = to_local(until) or datetime.now()
+    version = cache.current_version(db)
+    # 窗口按整点对齐，同一小时内的请求可以共用缓存
+    key = ("trending", hours, limit, by, until.replace(minute=0, second=0, microsecond=0))
+    entry = news_cache.get(key, version)
+    if entry is None:
+        entry = news_cache.put(key, version, serialize.dumps(trends.trending(db, until, hours, limit, by)))
+    return Response(content=entry[0], media_type="application/json")
+
+@app.get("/api/news/stream")
+async def stream_news(
+    request: Request,
+    q: Optional[str] = Query(None, description="只推送包含这些关键词（空格分隔，任一命中）的快讯"),
+):
+    """Server-Sent Events：有新快讯入库时实时推送"""
+    subscriber = hub.subscribe(q.split() if q else None)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # 心跳，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: news\ndata: {message}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# 路径参数路由放在 /api/news/ 下的固定路径之后，避免 export、stream 等被当作 id 解析
+@app.get("/api/news/{news_id}")
+def get_news_item(news_id: int, db: Session = Depends(get_db)):
+    """单条快讯的完整内容，配合列表的 preview 参数使用"""
+    items = load_items(db, [news_id])
+    if not items:
+        raise HTTPException(status_code=404, detail="快讯不存在")
+    return Response(content=serialize.dumps(items[0]), media_type="application/json")
+
+@app.get("/api/fetcher/metrics")
+async def fetcher_metrics():
+    """轮询指标：当前间隔、最近一次耗时与新增条数等；只读进程只返回角色"""
+    if not ingest_lock.held:
+        return {"role": "reader", "pid": os.getpid(), "cache": news_cache.stats(), "subscribers": len(hub.subscribers)}
+    return {"role": "leader", "pid": os.getpid(), "cache": news_cache.stats(), "subscribers": len(hub.subscribers),
+            **poller.metrics()}
+
 @app.get("/", response_class=HTMLResponse)
 async def index():
     static_path = os.path.join(os.path.dirname(__file__), "static", "index.html")
     if os.path.exists(static_path):
-        with open(static_path, "r", encoding="utf-8") as f:
-            return f.read()
+        # FileResponse 在线程池中分块读取文件，不阻塞事件循环
+        return FileResponse(static_path, media_type="text/html")
     return "<h1>36Kr News Service Frontend not found</h1>"
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, BigInteger, DateTime
+from sqlalchemy import Column, Integer, String, Text, BigInteger, DateTime, LargeBinary, ForeignKey, UniqueConstraint, Index
 from database import Base
 import datetime
 
@@ -12,3 +12,92 @@ class NewsFlash(Base):
     publish_time = Column(DateTime, index=True)  # 发布时间
     created_at = Column(DateTime, default=datetime.datetime.now)  # 抓取入库时间
     source_url = Column(String(1000))
+    simhash = Column(BigInteger)  # 近似重复检测指纹（有符号 64 位存储）
+    cluster_id = Column(Integer, index=True)  # 近似重复簇的代表 id，为空表示自己就是代表
+
+class BackfillJob(Base):
+    """历史回填任务，记录翻页游标以便重启后断点续抓"""
+    __tablename__ = "backfill_job_36kr"
+
+    id = Column(Integer, primary_key=True, index=True)
+    target_date = Column(DateTime)  # 回填到该时间为止
+    page_callback = Column(String(1000))  # 下一页的 pageCallback，为空表示从第一页开始
+    status = Column(String(20), default="pending", index=True)  # pending / running / done / failed
+    pages = Column(Integer, default=0)
+    new_count = Column(Integer, default=0)
+    duplicate_count = Column(Integer, default=0)
+    last_publish_time = Column(DateTime)  # 已抓取到的最早发布时间
+    error = Column(String(1000))
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class DataVersion(Base):
+    """数据版本号：每次有新快讯入库时加一，各进程据此判断响应缓存是否失效"""
+    __tablename__ = "data_version_36kr"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+
+class ArchiveDictionary(Base):
+    """归档压缩使用的预置字典，由快讯样本训练得到；段引用字典 id，字典只增不改"""
+    __tablename__ = "archive_dict_36kr"
+
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+class ArchiveSegment(Base):
+    """归档段：同一天发布的快讯整体序列化后压缩存放"""
+    __tablename__ = "archive_segment_36kr"
+
+    id = Column(Integer, primary_key=True)
+    day = Column(String(10), unique=True, index=True)  # 发布日期 YYYY-MM-DD
+    dict_id = Column(Integer, ForeignKey("archive_dict_36kr.id"))
+    row_count = Column(Integer, default=0)
+    raw_size = Column(Integer, default=0)  # 压缩前字节数
+    size = Column(Integer, default=0)  # 压缩后字节数
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class ArchivedNews(Base):
+    """已归档快讯的目录，只保留去重（含近似重复）、翻页与折叠所需的列，正文在归档段中"""
+    __tablename__ = "news_archive_36kr"
+
+    id = Column(Integer, primary_key=True)  # 与归档前 news_flash_36kr 中的 id 相同
+    item_id = Column(BigInteger, unique=True, index=True)
+    publish_time = Column(DateTime, index=True)
+    cluster_id = Column(Integer, index=True)
+    segment_id = Column(Integer, ForeignKey("archive_segment_36kr.id"), index=True)
+    simhash = Column(BigInteger)  # 近似重复指纹，重启后与热表的一起载入去重索引
+
+class TrendBucket(Base):
+    """按小时/按天预聚合的快讯数量与高频词摘要，入库时增量更新"""
+    __tablename__ = "trend_bucket_36kr"
+    __table_args__ = (UniqueConstraint("granularity", "start"),)
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(1), nullable=False)  # h 小时 / d 天
+    start = Column(DateTime, nullable=False)
+    flash_count = Column(Integer, default=0, nullable=False)
+    term_total = Column(Integer, default=0, nullable=False)  # 词频总数，每条快讯中每个词只计一次
+    terms = Column(Text)  # Space-Saving 摘要 JSON {词: [计数, 误差]}，小时桶过期后清空只保留数量
+
+class StockSymbol(Base):
+    """A 股 / 美股证券列表，secid 与前端行情页一致（市场号.代码，如 1.600519、105.AAPL）"""
+    __tablename__ = "stock_symbol_36kr"
+
+    secid = Column(String(32), primary_key=True)
+    code = Column(String(20), index=True)
+    name = Column(String(100))
+    region = Column(String(4))  # CN / US
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class NewsSymbol(Base):
+    """快讯提及的证券，冗余发布时间以便按证券直接在索引上按时间倒序翻页"""
+    __tablename__ = "news_symbol_36kr"
+    __table_args__ = (Index("ix_news_symbol_36kr_lookup", "secid", "publish_time", "news_id"),)
+
+    news_id = Column(Integer, primary_key=True)  # 快讯 id，归档后不变
+    secid = Column(String(32), primary_key=True)
+    publish_time = Column(DateTime)
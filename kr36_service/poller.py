@@ -0,0 +1,94 @@
+import time
+import datetime
+from collections import deque
+from sqlalchemy import select, func
+from apscheduler.triggers.interval import IntervalTrigger
+
+from models import NewsFlash
+from database import ReadSessionLocal
+
+
+class AdaptivePoller:
+    """
+    自适应轮询：以库中最新发布时间作为高水位，定时抓取第一页；
+    有新快讯时缩短轮询间隔，连续无新内容时逐步退避。只有第一页全是新内容（未触及高水位）时才继续翻页。
+    """
+
+    def __init__(self, fetcher, min_interval=15, max_interval=600, initial_interval=60,
+                 speedup=0.5, backoff=1.5, job_id="kr36_poll"):
+        self.fetcher = fetcher
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = initial_interval
+        self.speedup = speedup
+        self.backoff = backoff
+        self.job_id = job_id
+        self.scheduler = None
+        self.polls = 0
+        self.total_new = 0
+        self.watermark = None
+        self.last_poll = None
+        self.history = deque(maxlen=100)  # 最近若干次轮询的明细
+
+    def attach(self, scheduler):
+        self.scheduler = scheduler
+        scheduler.add_job(
+            self.poll, IntervalTrigger(seconds=self.interval),
+            id=self.job_id, max_instances=1, coalesce=True, replace_existing=True,
+        )
+
+    def current_watermark(self):
+        db = ReadSessionLocal()
+        try:
+            return db.execute(select(func.max(NewsFlash.publish_time))).scalar()
+        finally:
+            db.close()
+
+    def poll(self):
+        started = time.perf_counter()
+        error = None
+        new_count = 0
+        try:
+            self.watermark = self.current_watermark()
+            new_count = self.fetcher.fetch_latest(watermark=self.watermark)
+        except Exception as e:
+            error = str(e)
+            print(f"轮询异常: {e}")
+        latency = time.perf_counter() - started
+
+        # 有新内容说明源头活跃，缩短间隔；否则退避
+        if new_count:
+            interval = max(self.min_interval, self.interval * self.speedup)
+        else:
+            interval = min(self.max_interval, self.interval * self.backoff)
+        self.set_interval(interval)
+
+        self.polls += 1
+        self.total_new += new_count
+        self.last_poll = {
+            "time": datetime.datetime.now().isoformat(),
+            "latency": round(latency, 3),
+            "new_items": new_count,
+            "interval": self.interval,
+            "error": error,
+        }
+        self.history.append(self.last_poll)
+        return new_count
+
+    def set_interval(self, interval):
+        interval = round(interval, 1)
+        if interval != self.interval and self.scheduler is not None:
+            self.scheduler.reschedule_job(self.job_id, trigger=IntervalTrigger(seconds=interval))
+        self.interval = interval
+
+    def metrics(self):
+        latencies = [p["latency"] for p in self.history]
+        return {
+            "interval": self.interval,
+            "polls": self.polls,
+            "total_new": self.total_new,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "last_poll": self.last_poll,
+            "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "recent": list(self.history)[-20:],
+        }
@@ -0,0 +1,129 @@
+import re
+from sqlalchemy import text, bindparam, column, DateTime
+from sqlalchemy.orm import Session
+
+# SQLite FTS5 全文索引
+# FTS5 自带的 unicode61 分词器不会切分中文，这里先在 Python 里把中文切成重叠的二元组（bigram），
+# 英文/数字按单词切分，再以空格拼接写入 FTS5 表；查询时把关键词按同样规则切分后做短语匹配。
+FTS_TABLE = "news_flash_fts"
+
+_TOKEN_RE = re.compile(
+    r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)|([0-9A-Za-z\u00c0-\u024f]+)"
+)
+
+
+def tokenize(value):
+    """中文按二元组切分，英文/数字按单词切分（转小写）"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(value or ""):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def build_match(q):
+    """把用户关键词转换为 FTS5 MATCH 表达式，空格分隔的多个词之间为 AND 关系"""
+    phrases = []
+    for term in q.split():
+        tokens = tokenize(term)
+        if not tokens:
+            continue
+        single = [i for i, token in enumerate(tokens) if len(token) == 1 and not token.isascii()]
+        # 单个中文字符只能作为短语末尾的前缀匹配（如 "A股" -> "a 股*"），其余情况交给调用方回退到 LIKE 查询
+        if len(tokens) == 1 and single or any(i != len(tokens) - 1 for i in single):
+            return None
+        phrases.append('"' + " ".join(tokens) + '"' + (" *" if single else ""))
+    return " AND ".join(phrases) or None
+
+
+def is_enabled(db: Session):
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def init_search_index(engine):
+    """创建 FTS5 表，并把尚未建立索引的历史数据补录进去"""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, content, tokenize='unicode61')"
+        ))
+        rows = conn.execute(text(
+            f"SELECT id, title, content FROM news_flash_36kr "
+            f"WHERE id NOT IN (SELECT rowid FROM {FTS_TABLE})"
+        )).all()
+        _insert(conn, rows)
+    if rows:
+        print(f"全文索引补录 {len(rows)} 条数据")
+
+
+def index_rows(db: Session, rows):
+    """入库时增量更新索引，rows 为 (id, title, content)，与数据写入在同一事务中"""
+    if rows and is_enabled(db):
+        _insert(db, rows)
+
+
+def _insert(conn, rows):
+    if not rows:
+        return
+    conn.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (:id, :title, :content)"),
+        [
+            {"id": row[0], "title": " ".join(tokenize(row[1])), "content": " ".join(tokenize(row[2]))}
+            for row in rows
+        ],
+    )
+
+
+def search_ids(db: Session, match, limit, offset, with_total=True, heads_only=False, since=None, until=None):
+    """
+    按相关度（bm25，标题权重更高）排序返回 (总数, 当前页 id 列表)，with_total 为 False 时总数为 None。
+    heads_only 为 True 时只返回近似重复簇的代表；since/until 按发布时间过滤。
+    已归档的快讯仍保留在全文索引中，返回的 id 可能在热表也可能在归档目录中。
+    """
+    where = f"{FTS_TABLE} MATCH :match"
+    params = {"match": match}
+    if heads_only:
+        for table in ("news_flash_36kr", "news_archive_36kr"):
+            where += (
+                f" AND NOT EXISTS (SELECT 1 FROM {table} n "
+                f"WHERE n.id = {FTS_TABLE}.rowid AND n.cluster_id IS NOT NULL)"
+            )
+    conditions = []
+    if since:
+        conditions.append("publish_time >= :since")
+        params["since"] = since
+    if until:
+        conditions.append("publish_time < :until")
+        params["until"] = until
+    if conditions:
+        condition = " AND ".join(conditions)
+        where += (
+            f" AND rowid IN (SELECT id FROM news_flash_36kr WHERE {condition} "
+            f"UNION ALL SELECT id FROM news_archive_36kr WHERE {condition})"
+        )
+    bind_types = [bindparam(name, type_=DateTime) for name in ("since", "until") if name in params]
+    total = None
+    if with_total:
+        total = db.execute(
+            text(f"SELECT count(*) FROM {FTS_TABLE} WHERE {where}").bindparams(*bind_types),
+            params,
+        ).scalar()
+    ids = db.execute(
+        text(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {where} "
+            f"ORDER BY bm25({FTS_TABLE}, 5.0, 1.0), rowid DESC LIMIT :limit OFFSET :offset"
+        ).bindparams(*bind_types),
+        {**params, "limit": limit, "offset": offset},
+    ).scalars().all()
+    return total, ids
+
+
+def matching_ids(match):
+    """命中 match 的快讯 id 子查询，用于和其他筛选条件组合"""
+    return text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match").bindparams(match=match).columns(column("rowid"))
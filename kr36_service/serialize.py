@@ -0,0 +1,35 @@
+"""
+接口响应的 JSON 序列化
+
+快讯列表直接由列元组构造 dict 后序列化为字节，不经过 ORM 对象和 jsonable_encoder。
+安装了 orjson 时用 orjson（datetime 原生输出为 ISO 8601，与 isoformat() 一致），否则退回标准库 json。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson 是可选的加速依赖
+    orjson = None
+
+# 返回给前端的快讯字段；simhash 只用于入库去重，不返回
+NEWS_COLUMNS = ("id", "item_id", "title", "content", "publish_time", "created_at", "source_url", "cluster_id")
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def dumps(data):
+    """序列化为 UTF-8 字节，中文不转义"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def preview(text, length):
+    """正文截断为前 length 个字符，返回 (截断后的正文, 是否截断)"""
+    if text is None or len(text) <= length:
+        return text, False
+    return text[:length], True
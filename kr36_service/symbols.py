@@ -0,0 +1,306 @@
+"""
+证券实体标注
+
+用 A 股 / 美股的证券简称与代码构建 Aho-Corasick 自动机，入库时一次扫描标出快讯提及的全部证券，
+写入 news_symbol_36kr，/api/news?symbol= 直接按该表的索引翻页。
+证券列表来自东方财富行情列表接口（与 gupiao_new.html、us.html 相同），也可以从本地 JSON 文件导入。
+
+用法: python kr36_service/symbols.py [--file symbols.json] [--retag]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import re
+import threading
+import time
+from collections import deque
+import httpx
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import Session
+
+from models import StockSymbol, NewsSymbol
+from database import ReadSessionLocal, init_db
+from writer import write_queue
+import cache
+
+CLIST_URL = "https://push2.eastmoney.com/api/qt/clist/get"
+# 与前端行情页相同的市场筛选条件
+MARKETS = {
+    "CN": "m:0+t:6,m:0+t:80,m:1+t:2,m:1+t:23",
+    "US": "m:105,m:106,m:107",
+}
+CLIST_PAGE_SIZE = 100
+
+# 英文代码/缩写只在前后都不是字母数字时才算命中；下面这些常见缩写恰好也是美股代码，不做标注
+ASCII_BLOCKLIST = {
+    "AI", "IPO", "CEO", "CFO", "CTO", "COO", "ETF", "GDP", "CPI", "PPI", "PMI", "GPU", "CPU", "APP", "API",
+    "USD", "RMB", "IT", "PC", "TV", "EV", "AR", "VR", "IP", "OK", "LLM", "AGI", "ESG", "SAAS", "B2B", "ONE",
+    "NEW", "ALL", "ARE", "FOR", "NOW", "CAR", "BIG", "LOW", "HIGH", "TOP", "BEST", "GO", "ON", "SO", "AM",
+}
+_ASCII_WORD = re.compile(r"[0-9A-Za-z]")
+_NAME_PREFIX = re.compile(r"^\*?ST")
+_NAME_SUFFIX = re.compile(r"-[A-Z]+$")
+
+
+class Automaton:
+    """
+    Aho-Corasick 多模式匹配：所有模式串建成一棵字典树并补上失败指针，
+    对文本只扫描一遍即可找出全部命中，耗时与文本长度和命中数成正比，与模式串数量无关。
+    """
+
+    def __init__(self, patterns):
+        """patterns: {模式串: 标注值集合}"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # 每个节点上结束的模式 (长度, 标注值集合)，包含经失败指针可达的
+        for pattern, values in patterns.items():
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((len(pattern), frozenset(values)))
+
+        # 按层遍历补失败指针
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.output[self.fail[child]]:
+                    self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def find(self, text):
+        """返回全部命中 (起始位置, 结束位置, 标注值集合)"""
+        matches = []
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, values in output[node]:
+                matches.append((i + 1 - length, i + 1, values))
+        return matches
+
+
+def _boundary_ok(text, start, end):
+    """英文/数字模式要求整词命中，避免 600519 命中 16005190、AAPL 命中 AAPLX"""
+    if _ASCII_WORD.match(text[start]) and start > 0 and _ASCII_WORD.match(text[start - 1]):
+        return False
+    if _ASCII_WORD.match(text[end - 1]) and end < len(text) and _ASCII_WORD.match(text[end]):
+        return False
+    return True
+
+
+def build_patterns(rows):
+    """rows: (secid, code, name, region)，返回 {模式串: secid 集合}"""
+    patterns = {}
+    for secid, code, name, region in rows:
+        keys = set()
+        if code and (code.upper() not in ASCII_BLOCKLIST):
+            # 单字母美股代码太容易误伤，只按名称匹配
+            if region != "US" or len(code) >= 2:
+                keys.add(code)
+        if name:
+            name = name.strip()
+            keys.add(name)
+            # *ST、ST 前缀和 -U、-W 等后缀在正文里通常省略
+            stripped = _NAME_SUFFIX.sub("", _NAME_PREFIX.sub("", name)).strip()
+            if stripped:
+                keys.add(stripped)
+        for key in keys:
+            if len(key) >= 2:
+                patterns.setdefault(key, set()).add(secid)
+    return patterns
+
+
+class SymbolTagger:
+    """抓取主进程写线程中使用的标注器；证券列表变化时（行数或更新时间变化）自动重建自动机"""
+
+    def __init__(self):
+        self.automaton = None
+        self.signature = None
+        self.lock = threading.Lock()
+        self.build_seconds = None
+
+    def _signature(self, db: Session):
+        return tuple(db.execute(select(func.count(StockSymbol.secid), func.max(StockSymbol.updated_at))).one())
+
+    def ensure_current(self, db: Session):
+        signature = self._signature(db)
+        if signature == self.signature:
+            return self.automaton
+        with self.lock:
+            if signature != self.signature:
+                started = time.perf_counter()
+                rows = db.execute(
+                    select(StockSymbol.secid, StockSymbol.code, StockSymbol.name, StockSymbol.region)
+                ).all()
+                self.automaton = Automaton(build_patterns(rows)) if rows else None
+                self.signature = signature
+                self.build_seconds = time.perf_counter() - started
+                if rows:
+                    print(f"证券自动机重建: {len(rows)} 只证券, {len(self.automaton)} 个节点, "
+                          f"耗时 {self.build_seconds:.2f}s")
+        return self.automaton
+
+    def symbols_in(self, automaton, text):
+        """文本中提及的 secid；重叠的命中按最左最长只取一个，避免长简称中包含的短简称被重复标注"""
+        if not text or automaton is None:
+            return set()
+        matches = sorted(
+            (m for m in automaton.find(text) if _boundary_ok(text, m[0], m[1])),
+            key=lambda m: (m[0], -m[1]),
+        )
+        found = set()
+        covered = 0
+        for start, end, values in matches:
+            if start >= covered:
+                found |= values
+                covered = end
+        return found
+
+    def tag(self, db: Session, rows):
+        """在入库事务中调用，rows 为 (id, title, content, publish_time)，返回写入的关联数"""
+        automaton = self.ensure_current(db)
+        if automaton is None:
+            return 0
+        links = [
+            {"news_id": news_id, "secid": secid, "publish_time": publish_time}
+            for news_id, title, content, publish_time in rows
+            for secid in self.symbols_in(automaton, f"{title or ''}\n{content or ''}")
+        ]
+        if links:
+            db.execute(insert(NewsSymbol).prefix_with("OR IGNORE"), links)
+        return len(links)
+
+
+tagger = SymbolTagger()
+
+
+def resolve(db: Session, symbol):
+    """把 secid（1.600519）或代码（600519、AAPL）解析为 secid 列表"""
+    symbol = symbol.strip()
+    if "." in symbol:
+        return [symbol]
+    return db.execute(select(StockSymbol.secid).where(StockSymbol.code == symbol.upper())).scalars().all()
+
+
+async def fetch_symbols():
+    """从行情列表接口分页拉取全部证券，返回 [(secid, code, name, region)]"""
+    semaphore = asyncio.Semaphore(8)
+
+    async def page(client, region, number):
+        async with semaphore:
+            response = await client.get(CLIST_URL, params={
+                "pn": number, "pz": CLIST_PAGE_SIZE, "po": 1, "np": 1, "fltt": 2, "invt": 2,
+                "fid": "f3", "fs": MARKETS[region], "fields": "f12,f13,f14",
+            })
+            response.raise_for_status()
+            return (response.json().get("data") or {})
+
+    rows = []
+    async with httpx.AsyncClient(timeout=10, headers={"user-agent": "Mozilla/5.0"}) as client:
+        for region in MARKETS:
+            first = await page(client, region, 1)
+            pages = -(-(first.get("total") or 0) // CLIST_PAGE_SIZE)
+            results = [first] + await asyncio.gather(*[page(client, region, n) for n in range(2, pages + 1)])
+            for data in results:
+                diff = data.get("diff") or []
+                for item in (diff.values() if isinstance(diff, dict) else diff):
+                    if item.get("f12") and item.get("f14"):
+                        rows.append((f"{item['f13']}.{item['f12']}", str(item["f12"]), item["f14"], region))
+    return rows
+
+
+def save_symbols(db: Session, rows):
+    """以 rows 整体替换证券列表，只改动有变化的行；返回 (新增, 删除, 改名) 数"""
+    existing = {secid: (code, name, region) for secid, code, name, region in db.execute(
+        select(StockSymbol.secid, StockSymbol.code, StockSymbol.name, StockSymbol.region)
+    )}
+    incoming = {secid: (code, name, region) for secid, code, name, region in rows}
+    added = [secid for secid in incoming if secid not in existing]
+    removed = [secid for secid in existing if secid not in incoming]
+    changed = [secid for secid in incoming if secid in existing and existing[secid] != incoming[secid]]
+    if removed:
+        db.execute(delete(StockSymbol).where(StockSymbol.secid.in_(removed)))
+    for secid in changed:
+        code, name, region = incoming[secid]
+        db.merge(StockSymbol(secid=secid, code=code, name=name, region=region, updated_at=datetime.datetime.now()))
+    if added:
+        db.execute(insert(StockSymbol), [
+            {"secid": secid, "code": incoming[secid][0], "name": incoming[secid][1], "region": incoming[secid][2]}
+            for secid in added
+        ])
+    if added or removed or changed:
+        # symbol 参数的解析结果可能变化
+        cache.bump_version(db)
+    return len(added), len(removed), len(changed)
+
+
+def retag_all(batch_size=500):
+    """证券列表变化后对全部历史快讯（含归档）重新标注，每批一个事务经写队列执行"""
+    import export
+
+    db = ReadSessionLocal()
+    try:
+        rows = export.iter_rows(db)
+        indexes = [export.COLUMNS.index(name) for name in ("id", "title", "content", "publish_time")]
+        total = 0
+        while True:
+            batch = [tuple(row[i] for i in indexes) for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+
+            def retag(write_db, batch=batch):
+                write_db.execute(delete(NewsSymbol).where(NewsSymbol.news_id.in_([row[0] for row in batch])))
+                # 与重新标注一起提交数据版本号，缓存的 ?symbol= 响应随之失效
+                cache.bump_version(write_db)
+                return tagger.tag(write_db, batch)
+
+            total += write_queue.submit(retag).result()
+        return total
+    finally:
+        db.close()
+
+
+def refresh(rows=None):
+    """更新证券列表（默认从行情接口拉取），有变化时重新标注历史快讯"""
+    if rows is None:
+        rows = asyncio.run(fetch_symbols())
+    if not rows:
+        return
+    added, removed, changed = write_queue.submit(lambda db: save_symbols(db, rows)).result()
+    print(f"证券列表更新: {len(rows)} 只, 新增 {added}, 删除 {removed}, 变更 {changed}")
+    if added or removed or changed:
+        print(f"重新标注历史快讯: {retag_all()} 条关联")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="更新证券列表并标注快讯")
+    parser.add_argument("--file", help="从 JSON 文件导入证券列表：[[secid, code, name, region], ...]")
+    parser.add_argument("--retag", action="store_true", help="列表无变化时也重新标注全部快讯")
+    args = parser.parse_args()
+
+    init_db()
+    rows = None
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            rows = [tuple(row) for row in json.load(f)]
+    refresh(rows)
+    if args.retag:
+        print(f"重新标注历史快讯: {retag_all()} 条关联")
@@ -0,0 +1,270 @@
+"""
+热词与发稿量的增量聚合
+
+每条快讯入库时计入所属的小时桶和天桶：桶内记录快讯数量，以及标题+正文中出现的词的 Space-Saving 摘要
+（最多 SUMMARY_SIZE 个计数器，内存与词表大小无关）。小时桶的词摘要只保留 HOURLY_TERM_DAYS 天，
+更长的时间窗口用天桶。查询时只需读取窗口内的桶并合并摘要，耗时与桶数成正比，与快讯条数无关。
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+from collections import Counter, defaultdict
+import jieba
+from sqlalchemy import select, update, func, delete
+from sqlalchemy.orm import Session
+
+from models import TrendBucket, NewsFlash, ArchivedNews
+from database import SessionLocal, ReadSessionLocal
+from writer import write_queue
+
+SUMMARY_SIZE = 1000
+HOURLY_TERM_DAYS = 7
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+
+# 来源名称加入 jieba 词典，整体切出后由 STOPWORDS 过滤
+SOURCES = ("36氪", "财联社", "新浪财经", "界面新闻", "证券时报")
+# 模板用语与来源名称
+STOPWORDS = {
+    "获悉", "公司", "有限公司", "股份", "公告", "发布公告", "表示", "发布", "显示", "相关", "目前", "通过", "其中",
+    "同时", "截至", "进行", "方面", "可能", "存在", "以及", "以来", "部分", "包括", "根据", "情况", "主要", "近日",
+    "近期", "时间", "进一步", "属于", "新浪", "财经", "新闻", "界面", "时报", "记者", "消息", "宣布", "此前",
+    "此次", "已经", "我们", "他们", "这一", *SOURCES,
+}
+
+jieba.setLogLevel(logging.WARNING)
+for _source in SOURCES:
+    jieba.add_word(_source)
+
+
+def extract_terms(text):
+    """一条快讯中出现的词（去重），用 jieba 分词"""
+    words = jieba.lcut(text)
+    return {
+        word for word in (w.strip().lower() for w in words)
+        if len(word) >= 2 and not word.isdigit() and word not in STOPWORDS
+    }
+
+
+class SpaceSaving:
+    """
+    Space-Saving 高频项摘要：counters 为 {词: [计数, 误差]}，计数是真实值的上界，计数 - 误差是下界。
+    两个摘要可以直接合并：未被某一方记录的词，其在该方的真实计数不超过该方的最小计数（摘要已满时）。
+    """
+
+    def __init__(self, counters=None, capacity=SUMMARY_SIZE):
+        self.counters = counters or {}
+        self.capacity = capacity
+
+    @classmethod
+    def loads(cls, data, capacity=SUMMARY_SIZE):
+        return cls(json.loads(data) if data else {}, capacity)
+
+    def dumps(self):
+        return json.dumps(self.counters, ensure_ascii=False, separators=(",", ":"))
+
+    def floor(self):
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    @classmethod
+    def combine(cls, summaries, capacity=SUMMARY_SIZE):
+        """
+        一次合并多个摘要，耗时与各摘要的计数器总数成正比：
+        每个词的计数 = 各摘要最小计数之和 + 在记录了它的摘要中超出该摘要最小计数的部分，误差同理。
+        """
+        base = 0
+        deltas = defaultdict(lambda: [0, 0])
+        for summary in summaries:
+            floor = summary.floor()
+            base += floor
+            for term, (count, error) in summary.counters.items():
+                delta = deltas[term]
+                delta[0] += count - floor
+                delta[1] += error - floor
+        counters = {term: [base + count, base + error] for term, (count, error) in deltas.items()}
+        if len(counters) > capacity:
+            counters = dict(sorted(counters.items(), key=lambda kv: kv[1][0], reverse=True)[:capacity])
+        return cls(counters, capacity)
+
+
+def _hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _term_cutoff():
+    """早于该时间的小时桶不再保留词摘要"""
+    return _day(datetime.datetime.now()) - datetime.timedelta(days=HOURLY_TERM_DAYS)
+
+
+def record(db: Session, rows):
+    """在入库事务中调用，rows 为 (publish_time, title, content)，把新快讯计入所属的小时桶与天桶"""
+    groups = defaultdict(lambda: [0, Counter()])
+    for publish_time, title, content in rows:
+        if publish_time is None:
+            continue
+        terms = extract_terms(f"{title or ''} {content or ''}")
+        for key in (("h", _hour(publish_time)), ("d", _day(publish_time))):
+            group = groups[key]
+            group[0] += 1
+            group[1].update(terms)
+
+    cutoff = _term_cutoff()
+    for (granularity, start), (count, terms) in groups.items():
+        bucket = db.execute(
+            select(TrendBucket).where(TrendBucket.granularity == granularity, TrendBucket.start == start)
+        ).scalar_one_or_none()
+        if bucket is None:
+            bucket = TrendBucket(granularity=granularity, start=start, flash_count=0, term_total=0)
+            db.add(bucket)
+        bucket.flash_count += count
+        bucket.term_total += sum(terms.values())
+        if granularity == "h" and start < cutoff:
+            continue
+        # 本批的精确计数看作一个不限容量的摘要
+        batch = SpaceSaving({term: [n, 0] for term, n in terms.items()}, capacity=math.inf)
+        bucket.terms = SpaceSaving.combine([SpaceSaving.loads(bucket.terms), batch]).dumps()
+    # 写队列会把多次入库合并到同一事务，先 flush 让后续的查询能看到新建的桶
+    db.flush()
+
+
+def prune(db: Session):
+    """清空过期小时桶的词摘要，只保留数量；在写线程中调用"""
+    return db.execute(
+        update(TrendBucket)
+        .where(TrendBucket.granularity == "h", TrendBucket.start < _term_cutoff(), TrendBucket.terms.is_not(None))
+        .values(terms=None)
+    ).rowcount
+
+
+def run_prune():
+    return write_queue.submit(prune).result()
+
+
+def init_trends():
+    """聚合表为空而库中已有快讯时（首次升级），按发布时间顺序补算一遍"""
+    import export
+
+    db = SessionLocal()
+    read_db = ReadSessionLocal()
+    try:
+        if db.execute(select(TrendBucket.id).limit(1)).first() is not None:
+            return
+        if (db.execute(select(func.count(NewsFlash.id))).scalar()
+                + db.execute(select(func.count(ArchivedNews.id))).scalar()) == 0:
+            return
+        total = 0
+        batch = []
+        time_index, title_index, content_index = (export.COLUMNS.index(name) for name in ("publish_time", "title", "content"))
+        for row in export.iter_rows(read_db):
+            batch.append((row[time_index], row[title_index], row[content_index]))
+            if len(batch) >= export.BATCH_SIZE:
+                record(db, batch)
+                total += len(batch)
+                batch = []
+        record(db, batch)
+        total += len(batch)
+        prune(db)
+        db.commit()
+        print(f"热词聚合补算 {total} 条数据")
+    finally:
+        read_db.close()
+        db.close()
+
+
+def _buckets(db: Session, granularity, start, end, columns):
+    return db.execute(
+        select(*columns)
+        .where(TrendBucket.granularity == granularity, TrendBucket.start >= start, TrendBucket.start < end)
+        .order_by(TrendBucket.start)
+    ).all()
+
+
+def histogram(db: Session, since, until, granularity="h"):
+    """[since, until) 内每个小时/天的快讯数量，没有快讯的桶补 0"""
+    floor, step = (_hour, HOUR) if granularity == "h" else (_day, DAY)
+    start = floor(since)
+    counts = dict(_buckets(db, granularity, start, until, (TrendBucket.start, TrendBucket.flash_count)))
+    result = []
+    while start < until:
+        result.append({"start": start.isoformat(), "count": counts.get(start, 0)})
+        start += step
+    return result
+
+
+def _window_summary(db: Session, granularity, start, end):
+    rows = _buckets(db, granularity, start, end, (TrendBucket.flash_count, TrendBucket.terms))
+    flashes = sum(flash_count for flash_count, _ in rows)
+    return flashes, SpaceSaving.combine([SpaceSaving.loads(terms) for _, terms in rows if terms])
+
+
+def trending(db: Session, until, hours=24, limit=20, by="surge"):
+    """
+    截至 until 所在小时（含）的 hours 个小时内的热词。by=count 按出现次数排序；
+    by=surge 与前一个等长窗口比较，按 (本期 - 预期) / sqrt(预期 + 1) 排序，预期按两期快讯数量之比折算。
+    """
+    end = _hour(until) + HOUR
+    start = end - datetime.timedelta(hours=hours)
+    granularity = "h"
+    if start - datetime.timedelta(hours=hours) < _term_cutoff():
+        # 超出小时桶词摘要的保留期，改用天桶
+        granularity = "d"
+        end = _day(end - HOUR) + DAY
+        start = end - datetime.timedelta(days=max(1, math.ceil(hours / 24)))
+    window = end - start
+    flashes, current = _window_summary(db, granularity, start, end)
+    previous_flashes, previous = _window_summary(db, granularity, start - window, start)
+
+    scale = flashes / previous_flashes if previous_flashes else 1
+    previous_floor = previous.floor()
+    terms = []
+    for term, (count, error) in current.counters.items():
+        previous_count = previous.counters.get(term, (previous_floor,))[0]
+        expected = previous_count * scale
+        terms.append({
+            "term": term,
+            "count": count,
+            "min_count": count - error,
+            "previous": previous_count,
+            "score": round((count - expected) / math.sqrt(expected + 1), 2),
+        })
+    key = "count" if by == "count" else "score"
+    terms.sort(key=lambda item: (item[key], item["count"]), reverse=True)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "granularity": granularity,
+        "flashes": flashes,
+        "previous_flashes": previous_flashes,
+        "terms": terms[:limit],
+    }
+
+
+def rebuild_trends():
+    """清空聚合表后按当前分词重新补算（分词方式或停用词变化后使用）"""
+    db = SessionLocal()
+    try:
+        db.execute(delete(TrendBucket))
+        db.commit()
+    finally:
+        db.close()
+    init_trends()
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="热词与发稿量聚合")
+    parser.add_argument("--rebuild", action="store_true", help="清空聚合表并重新补算")
+    args = parser.parse_args()
+
+    init_db()
+    if args.rebuild:
+        rebuild_trends()
@@ -0,0 +1,92 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from database import SessionLocal
+
+
+class WriteQueue:
+    """
+    单写线程：所有入库操作排队交给同一个线程执行，队列中积压的多个操作合并为一次提交，
+    避免多个抓取线程争抢 SQLite 写锁。操作是 fn(db) 形式的函数，不要自行 commit。
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_batch=32):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.tasks = 0
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self.queue.put((fn, future))
+        self._ensure_started()
+        return future
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="kr36-writer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # 已被调用方取消（如请求断开时 asyncio 取消了 wrap_future）的操作不再执行；
+            # 其余的标记为执行中，之后不能再被取消，set_result 不会因状态冲突而失败
+            batch = [task for task in batch if task[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._execute(batch)
+            except Exception as e:
+                # 写线程不能退出，否则之后提交的操作永远得不到结果
+                print(f"写队列执行异常: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _execute(self, batch):
+        db = self.session_factory()
+        try:
+            results = [fn(db) for fn, _ in batch]
+            db.commit()
+        except Exception:
+            db.rollback()
+            db.close()
+            # 整批失败时逐个重试，只让出错的操作返回异常
+            for task in batch:
+                self._execute_one(task)
+            return
+        db.close()
+        self.batches += 1
+        self.tasks += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _execute_one(self, task):
+        fn, future = task
+        db = self.session_factory()
+        try:
+            result = fn(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            future.set_exception(e)
+        else:
+            self.batches += 1
+            self.tasks += 1
+            future.set_result(result)
+        finally:
+            db.close()
+
+
+write_queue = WriteQueue()
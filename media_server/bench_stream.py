@@ -0,0 +1,164 @@
+"""
+视频流式发送基准测试
+
+生成一个测试视频文件，在 uvicorn 子进程中启动 media_server，模拟 N 个不断拖动进度条的客户端：
+每次随机跳到一个位置，多数请求读取 bytes=o-(o+R-1) 的固定范围，其余请求 bytes=o- 读取 R 字节后主动断开
+（浏览器拖动时会中断上一个请求）。分别测试旧写法（StreamingResponse + 1MB 生成器）与新的 RangeFileResponse，
+统计总吞吐与服务进程每发送 1 Gbit 消耗的 CPU 秒数（读取 /proc，仅 Linux）。
+用法: python media_server/bench_stream.py --clients 20 --duration 10
+依赖: httpx
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def serve(directory, port):
+    """子进程：启动 media_server，并额外挂载旧写法的 /legacy/ 路由作为对照"""
+    sys.path.insert(0, HERE)
+    from pathlib import Path
+    from typing import Optional
+    from fastapi import Header
+    from fastapi.responses import StreamingResponse
+    import uvicorn
+    import main
+
+    main.VIDEO_DIR = Path(directory)
+
+    @main.app.get("/legacy/{video_name:path}")
+    async def legacy_stream(video_name: str, range: Optional[str] = Header(None)):
+        video_path = main.get_video_path(video_name)
+        file_size = video_path.stat().st_size
+        start, end = 0, file_size - 1
+        status_code = 200
+        if range:
+            first, _, last = range.replace("bytes=", "").partition("-")
+            start = int(first)
+            if last:
+                end = int(last)
+            status_code = 206
+        content_length = end - start + 1
+
+        def generate_chunks(chunk_size=1024 * 1024):
+            with open(video_path, "rb") as video:
+                video.seek(start)
+                remaining = content_length
+                while remaining > 0:
+                    data = video.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    yield data
+                    remaining -= len(data)
+
+        headers = {
+            "Content-Range": f"bytes {start}-{end}/{file_size}",
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(content_length),
+            "Content-Type": "video/mp4",
+        }
+        return StreamingResponse(generate_chunks(), status_code=status_code, headers=headers)
+
+    # 不启动目录监听（lifespan），只测发送路径
+    uvicorn.run(main.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning", access_log=False)
+
+
+def process_cpu_seconds(pid):
+    """进程累计的用户态 + 内核态 CPU 秒数；没有 /proc 时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def run_clients(base_url, prefix, size, clients, duration, range_bytes, abort_ratio, seed):
+    received = 0
+    requests = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(index):
+        nonlocal received, requests
+        rng = random.Random(seed + index)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+            while time.perf_counter() < deadline:
+                offset = rng.randrange(0, size - range_bytes)
+                abort = rng.random() < abort_ratio
+                header = f"bytes={offset}-" if abort else f"bytes={offset}-{offset + range_bytes - 1}"
+                got = 0
+                async with http.stream("GET", f"{prefix}/sample.mp4", headers={"Range": header}) as response:
+                    assert response.status_code == 206, response.status_code
+                    async for chunk in response.aiter_raw():
+                        got += len(chunk)
+                        if got >= range_bytes:
+                            break
+                received += got
+                requests += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(clients)])
+    return received, requests, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频流式发送基准测试")
+    parser.add_argument("--size-mb", type=int, default=512, help="测试文件大小")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="每种写法的测试时长（秒）")
+    parser.add_argument("--range-mb", type=float, default=4, help="每次请求读取的数据量")
+    parser.add_argument("--abort-ratio", type=float, default=0.3, help="读取后主动断开的开放范围请求比例")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    size = args.size_mb * 1024 * 1024
+    range_bytes = int(args.range_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        block = os.urandom(1024 * 1024)
+        with open(os.path.join(tmp, "sample.mp4"), "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(block)
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", tmp, "--port", str(args.port)])
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            for _ in range(100):
+                try:
+                    httpx.head(f"{base_url}/video/sample.mp4", timeout=1)
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            print(f"{args.clients} 个客户端, 文件 {args.size_mb}MB, 每次读取 {args.range_mb}MB, "
+                  f"{args.abort_ratio:.0%} 的请求读取后断开")
+            for name, prefix in (("legacy", "/legacy"), ("range", "/video")):
+                cpu_before = process_cpu_seconds(server.pid)
+                received, requests, elapsed = asyncio.run(run_clients(
+                    base_url, prefix, size, args.clients, args.duration, range_bytes, args.abort_ratio, args.seed))
+                cpu_after = process_cpu_seconds(server.pid)
+                gbits = received * 8 / 1e9
+                line = (f"{name:<7} {requests:5d} 次请求  {received / elapsed / 1024 / 1024:8.1f} MB/s  "
+                        f"({gbits / elapsed:.2f} Gbit/s)")
+                if cpu_before is not None:
+                    cpu = cpu_after - cpu_before
+                    line += f"  服务进程 CPU {cpu:.2f}s, {cpu / gbits:.3f} CPU 秒/Gbit"
+                print(line)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+HTTP 条件请求（RFC 7232）与 If-Range（RFC 7233）
+
+视频文件的校验器由 (size, mtime_ns, inode) 生成，与视频库索引记录的字段相同：
+文件被覆盖、替换或改名后换了一个同名文件，ETag 都会变化。
+"""
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def file_etag(size, mtime_ns, ino):
+    """强校验器：If-Range 要求强比较，所以不加 W/"""
+    return f'"{size:x}-{mtime_ns:x}-{ino or 0:x}"'
+
+
+def http_date(mtime_ns):
+    return formatdate(mtime_ns / 1e9, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 的弱比较：忽略 W/ 前缀"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified(if_none_match, if_modified_since, etag, mtime_ns=None):
+    """
+    GET/HEAD 是否应返回 304。有 If-None-Match 时只看 ETag（忽略 If-Modified-Since）；
+    否则比较 If-Modified-Since 与 Last-Modified（HTTP 日期精确到秒）。
+    """
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if if_modified_since and mtime_ns is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and mtime_ns // 10 ** 9 <= since
+    return False
+
+
+def if_range_matches(if_range, etag, mtime_ns):
+    """
+    If-Range 是否仍指向当前文件；不匹配时应忽略 Range 返回完整文件，避免续传时拼接新旧两个版本的字节。
+    ETag 形式按强比较（弱标签永不匹配）；日期形式要求与 Last-Modified 完全相同，
+    且文件修改时间距现在超过 1 秒（同一秒内的再次修改无法从日期上区分）。
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    since = parse_http_date(if_range)
+    return (since is not None and mtime_ns // 10 ** 9 == since
+            and time.time() - mtime_ns / 1e9 > 1)
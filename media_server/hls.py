@@ -0,0 +1,361 @@
+"""
+按需 HLS
+
+浏览器不能直接播放的 MKV / AVI，以及在移动网络上拖不动原始码率的大文件，改用 HLS 播放：
+播放列表按视频库索引中的时长直接生成（固定 SEGMENT_SECONDS 秒一段），分段在被请求时由 ffmpeg 生成。
+
+  - 一个生成任务是一个 ffmpeg 进程，从某个分段的起点开始（-ss 跳转 + -copyts 保留原时间戳）连续输出后续分段；
+    视频编码为 H.264 且最大关键帧间隔（探测时从容器索引中得到）不超过一个分段时直接复制（只换封装），
+    否则转码并在分段边界强制关键帧；音频不是 AAC / MP3 时转为 AAC；
+    另有 480p 低码率档，主播放列表中两档都列出，由播放器按带宽选择。
+  - 任务领先播放位置 PREFETCH_SEGMENTS 段后暂停（SIGSTOP），播放器继续请求时恢复，闲置超过 IDLE_SECONDS 结束；
+  - 同一视频档位可以同时有多个任务（多人观看不同位置）：请求由进度覆盖该分段的任务负责，多人看同一处时共用；
+    没有这样的任务（首次播放、拖动到较远处、已生成的分段被 LRU 删除）时从所需分段另起任务，不结束别人正在用的任务，
+    被拖走而不再请求的任务很快暂停，之后被新任务取代或闲置结束；
+  - 同时存在的任务不超过 MAX_JOBS 个，满了时结束最久没有请求的暂停或闲置任务，否则等待；
+  - 生成好的分段移入磁盘缓存（按视频路径、大小、mtime 与档位寻址），总大小超过 CACHE_BYTES 时按 LRU 删除。
+复制编码时分段只能在关键帧处切开，实际长度最多比标称长度多一个关键帧间隔，
+#EXT-X-TARGETDURATION 按此上限给出（RFC 8216 要求不小于任何分段的时长）；
+播放器按分段内的时间戳（与原视频一致）拼接，不受影响。
+"""
+import hashlib
+import itertools
+import math
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from thumbs import FFMPEG
+
+HLS_DIR = os.environ.get("MEDIA_HLS_DIR", "./hls_cache")
+CACHE_BYTES = int(os.environ.get("MEDIA_HLS_CACHE_MB", "4096")) * 1024 * 1024
+SEGMENT_SECONDS = 6
+MAX_JOBS = 2
+PREFETCH_SEGMENTS = 5
+# 请求的分段在任务当前进度之后不超过该段数时等待该任务，不另起任务
+REUSE_GAP = 3
+IDLE_SECONDS = 30
+# 并发已满时，超过该秒数没有请求的任务可以被新任务取代
+EVICT_SECONDS = 5
+POLL_SECONDS = 0.2
+
+PROFILES = {
+    "src": {"height": None, "video_bitrate": None, "audio_bitrate": 160000},
+    "low": {"height": 480, "video_bitrate": 1000000, "audio_bitrate": 96000},
+}
+COPY_VIDEO = {"h264"}
+COPY_AUDIO = {"aac", "mp3"}
+
+
+def copies_video(record, profile):
+    """
+    是否直接复制视频编码。复制时只能在关键帧处切分，关键帧间隔超过分段长度时分段会越切越偏离标称位置，
+    间隔未知时同样无法保证，这两种情况都转码
+    """
+    interval = record.get("keyframe_interval")
+    return (profile == "src" and record.get("video_codec") in COPY_VIDEO
+            and interval is not None and interval <= SEGMENT_SECONDS)
+
+
+def target_duration(record, profile):
+    """分段时长的上限：转码时关键帧对齐分段边界，复制时最多多出一个关键帧间隔"""
+    if copies_video(record, profile):
+        return math.ceil(SEGMENT_SECONDS + record["keyframe_interval"])
+    return SEGMENT_SECONDS
+
+
+def segment_count(record):
+    duration = record.get("duration")
+    return math.ceil(duration / SEGMENT_SECONDS) if duration else 0
+
+
+def master_playlist(record):
+    width, height = record.get("width"), record.get("height")
+    lines = ["#EXTM3U"]
+    variants = [("src", record.get("bitrate") or 8000000, width, height)]
+    low = PROFILES["low"]
+    if not height or height > low["height"]:
+        low_width = round(width * low["height"] / height / 2) * 2 if width and height else None
+        variants.append(("low", low["video_bitrate"] + low["audio_bitrate"], low_width, low["height"]))
+    for profile, bandwidth, variant_width, variant_height in variants:
+        info = f"#EXT-X-STREAM-INF:BANDWIDTH={int(bandwidth * 1.1)}"
+        if variant_width and variant_height:
+            info += f",RESOLUTION={variant_width}x{variant_height}"
+        lines += [info, f"{profile}.m3u8"]
+    return "\n".join(lines) + "\n"
+
+
+def media_playlist(record, profile):
+    duration = record["duration"]
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target_duration(record, profile)}",
+             "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD"]
+    for index in range(segment_count(record)):
+        lines += [f"#EXTINF:{min(SEGMENT_SECONDS, duration - index * SEGMENT_SECONDS):.3f},",
+                  f"{profile}/{index}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class Job:
+    def __init__(self, key, start, workdir, process):
+        self.key = key
+        self.start = start
+        # 下一个尚未生成完的分段
+        self.next = start
+        # 最近一次请求的分段，决定预读到哪里
+        self.requested = start
+        self.last_access = time.monotonic()
+        self.workdir = workdir
+        self.process = process
+        self.paused = False
+
+
+class HlsManager:
+    def __init__(self, library, cache_dir=HLS_DIR, cache_bytes=CACHE_BYTES, max_jobs=MAX_JOBS):
+        self.library = library
+        self.cache_dir = cache_dir
+        self.work_dir = os.path.join(cache_dir, "work")
+        self.cache_bytes = cache_bytes
+        self.max_jobs = max_jobs
+        # (key, 分段号) -> 文件大小，按最近使用排序
+        self.segments = OrderedDict()
+        self.cache_size = 0
+        # key -> 该视频档位正在运行的任务列表
+        self.jobs = {}
+        self.failed = set()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.stopping = False
+        self.started_jobs = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return FFMPEG is not None
+
+    def start(self):
+        """加载磁盘上已有的分段（按修改时间近似 LRU 顺序），启动任务监控线程"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            key_dir = os.path.join(self.cache_dir, key)
+            if key_dir == self.work_dir or not os.path.isdir(key_dir):
+                continue
+            for name in os.listdir(key_dir):
+                if name.endswith(".ts") and name[:-3].isdigit():
+                    st = os.stat(os.path.join(key_dir, name))
+                    entries.append((st.st_mtime, key, int(name[:-3]), st.st_size))
+        with self.lock:
+            for _, key, index, size in sorted(entries):
+                self.segments[(key, index)] = size
+                self.cache_size += size
+            self._evict()
+        if self.enabled:
+            threading.Thread(target=self._monitor, daemon=True).start()
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            for job in self._all_jobs():
+                self._kill(job)
+            self.changed.notify_all()
+
+    def cache_key(self, rel, record, profile):
+        return hashlib.sha1(f"{rel}\0{record['size']}\0{record['mtime_ns']}\0{profile}".encode("utf-8")).hexdigest()
+
+    def _segment_path(self, key, index):
+        return os.path.join(self.cache_dir, key, f"{index}.ts")
+
+    # ---- 请求 ----
+
+    def segment(self, rel, record, profile, index, timeout):
+        """
+        返回分段内容，必要时启动或复用生成任务并等待；超时返回 None，
+        ffmpeg 无法从该位置生成时抛出 RuntimeError。
+        """
+        key = self.cache_key(rel, record, profile)
+        deadline = time.monotonic() + timeout
+        while True:
+            path = self._wait(rel, record, profile, key, index, deadline)
+            if path is None:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:  # 刚好被 LRU 删除，重新生成
+                continue
+
+    def _all_jobs(self):
+        return [job for jobs in self.jobs.values() for job in jobs]
+
+    def _job_for(self, key, index):
+        """已生成或即将生成 index 分段的任务（起点最近的一个）；没有返回 None"""
+        candidates = [job for job in self.jobs.get(key, ()) if job.start <= index <= job.next + REUSE_GAP]
+        return max(candidates, key=lambda job: job.start) if candidates else None
+
+    def _wait(self, rel, record, profile, key, index, deadline):
+        with self.lock:
+            waited = False
+            while True:
+                job = self._job_for(key, index)
+                if job is not None:
+                    # 多人共用一个任务时按最靠前的请求预读，回看已生成的分段不让任务暂停
+                    job.requested = max(job.requested, index)
+                    job.last_access = time.monotonic()
+                if (key, index) in self.segments:
+                    self.segments.move_to_end((key, index))
+                    if waited:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    return self._segment_path(key, index)
+                if (key, index) in self.failed:
+                    raise RuntimeError(f"无法生成 HLS 分段: {rel} #{index}")
+                waited = True
+                if job is None or index < job.next:
+                    # 首次播放、拖动到任务前方较远处，或已生成的分段被 LRU 删除：从该分段另起任务，
+                    # 其他人正在使用的任务不受影响；并发已满时下一轮再试
+                    self._spawn(rel, record, profile, key, index)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stopping:
+                    return None
+                self.changed.wait(min(remaining, POLL_SECONDS * 5))
+
+    # ---- 生成任务 ----
+
+    def _command(self, rel, record, profile, start, workdir):
+        settings = PROFILES[profile]
+        transcode = not copies_video(record, profile)
+        command = [FFMPEG, "-nostdin", "-v", "error", "-ss", str(start * SEGMENT_SECONDS), "-copyts",
+                   "-i", str(self.library.root / rel), "-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn"]
+        if transcode:
+            command += ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                        # 关键帧对齐分段边界（t 从跳转点起算，而跳转点本身就是分段边界）
+                        "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_SECONDS})"]
+            if settings["video_bitrate"]:
+                bitrate = settings["video_bitrate"]
+                command += ["-b:v", str(bitrate), "-maxrate", str(bitrate), "-bufsize", str(bitrate * 2)]
+            else:
+                command += ["-crf", "21"]
+            if settings["height"] and (record.get("height") or 0) > settings["height"]:
+                command += ["-vf", f"scale=-2:{settings['height']}"]
+        else:
+            command += ["-c:v", "copy"]
+        if profile == "src" and record.get("audio_codec") in COPY_AUDIO:
+            command += ["-c:a", "copy"]
+        else:
+            command += ["-c:a", "aac", "-ac", "2", "-b:a", str(settings["audio_bitrate"])]
+        command += ["-f", "hls", "-hls_time", str(SEGMENT_SECONDS), "-start_number", str(start),
+                    "-hls_playlist_type", "event", "-hls_segment_filename", os.path.join(workdir, "%d.ts"),
+                    os.path.join(workdir, "list.m3u8")]
+        return command
+
+    def _spawn(self, rel, record, profile, key, start):
+        """启动从 start 分段开始的任务；并发已满且没有可取代的任务时返回 None"""
+        if len(self._all_jobs()) >= self.max_jobs:
+            now = time.monotonic()
+            idle = [job for job in self._all_jobs() if job.paused or now - job.last_access > EVICT_SECONDS]
+            if not idle:
+                return None
+            self._kill(min(idle, key=lambda job: job.last_access))
+        workdir = os.path.join(self.work_dir, str(next(self.counter)))
+        os.makedirs(workdir)
+        with open(os.path.join(workdir, "ffmpeg.log"), "wb") as log:
+            process = subprocess.Popen(self._command(rel, record, profile, start, workdir),
+                                       stdout=subprocess.DEVNULL, stderr=log)
+        job = Job(key, start, workdir, process)
+        self.jobs.setdefault(key, []).append(job)
+        self.started_jobs += 1
+        return job
+
+    def _kill(self, job):
+        if job.process.poll() is None:
+            # SIGKILL 对已暂停（SIGSTOP）的进程同样有效
+            job.process.kill()
+            job.process.wait()
+        shutil.rmtree(job.workdir, ignore_errors=True)
+        jobs = self.jobs.get(job.key, [])
+        if job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self.jobs[job.key]
+        self.changed.notify_all()
+
+    def _collect(self, job):
+        """把播放列表中已列出（即已写完）的新分段移入缓存"""
+        try:
+            with open(os.path.join(job.workdir, "list.m3u8")) as f:
+                names = [line.strip() for line in f if line.strip().endswith(".ts")]
+        except FileNotFoundError:
+            return
+        for name in names:
+            index = int(name[:-3])
+            if index < job.next:
+                continue
+            key_dir = os.path.join(self.cache_dir, job.key)
+            os.makedirs(key_dir, exist_ok=True)
+            path = self._segment_path(job.key, index)
+            os.replace(os.path.join(job.workdir, name), path)
+            self.cache_size += os.path.getsize(path) - self.segments.pop((job.key, index), 0)
+            self.segments[(job.key, index)] = os.path.getsize(path)
+            job.next = index + 1
+
+    def _evict(self):
+        while self.cache_size > self.cache_bytes and self.segments:
+            (key, index), size = self.segments.popitem(last=False)
+            self.cache_size -= size
+            try:
+                os.remove(self._segment_path(key, index))
+            except FileNotFoundError:
+                pass
+
+    def _monitor(self):
+        while True:
+            with self.lock:
+                if self.stopping:
+                    return
+                now = time.monotonic()
+                for job in self._all_jobs():
+                    exited = job.process.poll() is not None
+                    try:
+                        self._collect(job)
+                    except OSError as e:
+                        print(f"HLS 分段收集失败: {e}")
+                    if exited:
+                        if job.process.returncode != 0 and job.next == job.start:
+                            self.failed.add((job.key, job.start))
+                            with open(os.path.join(job.workdir, "ffmpeg.log"), "rb") as f:
+                                print(f"HLS 生成失败: {f.read()[-500:].decode('utf-8', 'replace')}")
+                        self._kill(job)
+                    elif now - job.last_access > IDLE_SECONDS:
+                        self._kill(job)
+                    elif not job.paused and job.next > job.requested + PREFETCH_SEGMENTS:
+                        # 已预读足够多的分段，暂停 ffmpeg，不占用 CPU 与磁盘
+                        job.process.send_signal(signal.SIGSTOP)
+                        job.paused = True
+                    elif job.paused and job.next <= job.requested + PREFETCH_SEGMENTS:
+                        job.process.send_signal(signal.SIGCONT)
+                        job.paused = False
+                self._evict()
+                self.changed.notify_all()
+            time.sleep(POLL_SECONDS)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "jobs": [{"start": job.start, "next": job.next, "requested": job.requested, "paused": job.paused}
+                         for job in self._all_jobs()],
+                "started_jobs": self.started_jobs,
+                "segments": len(self.segments),
+                "cache_mb": round(self.cache_size / 1024 / 1024, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,434 @@
+"""
+视频库索引
+
+VIDEO_DIR 下的视频文件（大小、修改时间、所属顶层目录）与各目录的修改时间保存在 SQLite 中，
+启动时直接从索引加载，不需要先扫一遍外置硬盘。
+新增或变化的文件在提交到索引前并行读取容器头部（probe.py），时长、编码、分辨率等一并保存。
+
+重新扫描是增量的：目录的 mtime 只在其直接子项增加、删除或改名时变化，
+mtime 未变的目录直接沿用索引中的文件列表与子目录列表，不再 listdir，也不逐个 stat 文件，
+只需 stat 目录本身并继续检查子目录（深层的变化不会反映到祖先目录的 mtime 上）。
+刚写入不久的文件（可能还在拷贝中）在之后的扫描里会重新 stat，直到大小稳定。
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from contextlib import closing
+from pathlib import Path
+
+from probe import probe, FIELDS as PROBE_FIELDS, VERSION as PROBE_VERSION
+
+ROOT_FOLDER = "根目录"
+SKIP_DIRS = {"System Volume Information", ".Trashes"}
+# mtime 在该时间之内的文件视为可能仍在写入，下次扫描时重新 stat
+SETTLE_SECONDS = 600
+# 目录 mtime 距扫描时刻太近时不可信（同一时间粒度内可能还有后续改动），下次扫描时重新列出
+MTIME_GRACE_NS = 2 * 10 ** 9
+# 并行读取容器头部的线程数（每个文件只有几次小范围读取，主要在等外置硬盘寻道）
+PROBE_WORKERS = 8
+# 元数据列；旧版本的索引文件在打开时补上这些列，已有记录在下次扫描时补读
+PROBE_COLUMNS = {
+    "container": "TEXT", "duration": "REAL", "video_codec": "TEXT", "audio_codec": "TEXT",
+    "width": "INTEGER", "height": "INTEGER", "bitrate": "INTEGER", "faststart": "INTEGER", "keyframe_interval": "REAL",
+}
+# 无法识别的文件（如 AVI）也记录下来，避免每次扫描都重新读取
+UNKNOWN_PROBE = {**dict.fromkeys(PROBE_FIELDS), "container": "unknown"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino INTEGER,
+    container TEXT,
+    duration REAL,
+    video_codec TEXT,
+    audio_codec TEXT,
+    width INTEGER,
+    height INTEGER,
+    bitrate INTEGER,
+    faststart INTEGER,
+    keyframe_interval REAL
+);
+CREATE INDEX IF NOT EXISTS ix_files_dir ON files (dir);
+"""
+
+
+def _hidden_dir(name):
+    return name.startswith(".") or name in SKIP_DIRS
+
+
+def _under(path, scope):
+    return not scope or path == scope or path.startswith(scope + os.sep)
+
+
+def _top_folder(rel_dir):
+    return rel_dir.split(os.sep, 1)[0] if rel_dir else ROOT_FOLDER
+
+
+class Library:
+    """
+    内存中保存完整的索引（files: {相对路径: 记录}，dirs: {相对路径: (上级目录, mtime_ns)}），
+    SQLite 只在加载和每次更新结束时读写。扫描与事件更新（apply_changes）同一时间只有一个在进行。
+    """
+
+    def __init__(self, root, db_path, extensions):
+        self.root = Path(root)
+        self.db_path = db_path
+        self.extensions = extensions
+        self.files = {}
+        self.dirs = {}
+        self.children = {}
+        self.sorted = None
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.last_scan = 0
+        self.last_stats = None
+        # 索引版本：epoch 在索引文件新建或重置时随机生成，generation 在每次文件列表有变化时加一，
+        # 两者一起作为 /api/videos 的 ETag（索引文件被删除重建后 generation 从 0 开始也不会与旧值混淆）
+        self.epoch = None
+        self.generation = 0
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        for column, column_type in PROBE_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+        return conn
+
+    def load(self):
+        """从索引文件加载；索引对应的根目录与当前配置不同时丢弃旧索引"""
+        with closing(self.connect()) as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("root") != str(self.root):
+                with conn:
+                    conn.execute("DELETE FROM files")
+                    conn.execute("DELETE FROM dirs")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (str(self.root),))
+                    conn.execute("DELETE FROM meta WHERE key IN ('last_scan', 'generation', 'epoch')")
+                meta = {}
+            if "epoch" not in meta:
+                meta["epoch"] = secrets.token_hex(4)
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('epoch', ?)", (meta["epoch"],))
+            if meta.get("probe_version") != str(PROBE_VERSION):
+                # 探测逻辑更新后，此前无法识别的文件、旧版本记下无穷大时长的文件，
+                # 以及还没有关键帧间隔（HLS 判断能否复制编码时需要）的 H.264 文件在下次扫描时重新探测
+                with conn:
+                    conn.execute("UPDATE files SET container = NULL WHERE container = 'unknown' OR abs(duration) > 1e308 "
+                                 "OR (video_codec = 'h264' AND keyframe_interval IS NULL)")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('probe_version', ?)", (str(PROBE_VERSION),))
+            files = {}
+            for path, name, folder, dir, size, mtime_ns, ino, *info in conn.execute(
+                f"SELECT path, name, folder, dir, size, mtime_ns, ino, {', '.join(PROBE_FIELDS)} FROM files"
+            ):
+                record = {"name": name, "folder": folder, "dir": dir, "size": size, "mtime_ns": mtime_ns, "ino": ino}
+                record.update(zip(PROBE_FIELDS, info))
+                if record["faststart"] is not None:
+                    record["faststart"] = bool(record["faststart"])
+                files[path] = record
+            dirs = {path: (parent, mtime_ns) for path, parent, mtime_ns in conn.execute(
+                "SELECT path, parent, mtime_ns FROM dirs"
+            )}
+        with self.lock:
+            self.files = files
+            self.dirs = dirs
+            self.children = self._children(dirs)
+            self.sorted = None
+            self.last_scan = float(meta.get("last_scan", 0))
+            self.epoch = meta["epoch"]
+            self.generation = int(meta.get("generation", 0))
+        return len(files)
+
+    @staticmethod
+    def _children(dirs):
+        children = {}
+        for path, (parent, _) in dirs.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(path)
+        return children
+
+    def videos(self):
+        """按 (顶层目录, 文件名) 排序的视频列表，结构与 /api/videos 的返回值一致"""
+        with self.lock:
+            if self.sorted is None:
+                self.sorted = sorted(
+                    ({"name": r["name"], "folder": r["folder"], "path": path, "size": r["size"],
+                      **{field: r.get(field) for field in PROBE_FIELDS if field != "container"}}
+                     for path, r in self.files.items()),
+                    key=lambda video: (video["folder"], video["name"]),
+                )
+            return self.sorted
+
+    @property
+    def version(self):
+        """索引内容的版本号，文件列表（含大小、修改时间）有任何变化时改变"""
+        with self.lock:
+            return f"{self.epoch}-{self.generation}"
+
+    def get(self, path):
+        with self.lock:
+            return self.files.get(path)
+
+    def wanted(self, rel, is_dir):
+        """相对路径是否属于索引范围：不在隐藏/系统目录中，文件还要求是视频扩展名且不是隐藏文件"""
+        parts = rel.split(os.sep) if rel else []
+        dir_parts = parts if is_dir else parts[:-1]
+        if any(_hidden_dir(part) for part in dir_parts):
+            return False
+        if is_dir:
+            return True
+        return (bool(parts) and not parts[-1].startswith(".")
+                and os.path.splitext(parts[-1])[1].lower() in self.extensions)
+
+    # ---- 扫描 ----
+
+    def _stat_file(self, rel_dir, name):
+        rel = os.path.join(rel_dir, name) if rel_dir else name
+        st = os.stat(self.root / rel)
+        return rel, {"name": name, "folder": _top_folder(rel_dir), "dir": rel_dir,
+                     "size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino}
+
+    def _visit(self, rel_dir, dirs, files_by_dir, settle_ns, now_ns):
+        """
+        检查一个目录，返回 (结果, 子目录列表)。结果为 (目录, 上级, mtime_ns, 文件)：
+        文件为 None 表示目录未变化、沿用索引，此时返回值中的文件为需要更新的 {路径: 记录}（重新 stat 的）；
+        否则为该目录下完整的 {路径: 记录}。目录已不存在时返回 (None, [])。
+        """
+        parent = None if rel_dir == "" else os.path.dirname(rel_dir)
+        try:
+            mtime_ns = os.stat(self.root / rel_dir).st_mtime_ns
+        except OSError:
+            return None, []
+        known = dirs.get(rel_dir)
+        if known is not None and known[1] == mtime_ns:
+            updates = {}
+            for rel, record in files_by_dir.get(rel_dir, ()):
+                if record["mtime_ns"] >= settle_ns:
+                    try:
+                        rel, fresh = self._stat_file(rel_dir, record["name"])
+                    except OSError:
+                        continue
+                    if (fresh["size"], fresh["mtime_ns"], fresh["ino"]) != (record["size"], record["mtime_ns"], record["ino"]):
+                        updates[rel] = fresh
+            return (rel_dir, parent, mtime_ns, None, updates), self.children.get(rel_dir, [])
+
+        files, subdirs = {}, []
+        try:
+            with os.scandir(self.root / rel_dir) as entries:
+                for entry in entries:
+                    rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not _hidden_dir(entry.name):
+                                subdirs.append(rel)
+                        elif (entry.is_file() and not entry.name.startswith(".")
+                              and os.path.splitext(entry.name)[1].lower() in self.extensions):
+                            st = entry.stat()
+                            files[rel] = {"name": entry.name, "folder": _top_folder(rel_dir), "dir": rel_dir,
+                                          "size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino}
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error scanning {self.root / rel_dir}: {e}")
+            return None, []
+        # 刚改动过的目录不记录 mtime，下次扫描时重新列出
+        trusted = mtime_ns if now_ns - mtime_ns > MTIME_GRACE_NS else None
+        return (rel_dir, parent, trusted, files, None), subdirs
+
+    def _walk(self, rel_top, dirs, files_by_dir, settle_ns, now_ns):
+        results = []
+        stack = [rel_top]
+        while stack:
+            result, subdirs = self._visit(stack.pop(), dirs, files_by_dir, settle_ns, now_ns)
+            if result is not None:
+                results.append(result)
+                stack.extend(subdirs)
+        return results
+
+    def _snapshot(self):
+        with self.lock:
+            dirs = dict(self.dirs)
+            files = dict(self.files)
+        files_by_dir = {}
+        for rel, record in files.items():
+            files_by_dir.setdefault(record["dir"], []).append((rel, record))
+        return dirs, files, files_by_dir
+
+    def rescan(self, workers=None):
+        """增量扫描并写回索引，返回统计信息；已有扫描在进行时等待其完成后再扫一次"""
+        with self.scan_lock:
+            started = time.time()
+            now_ns = time.time_ns()
+            dirs, files, files_by_dir = self._snapshot()
+            settle_ns = int((self.last_scan - SETTLE_SECONDS) * 1e9)
+
+            root_result, top_dirs = self._visit("", dirs, files_by_dir, settle_ns, now_ns)
+            if root_result is None:
+                raise OSError(f"无法访问磁盘: {self.root}")
+            results = [root_result]
+            # 顶层目录并行扫描（外置硬盘上的 stat 延迟较高，并发可以重叠等待）
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+                for walked in executor.map(lambda d: self._walk(d, dirs, files_by_dir, settle_ns, now_ns), top_dirs):
+                    results.extend(walked)
+            new_dirs, new_files = {}, dict(files)
+            listed = self._merge(results, files_by_dir, new_dirs, new_files)
+            stats = self._commit(dirs, files, files_by_dir, new_dirs, new_files)
+            stats["dirs_listed"] = listed
+            stats["seconds"] = round(time.time() - started, 3)
+            self.last_scan = started
+            with closing(self.connect()) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_scan', ?)", (str(started),))
+            self.last_stats = stats
+            return stats
+
+    def apply_changes(self, file_paths=(), dir_paths=()):
+        """
+        把文件系统事件涉及的路径（相对 root）同步到索引，不做全量扫描：
+        file_paths 中的文件重新 stat（已不存在的删除），dir_paths 中的目录整棵重新列出（已不存在的连同内容删除）。
+        """
+        with self.scan_lock:
+            now_ns = time.time_ns()
+            dirs, files, files_by_dir = self._snapshot()
+            dir_paths = [rel_dir for rel_dir in dir_paths if self.wanted(rel_dir, is_dir=True)]
+            scopes = set()
+            for rel_dir in dir_paths:
+                if not any(_under(rel_dir, scope) for scope in dir_paths if scope != rel_dir):
+                    scopes.add(rel_dir)
+            # 事件中的目录都当作有变化：从快照中去掉，使 _visit 重新列出
+            new_dirs = {rel_dir: value for rel_dir, value in dirs.items()
+                        if not any(_under(rel_dir, scope) for scope in scopes)}
+            new_files = dict(files)
+            results = []
+            for scope in scopes:
+                results.extend(self._walk(scope, new_dirs, files_by_dir, 0, now_ns))
+            self._merge(results, files_by_dir, new_dirs, new_files)
+
+            for rel in file_paths:
+                rel_dir, name = os.path.split(rel)
+                if not self.wanted(rel, is_dir=False) or any(_under(rel_dir, scope) for scope in scopes):
+                    continue
+                if rel_dir not in new_dirs:
+                    # 所在目录还不在索引中（如刚建好的目录），整个目录列出
+                    for result in self._walk(rel_dir, new_dirs, files_by_dir, 0, now_ns):
+                        self._merge([result], files_by_dir, new_dirs, new_files)
+                    continue
+                try:
+                    rel, record = self._stat_file(rel_dir, name)
+                    new_files[rel] = record
+                except OSError:
+                    new_files.pop(rel, None)
+            return self._commit(dirs, files, files_by_dir, new_dirs, new_files)
+
+    @staticmethod
+    def _merge(results, files_by_dir, new_dirs, new_files):
+        """把 _visit 的结果并入 new_dirs / new_files（就地修改），返回重新列出的目录数"""
+        listed = 0
+        for rel_dir, parent, mtime_ns, listing, updates in results:
+            new_dirs[rel_dir] = (parent, mtime_ns)
+            if listing is None:
+                new_files.update(updates)
+                continue
+            listed += 1
+            for rel, _ in files_by_dir.get(rel_dir, ()):
+                if rel not in listing:
+                    new_files.pop(rel, None)
+            new_files.update(listing)
+        return listed
+
+    def _commit(self, old_dirs, old_files, files_by_dir, new_dirs, new_files):
+        """与旧索引比较，把差异写入 SQLite 并替换内存中的索引"""
+        # 不再存在（或已不可访问）的目录，连同其中的文件一起删除
+        removed_dirs = [rel_dir for rel_dir in old_dirs if rel_dir not in new_dirs]
+        for rel_dir in removed_dirs:
+            for rel, _ in files_by_dir.get(rel_dir, ()):
+                new_files.pop(rel, None)
+        probed = self._probe(old_files, new_files)
+        upserts = {rel: record for rel, record in new_files.items() if old_files.get(rel) != record}
+        deleted = [rel for rel in old_files if rel not in new_files]
+        added = sum(1 for rel in upserts if rel not in old_files)
+        changed_dirs = [(rel_dir, parent, mtime_ns) for rel_dir, (parent, mtime_ns) in new_dirs.items()
+                        if old_dirs.get(rel_dir) != (parent, mtime_ns)]
+
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("DELETE FROM files WHERE path = ?", [(rel,) for rel in deleted])
+            conn.executemany(
+                f"INSERT OR REPLACE INTO files (path, name, folder, dir, size, mtime_ns, ino, {', '.join(PROBE_FIELDS)}) "
+                f"VALUES ({', '.join('?' * (7 + len(PROBE_FIELDS)))})",
+                [(rel, r["name"], r["folder"], r["dir"], r["size"], r["mtime_ns"], r["ino"],
+                  *(r.get(field) for field in PROBE_FIELDS)) for rel, r in upserts.items()],
+            )
+            conn.executemany("DELETE FROM dirs WHERE path = ?", [(rel_dir,) for rel_dir in removed_dirs])
+            conn.executemany("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)", changed_dirs)
+            generation = self.generation + 1 if upserts or deleted else self.generation
+            if generation != self.generation:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(generation),))
+
+        with self.lock:
+            self.files = new_files
+            self.dirs = new_dirs
+            self.children = self._children(new_dirs)
+            if upserts or deleted:
+                self.sorted = None
+                self.generation = generation
+        return {
+            "files": len(new_files),
+            "added": added,
+            "updated": len(upserts) - added,
+            "removed": len(deleted),
+            "dirs": len(new_dirs),
+            "probed": probed,
+        }
+
+    def _probe(self, old_files, new_files):
+        """
+        为新增或变化的文件（记录中还没有元数据）并行读取容器头部，就地更新 new_files，返回读取的文件数。
+        大小、mtime、inode 都与旧记录相同的沿用旧的元数据。
+        """
+        todo = []
+        for rel, record in new_files.items():
+            if record.get("container") is not None:
+                continue
+            old = old_files.get(rel)
+            if (old is not None and old.get("container") is not None
+                    and (old["size"], old["mtime_ns"], old["ino"]) == (record["size"], record["mtime_ns"], record["ino"])):
+                todo.append((rel, {field: old[field] for field in PROBE_FIELDS}))
+            else:
+                todo.append((rel, None))
+        missing = [rel for rel, info in todo if info is None]
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+                found = dict(zip(missing, executor.map(lambda rel: probe(self.root / rel) or UNKNOWN_PROBE, missing)))
+        for rel, info in todo:
+            # 记录可能与旧索引共享，不能原地修改
+            new_files[rel] = {**new_files[rel], **(info or found[rel])}
+        return len(missing)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="扫描视频目录并更新索引")
+    parser.add_argument("root")
+    parser.add_argument("--db", default="./media_index.db")
+    args = parser.parse_args()
+
+    library = Library(args.root, args.db, {".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v"})
+    started = time.time()
+    print(f"从索引加载 {library.load()} 个文件, 耗时 {(time.time() - started) * 1000:.1f}ms")
+    print(json.dumps(library.rescan(), ensure_ascii=False))
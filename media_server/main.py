@@ -1,22 +1,56 @@
 import os
-import re
 import mimetypes
-import concurrent.futures
-import time
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, List, Dict
-from fastapi import FastAPI, HTTPException, Request, Header
-from fastapi.responses import StreamingResponse, HTMLResponse
+from typing import List, Optional
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Request, Header, Body
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="Local Media Server")
+from library import Library
+from watcher import LibraryWatcher
+from ranges import parse_ranges, RangeNotSatisfiable, RangeFileResponse
+from conditional import file_etag, http_date, etag_matches, not_modified, if_range_matches
+from thumbs import ThumbnailPipeline, cache_key
+import hls
 
-# 简单的内存缓存
-VIDEO_CACHE: Dict = {
-    "data": [],
-    "last_updated": 0,
-    "expiry": 600  # 10分钟缓存
-}
+VIDEO_DIR = Path("/Volumes/T2")
+EXTENSIONS = {".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v"}
+# 视频库索引文件
+INDEX_PATH = os.environ.get("MEDIA_INDEX_DB", "./media_index.db")
+# 部署在 nginx 后面时设置为 internal location 的前缀（如 /_media/），视频由 nginx 以 sendfile 零拷贝发送：
+#   location /_media/ { internal; alias /Volumes/T2/; }
+ACCEL_REDIRECT_PREFIX = os.environ.get("MEDIA_ACCEL_REDIRECT")
+# 视频文件很少原地修改，允许浏览器与 nginx 缓存一小时；过期后带 If-None-Match / If-Range 重新校验
+VIDEO_CACHE_CONTROL = "public, max-age=3600"
+# 缩略图稍有过期也无妨，缓存一天；视频变化后 ETag（缓存 key）随之变化
+THUMB_CACHE_CONTROL = "public, max-age=86400"
+# 缩略图还没生成时请求最多等待的秒数（此时会插到后台预生成任务之前）
+THUMB_WAIT_SECONDS = 15
+# HLS 分段最多等待的秒数（转码起步时第一个分段需要几秒）
+HLS_WAIT_SECONDS = 30
+
+library = Library(VIDEO_DIR, INDEX_PATH, EXTENSIONS)
+watcher = LibraryWatcher(library)
+thumbnails = ThumbnailPipeline(library)
+hls_manager = hls.HlsManager(library)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 先用上次的索引提供服务；监听启动后在后台扫描一次，补上停机期间的变化
+    count = library.load()
+    print(f"视频库索引已加载: {count} 个文件")
+    watcher.start()
+    thumbnails.start()
+    hls_manager.start()
+    yield
+    hls_manager.stop()
+    thumbnails.stop()
+    watcher.stop()
+
+app = FastAPI(title="Local Media Server", lifespan=lifespan)
 
 # 配置 CORS
 # ... (keep existing middleware)
@@ -28,93 +62,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-VIDEO_DIR = Path("/Volumes/T2")
-EXTENSIONS = {".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v"}
-
-def scan_directory(directory: Path) -> List[dict]:
-    """扫描单个目录及其子目录中的视频文件，但归类到顶层目录"""
-    local_videos = []
-    # 确定该目录相对于 VIDEO_DIR 的顶层名称
-    try:
-        rel_top = directory.relative_to(VIDEO_DIR)
-        top_folder_name = rel_top.parts[0] if rel_top.parts else "根目录"
-    except Exception:
-        top_folder_name = "未知目录"
-
-    try:
-        for root, dirs, files in os.walk(directory):
-            # 过滤掉隐藏目录
-            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "System Volume Information" and d != ".Trashes"]
-            
-            for file in files:
-                if file.startswith("._") or file.startswith("."):
-                    continue
-                    
-                ext = os.path.splitext(file)[1].lower()
-                if ext in EXTENSIONS:
-                    file_path = Path(root) / file
-                    try:
-                        rel_path = file_path.relative_to(VIDEO_DIR)
-                        local_videos.append({
-                            "name": file,
-                            "folder": top_folder_name, # 只记录顶层目录名
-                            "path": str(rel_path),
-                            "size": file_path.stat().st_size
-                        })
-                    except Exception:
-                        continue
-    except Exception as e:
-        print(f"Error scanning {directory}: {e}")
-    return local_videos
-
 @app.get("/api/videos")
-async def list_videos(refresh: bool = False):
-    global VIDEO_CACHE
-    
-    # 检查缓存是否有效
-    now = time.time()
-    if not refresh and VIDEO_CACHE["data"] and (now - VIDEO_CACHE["last_updated"] < VIDEO_CACHE["expiry"]):
-        return VIDEO_CACHE["data"]
-
-    # 获取第一层目录进行并行扫描
-    try:
-        top_level_items = [VIDEO_DIR / item for item in os.listdir(VIDEO_DIR) 
-                          if (VIDEO_DIR / item).is_dir() and not item.startswith(".")]
-        # 也包含根目录下的文件
-        root_files = [VIDEO_DIR / item for item in os.listdir(VIDEO_DIR) 
-                     if (VIDEO_DIR / item).is_file() and not item.startswith(".")]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"无法访问磁盘: {e}")
-
-    all_videos = []
-    
-    # 使用线程池并行扫描
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
-        # 扫描子目录
-        future_to_dir = {executor.submit(scan_directory, d): d for d in top_level_items}
-        
-        # 处理根目录下的文件
-        for file_path in root_files:
-            ext = file_path.suffix.lower()
-            if ext in EXTENSIONS:
-                all_videos.append({
-                    "name": file_path.name,
-                    "folder": "根目录",
-                    "path": file_path.name,
-                    "size": file_path.stat().st_size
-                })
-
-        for future in concurrent.futures.as_completed(future_to_dir):
-            all_videos.extend(future.result())
-    
-    # 先按文件夹排序，再按文件名排序
-    sorted_videos = sorted(all_videos, key=lambda x: (x["folder"], x["name"]))
-    
-    # 更新缓存
-    VIDEO_CACHE["data"] = sorted_videos
-    VIDEO_CACHE["last_updated"] = time.time()
-    
-    return sorted_videos
+async def list_videos(refresh: bool = False, if_none_match: Optional[str] = Header(None)):
+    if refresh or not library.last_scan:
+        # 强制刷新或从未扫描过（首次启动）：等待一次增量扫描完成
+        try:
+            await asyncio.to_thread(library.rescan)
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    # 其余情况直接返回内存中的索引，由目录监听与定期扫描保持更新。
+    # 先取版本号再取列表：两者之间索引有更新时 ETag 偏旧，客户端下次请求会拿到新列表，而不会把新列表当成未变化
+    etag = f'"{library.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(library.videos(), headers=headers)
+
+@app.get("/api/videos/status")
+async def library_status():
+    """目录监听是否在工作、事件数与最近一次扫描的统计"""
+    return {"files": len(library.files), **watcher.stats(), "thumbs": thumbnails.stats(), "hls": hls_manager.stats()}
+
+@app.get("/api/thumb/{video_path:path}")
+async def thumbnail(video_path: str, if_none_match: Optional[str] = Header(None)):
+    """视频缩略图（JPEG）。已生成的直接从内存或本地缓存返回；未生成的优先排队并等待生成完成"""
+    record = library.get(video_path)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Video not found: {video_path}")
+    etag = f'"{cache_key(video_path, record)}"'
+    headers = {"ETag": etag, "Cache-Control": THUMB_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    data = thumbnails.cached(etag.strip('"'))
+    if data is None:
+        if not thumbnails.enabled:
+            raise HTTPException(status_code=404, detail="未安装 ffmpeg，无法生成缩略图")
+        # shield：等待超时或客户端断开时不取消生成任务，其他请求和缓存仍会用到结果
+        future = asyncio.wrap_future(thumbnails.request(video_path, record))
+        try:
+            data = await asyncio.wait_for(asyncio.shield(future), THUMB_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="缩略图生成中", headers={"Retry-After": "5"})
+    if not data:
+        raise HTTPException(status_code=404, detail=f"无法从视频中取得画面: {video_path}")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+@app.post("/api/thumb/prefetch")
+async def prefetch_thumbnails(paths: List[str] = Body(...)):
+    """页面上正在显示的视频，把它们的缩略图排到后台预生成之前"""
+    queued = 0
+    for video_path in paths:
+        record = library.get(video_path)
+        if record is not None and thumbnails.enabled and thumbnails.cached(cache_key(video_path, record)) is None:
+            thumbnails.request(video_path, record)
+            queued += 1
+    return {"queued": queued}
 
 @app.get("/", response_class=HTMLResponse)
 async def index():
@@ -145,52 +147,81 @@ def get_video_path(video_name: str) -> Path:
     print(f"DEBUG: Video not found. VIDEO_DIR={VIDEO_DIR}, video_name={video_name}, decoded_name={decoded_name}")
     raise HTTPException(status_code=404, detail=f"Video not found: {decoded_name}")
 
-@app.get("/video/{video_name:path}")
-async def stream_video(video_name: str, request: Request, range: Optional[str] = Header(None)):
+def get_hls_record(video_path: str) -> dict:
+    record = library.get(video_path)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Video not found: {video_path}")
+    if not hls_manager.enabled:
+        raise HTTPException(status_code=404, detail="未安装 ffmpeg，无法提供 HLS")
+    if not record.get("duration"):
+        raise HTTPException(status_code=415, detail=f"无法得到视频时长: {video_path}")
+    return record
+
+@app.get("/api/hls/{video_path:path}/{name}.m3u8")
+async def hls_playlist(video_path: str, name: str):
+    """index.m3u8 为列出各档位的主播放列表，src.m3u8 / low.m3u8 为各档位的分段列表"""
+    record = get_hls_record(video_path)
+    if name == "index":
+        body = hls.master_playlist(record)
+    elif name in hls.PROFILES:
+        body = hls.media_playlist(record, name)
+    else:
+        raise HTTPException(status_code=404, detail=f"Unknown playlist: {name}")
+    return Response(content=body, media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/hls/{video_path:path}/{profile}/{index}.ts")
+async def hls_segment(video_path: str, profile: str, index: int):
+    record = get_hls_record(video_path)
+    if profile not in hls.PROFILES or not 0 <= index < hls.segment_count(record):
+        raise HTTPException(status_code=404, detail=f"Segment not found: {profile}/{index}")
+    try:
+        data = await asyncio.to_thread(hls_manager.segment, video_path, record, profile, index, HLS_WAIT_SECONDS)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=503, detail="HLS 分段生成中", headers={"Retry-After": "2"})
+    return Response(content=data, media_type="video/mp2t", headers={"Cache-Control": VIDEO_CACHE_CONTROL})
+
+# 同步函数：定位文件需要 stat 外置硬盘，放到线程池中执行，不阻塞事件循环
+@app.api_route("/video/{video_name:path}", methods=["GET", "HEAD"])
+def stream_video(
+    video_name: str,
+    request: Request,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+):
     video_path = get_video_path(video_name)
-    file_size = video_path.stat().st_size
+    st = video_path.stat()
+    file_size = st.st_size
+    # 校验器与视频库索引记录的字段（大小、修改时间、inode）一致
+    etag = file_etag(st.st_size, st.st_mtime_ns, st.st_ino)
+    headers = {"ETag": etag, "Last-Modified": http_date(st.st_mtime_ns), "Cache-Control": VIDEO_CACHE_CONTROL}
     
     mime_type, _ = mimetypes.guess_type(video_path)
     if not mime_type:
         mime_type = "video/mp4"
-    
-    start, end = 0, file_size - 1
-    status_code = 200
-
-    if range:
-        match = re.search(r"bytes=(\d+)-(\d*)", range)
-        if match:
-            start = int(match.group(1))
-            if match.group(2):
-                end = int(match.group(2))
-            status_code = 206
-    
-    # 确保范围有效
-    if start > end or start < 0 or end >= file_size:
-        raise HTTPException(status_code=416, detail="Requested range not satisfiable")
 
-    content_length = end - start + 1
-    
-    def generate_chunks(chunk_size=1024 * 1024): # 1MB chunks
-        with open(video_path, "rb") as video:
-            video.seek(start)
-            remaining = content_length
-            while remaining > 0:
-                to_read = min(chunk_size, remaining)
-                data = video.read(to_read)
-                if not data:
-                    break
-                yield data
-                remaining -= len(data)
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(content_length),
-        "Content-Type": mime_type,
-    }
-    
-    return StreamingResponse(generate_chunks(), status_code=status_code, headers=headers)
+    if ACCEL_REDIRECT_PREFIX:
+        # 交给 nginx 用 sendfile 发送文件，Range 与条件请求（ETag / Last-Modified）也由 nginx 处理
+        rel_path = video_path.relative_to(VIDEO_DIR).as_posix()
+        return Response(headers={
+            "X-Accel-Redirect": ACCEL_REDIRECT_PREFIX + quote(rel_path),
+            "Content-Type": mime_type,
+            "Cache-Control": VIDEO_CACHE_CONTROL,
+        })
+
+    if not_modified(if_none_match, if_modified_since, etag, st.st_mtime_ns):
+        return Response(status_code=304, headers={**headers, "Accept-Ranges": "bytes"})
+    # If-Range 不匹配说明客户端手上的是旧文件的片段，忽略 Range 返回完整的新文件
+    if not if_range_matches(if_range, etag, st.st_mtime_ns):
+        range = None
+    try:
+        ranges = parse_ranges(range, file_size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}", "Accept-Ranges": "bytes"})
+    return RangeFileResponse(video_path, file_size, ranges, mime_type, headers=headers, method=request.method)
 
 if __name__ == "__main__":
     import uvicorn
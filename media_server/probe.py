@@ -0,0 +1,496 @@
+"""
+视频元数据探测
+
+只读取容器头部结构，不解码任何帧：
+  MP4 / MOV：按 box 头逐个 seek 跳过顶层 box（mdat 不读），读入 moov 后解析
+    mvhd（时长）、tkhd / stsd（分辨率、编码）、hdlr（轨道类型）、stss / stts（关键帧间隔），
+    moov 在 mdat 之前即为 faststart；
+  MKV / WebM：解析 EBML 头与 Segment 下的 Info（时长）、Tracks（编码、分辨率）、Cues（关键帧间隔），
+    SeekHead 用于跳到位于 Cluster 之后的元素，Cues（索引）在第一个 Cluster 之前视为 faststart；
+  AVI：只读取文件开头的 hdrl 列表（avih、各流的 strh / strf），浏览器不能直接播放，不判断 faststart。
+moov 在文件末尾（或 MKV 的 Cues 在末尾）时，浏览器播放前需要额外请求文件尾部，外置硬盘上拖动明显变慢。
+一个文件通常只需 3~10 次小范围读取。
+用法: python media_server/probe.py a.mp4 b.mkv
+"""
+import math
+import os
+import struct
+
+# moov 一般在几百 KB 以内，超过该大小的视为损坏，不读入
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+MAX_EBML_ELEMENT = 16 * 1024 * 1024
+
+# 探测逻辑有改进（如新支持了一种容器）时加一，视频库会重新探测此前无法识别的文件
+VERSION = 4
+
+# keyframe_interval：视频轨道相邻关键帧的最大间隔（秒），HLS 据此判断能否直接复制视频编码
+FIELDS = ("container", "duration", "video_codec", "audio_codec", "width", "height", "bitrate", "faststart",
+          "keyframe_interval")
+
+MP4_TOP_LEVEL = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot", b"uuid", b"styp", b"sidx", b"moof"}
+MP4_CODECS = {
+    "avc1": "h264", "avc3": "h264", "hvc1": "hevc", "hev1": "hevc", "av01": "av1", "vp09": "vp9", "vp08": "vp8",
+    "mp4v": "mpeg4", "jpeg": "mjpeg", "apch": "prores", "apcn": "prores", "apcs": "prores", "apco": "prores",
+    "ap4h": "prores", "mp4a": "aac", "ac-3": "ac3", "ec-3": "eac3", "Opus": "opus", "fLaC": "flac",
+    "alac": "alac", ".mp3": "mp3", "lpcm": "pcm", "sowt": "pcm", "twos": "pcm",
+}
+MKV_CODECS = {
+    "V_MPEG4/ISO/AVC": "h264", "V_MPEGH/ISO/HEVC": "hevc", "V_AV1": "av1", "V_VP9": "vp9", "V_VP8": "vp8",
+    "V_MPEG4/ISO/ASP": "mpeg4", "V_MPEG2": "mpeg2", "A_AAC": "aac", "A_OPUS": "opus", "A_VORBIS": "vorbis",
+    "A_AC3": "ac3", "A_EAC3": "eac3", "A_DTS": "dts", "A_FLAC": "flac", "A_MPEG/L3": "mp3", "A_TRUEHD": "truehd",
+}
+
+AVI_VIDEO_CODECS = {
+    "xvid": "mpeg4", "divx": "mpeg4", "dx50": "mpeg4", "fmp4": "mpeg4", "mp4v": "mpeg4", "div3": "msmpeg4",
+    "h264": "h264", "avc1": "h264", "x264": "h264", "hevc": "hevc", "h265": "hevc", "mjpg": "mjpeg",
+}
+AVI_AUDIO_CODECS = {0x1: "pcm", 0x50: "mp2", 0x55: "mp3", 0xFF: "aac", 0x1610: "aac", 0x2000: "ac3", 0x2001: "dts"}
+
+# Matroska 元素 ID
+EBML, DOC_TYPE = 0x1A45DFA3, 0x4282
+SEGMENT, SEEK_HEAD, SEEK, SEEK_ID, SEEK_POSITION = 0x18538067, 0x114D9B74, 0x4DBB, 0x53AB, 0x53AC
+INFO, TIMESTAMP_SCALE, DURATION = 0x1549A966, 0x2AD7B1, 0x4489
+TRACKS, TRACK_ENTRY, TRACK_TYPE, TRACK_NUMBER, CODEC_ID = 0x1654AE6B, 0xAE, 0x83, 0xD7, 0x86
+CUE_POINT, CUE_TIME, CUE_TRACK_POSITIONS, CUE_TRACK = 0xBB, 0xB3, 0xB7, 0xF7
+VIDEO, PIXEL_WIDTH, PIXEL_HEIGHT = 0xE0, 0xB0, 0xBA
+CUES, CLUSTER = 0x1C53BB6B, 0x1F43B675
+
+
+def probe(path):
+    """返回包含 FIELDS 各项的字典（无法得到的为 None）；不是可识别的 MP4/MOV/MKV/WebM 时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(12)
+            if head[:4] == struct.pack(">I", EBML):
+                result = _probe_matroska(f, file_size)
+            elif head[4:8] in MP4_TOP_LEVEL:
+                result = _probe_mp4(f, file_size)
+            elif head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+                result = _probe_avi(f)
+            else:
+                return None
+    except (OSError, ValueError, IndexError, struct.error):
+        return None
+    if result is None:
+        return None
+    duration = result.get("duration")
+    # 损坏或伪造的文件头可能给出 NaN、无穷大或负数的时长，这类时长视为未知
+    if duration is not None and not (math.isfinite(duration) and duration > 0):
+        result["duration"] = duration = None
+    result["bitrate"] = int(file_size * 8 / duration) if duration else None
+    return {field: result.get(field) for field in FIELDS}
+
+
+# ---- MP4 / MOV ----
+
+def _boxes(buf, start, end):
+    """遍历 buf[start:end] 中的 box，产生 (类型, 内容起点, 内容终点)"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind.decode("latin-1"), pos + header, min(pos + size, end)
+        pos += size
+
+
+def _child(buf, start, end, kind):
+    for child, body, body_end in _boxes(buf, start, end):
+        if child == kind:
+            return body, body_end
+    return None
+
+
+def _probe_mp4(f, file_size):
+    pos = 0
+    brand = None
+    moov = None
+    mdat_seen = False
+    faststart = None
+    # 顶层只读 box 头，逐个 seek 跳过
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, kind = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size or not kind.isascii():
+            break
+        if kind == b"ftyp":
+            brand = header[8:12].decode("latin-1")
+        elif kind == b"mdat":
+            mdat_seen = True
+        elif kind == b"moov":
+            if size > MAX_MOOV_BYTES:
+                return None
+            faststart = not mdat_seen
+            f.seek(pos + header_size)
+            moov = f.read(size - header_size)
+            break
+        pos += size
+    container = "mov" if brand == "qt  " else "mp4"
+    if moov is None:
+        return {"container": container, "faststart": False}
+
+    result = {"container": container, "faststart": faststart}
+    end = len(moov)
+    mvhd = _child(moov, 0, end, "mvhd")
+    if mvhd:
+        timescale, duration = _mp4_time(moov, mvhd[0])
+        if not duration:
+            # 分片 MP4：总时长在 mvex/mehd 中
+            mvex = _child(moov, 0, end, "mvex")
+            mehd = mvex and _child(moov, mvex[0], mvex[1], "mehd")
+            if mehd:
+                version = moov[mehd[0]]
+                duration = struct.unpack_from(">Q" if version == 1 else ">I", moov, mehd[0] + 4)[0]
+        if timescale and duration:
+            result["duration"] = round(duration / timescale, 3)
+
+    for kind, body, body_end in _boxes(moov, 0, end):
+        if kind != "trak":
+            continue
+        mdia = _child(moov, body, body_end, "mdia")
+        if not mdia:
+            continue
+        hdlr = _child(moov, mdia[0], mdia[1], "hdlr")
+        handler = moov[hdlr[0] + 8:hdlr[0] + 12].decode("latin-1") if hdlr else None
+        if handler not in ("vide", "soun"):
+            continue
+        field = "video_codec" if handler == "vide" else "audio_codec"
+        if result.get(field):
+            continue
+        stsd = None
+        minf = _child(moov, mdia[0], mdia[1], "minf")
+        stbl = minf and _child(moov, minf[0], minf[1], "stbl")
+        if stbl:
+            stsd = _child(moov, stbl[0], stbl[1], "stsd")
+        entry = stsd[0] + 8 if stsd else None
+        if entry is not None and entry + 8 <= stsd[1]:
+            fourcc = moov[entry + 4:entry + 8].decode("latin-1")
+            result[field] = MP4_CODECS.get(fourcc, fourcc.strip().lower())
+            if handler == "vide" and entry + 36 <= stsd[1]:
+                result["width"], result["height"] = struct.unpack_from(">HH", moov, entry + 32)
+        if handler == "vide" and stbl:
+            mdhd = _child(moov, mdia[0], mdia[1], "mdhd")
+            if mdhd:
+                result["keyframe_interval"] = _mp4_keyframe_interval(moov, stbl, _mp4_time(moov, mdhd[0])[0])
+        if handler == "vide" and not result.get("width"):
+            # 采样描述中没有尺寸时用 tkhd 中的显示尺寸（16.16 定点数，位于 box 末尾）
+            tkhd = _child(moov, body, body_end, "tkhd")
+            if tkhd:
+                width, height = struct.unpack_from(">II", moov, tkhd[1] - 8)
+                result["width"], result["height"] = width >> 16, height >> 16
+        if "duration" not in result:
+            mdhd = _child(moov, mdia[0], mdia[1], "mdhd")
+            if mdhd:
+                timescale, duration = _mp4_time(moov, mdhd[0])
+                if timescale and duration:
+                    result["duration"] = round(duration / timescale, 3)
+    return result
+
+
+def _mp4_time(buf, body):
+    """mvhd / mdhd 的 (timescale, duration)"""
+    if buf[body] == 1:
+        return struct.unpack_from(">IQ", buf, body + 20)
+    return struct.unpack_from(">II", buf, body + 12)
+
+
+def _mp4_keyframe_interval(buf, stbl, timescale):
+    """由 stts（每个采样的时长）与 stss（关键帧的采样序号）算出相邻关键帧的最大间隔；分片 MP4 没有采样表，返回 None"""
+    stts = _child(buf, stbl[0], stbl[1], "stts")
+    if not stts or not timescale:
+        return None
+    runs = struct.unpack_from(f">{struct.unpack_from('>I', buf, stts[0] + 4)[0] * 2}I", buf, stts[0] + 8)
+    if not any(runs[0::2]):
+        return None
+    stss = _child(buf, stbl[0], stbl[1], "stss")
+    if stss is None:
+        # 没有 stss 表示每个采样都是关键帧
+        return round(max(runs[1::2]) / timescale, 3)
+    sync = struct.unpack_from(f">{struct.unpack_from('>I', buf, stss[0] + 4)[0]}I", buf, stss[0] + 8)
+    # 按 stts 的游程逐段换算关键帧的时间（采样序号从 1 开始）
+    times = []
+    first, elapsed, i = 1, 0, 0
+    for count, delta in zip(runs[0::2], runs[1::2]):
+        while i < len(sync) and sync[i] < first + count:
+            times.append(elapsed + (sync[i] - first) * delta)
+            i += 1
+        first += count
+        elapsed += count * delta
+    if not times:
+        return None
+    times.append(elapsed)
+    return round(max(b - a for a, b in zip(times, times[1:])) / timescale, 3)
+
+
+# ---- AVI ----
+
+def _chunks(buf, start, end):
+    """RIFF 块：产生 (块 ID, 内容起点, 内容终点)，LIST 块的 ID 为其列表类型"""
+    pos = start
+    while pos + 8 <= end:
+        kind, size = struct.unpack_from("<4sI", buf, pos)
+        body = pos + 8
+        if kind == b"LIST":
+            kind = buf[body:body + 4]
+            body += 4
+        yield kind.decode("latin-1"), body, min(pos + 8 + size, end)
+        pos += 8 + size + (size & 1)
+
+
+def _probe_avi(f):
+    f.seek(12)
+    kind, size, list_type = struct.unpack("<4sI4s", f.read(12))
+    if kind != b"LIST" or list_type != b"hdrl" or size > MAX_MOOV_BYTES:
+        return None
+    hdrl = f.read(size - 4)
+    result = {"container": "avi"}
+    for kind, body, end in _chunks(hdrl, 0, len(hdrl)):
+        if kind == "avih" and end - body >= 40:
+            micro_sec_per_frame, total_frames = struct.unpack_from("<I12xI", hdrl, body)
+            result["width"], result["height"] = struct.unpack_from("<II", hdrl, body + 32)
+            if micro_sec_per_frame and total_frames:
+                result["duration"] = round(micro_sec_per_frame * total_frames / 1e6, 3)
+        elif kind == "strl":
+            strh = _child_chunk(hdrl, body, end, "strh")
+            strf = _child_chunk(hdrl, body, end, "strf")
+            if not strh or strh[1] - strh[0] < 36:
+                continue
+            stream_type, handler = hdrl[strh[0]:strh[0] + 4], hdrl[strh[0] + 4:strh[0] + 8]
+            scale, rate, _, length = struct.unpack_from("<IIII", hdrl, strh[0] + 20)
+            if stream_type == b"vids" and not result.get("video_codec"):
+                fourcc = hdrl[strf[0] + 16:strf[0] + 20] if strf and strf[1] - strf[0] >= 20 else handler
+                fourcc = fourcc.decode("latin-1").strip("\0 ").lower()
+                result["video_codec"] = AVI_VIDEO_CODECS.get(fourcc, fourcc or None)
+                # avih 中的总帧数只覆盖第一个 RIFF 块（OpenDML 大文件），以视频流的长度为准
+                if scale and rate and length:
+                    result["duration"] = round(length * scale / rate, 3)
+            elif stream_type == b"auds" and not result.get("audio_codec") and strf and strf[1] - strf[0] >= 2:
+                tag = struct.unpack_from("<H", hdrl, strf[0])[0]
+                result["audio_codec"] = AVI_AUDIO_CODECS.get(tag, f"0x{tag:04x}")
+    return result
+
+
+def _child_chunk(buf, start, end, kind):
+    for child, body, body_end in _chunks(buf, start, end):
+        if child == kind:
+            return body, body_end
+    return None
+
+
+# ---- Matroska / WebM ----
+
+def _vint(buf, pos, keep_marker=False):
+    """EBML 变长整数，返回 (值, 新位置, 是否为未知大小)"""
+    first = buf[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("invalid EBML vint")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in buf[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    if pos + length > len(buf):
+        raise IndexError("truncated EBML vint")
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, pos + length, unknown
+
+
+def _elements(buf, start, end):
+    pos = start
+    while pos < end:
+        element_id, pos, _ = _vint(buf, pos, keep_marker=True)
+        size, pos, unknown = _vint(buf, pos)
+        body_end = end if unknown else min(pos + size, end)
+        yield element_id, pos, body_end
+        pos = body_end
+
+
+def _uint(buf, start, end):
+    return int.from_bytes(buf[start:end], "big")
+
+
+def _read_header(f, pos):
+    """读取文件中 pos 处的元素头，返回 (ID, 内容起点, 内容大小，未知大小时为 None)"""
+    f.seek(pos)
+    head = f.read(12)
+    element_id, offset, _ = _vint(head, 0, keep_marker=True)
+    size, offset, unknown = _vint(head, offset)
+    return element_id, pos + offset, None if unknown else size
+
+
+def _read_body(f, start, size):
+    if size is None or size > MAX_EBML_ELEMENT:
+        raise ValueError("EBML element too large")
+    f.seek(start)
+    return f.read(size)
+
+
+def _probe_matroska(f, file_size):
+    element_id, body, size = _read_header(f, 0)
+    doc_type = "matroska"
+    header = _read_body(f, body, size)
+    for child, start, end in _elements(header, 0, len(header)):
+        if child == DOC_TYPE:
+            doc_type = header[start:end].rstrip(b"\0").decode("ascii", "replace")
+    result = {"container": "webm" if doc_type == "webm" else "mkv"}
+
+    element_id, segment, size = _read_header(f, body + size)
+    if element_id != SEGMENT:
+        return result
+    segment_end = file_size if size is None else min(segment + size, file_size)
+    positions = {}
+    parsed = set()
+    first_cluster = None
+    pos = segment
+    # 一直读到第一个 Cluster：Cluster 之前只有 SeekHead / Info / Tracks / Cues 等少数几个元素
+    while pos < segment_end:
+        element_id, start, size = _read_header(f, pos)
+        if element_id == CLUSTER:
+            first_cluster = pos
+            break
+        if element_id == CUES:
+            positions.setdefault(CUES, pos)
+        elif element_id in (SEEK_HEAD, INFO, TRACKS):
+            data = _read_body(f, start, size)
+            if element_id == SEEK_HEAD:
+                positions.update({k: v for k, v in _seek_head(data, segment).items() if k not in positions})
+            else:
+                _matroska_element(element_id, data, result)
+                parsed.add(element_id)
+        if size is None:
+            break
+        pos = start + size
+    # Info / Tracks 在 Cluster 之后（少见）时按 SeekHead 中的位置跳过去
+    for element_id in (INFO, TRACKS):
+        if element_id not in parsed and element_id in positions:
+            found, start, size = _read_header(f, positions[element_id])
+            if found == element_id:
+                _matroska_element(element_id, _read_body(f, start, size), result)
+    if first_cluster is None:
+        first_cluster = positions.get(CLUSTER)
+    cues = positions.get(CUES)
+    if cues is not None and result.get("_video_track") is not None:
+        found, start, size = _read_header(f, cues)
+        if found == CUES:
+            result["keyframe_interval"] = _matroska_keyframe_interval(_read_body(f, start, size), result)
+    result["faststart"] = cues is not None and first_cluster is not None and cues < first_cluster
+    return result
+
+
+def _seek_head(data, segment):
+    positions = {}
+    for element_id, start, end in _elements(data, 0, len(data)):
+        if element_id != SEEK:
+            continue
+        seek_id = seek_position = None
+        for child, child_start, child_end in _elements(data, start, end):
+            if child == SEEK_ID:
+                seek_id = _uint(data, child_start, child_end)
+            elif child == SEEK_POSITION:
+                seek_position = _uint(data, child_start, child_end)
+        if seek_id is not None and seek_position is not None:
+            positions.setdefault(seek_id, segment + seek_position)
+    return positions
+
+
+def _matroska_element(element_id, data, result):
+    if element_id == INFO:
+        scale = 1000000
+        duration = None
+        for child, start, end in _elements(data, 0, len(data)):
+            if child == TIMESTAMP_SCALE:
+                scale = _uint(data, start, end)
+            elif child == DURATION and end - start in (4, 8):
+                duration = struct.unpack(">f" if end - start == 4 else ">d", data[start:end])[0]
+        result["_scale"] = scale
+        if duration is not None and math.isfinite(duration) and duration > 0:
+            result["duration"] = round(duration * scale / 1e9, 3)
+        return
+    for entry, start, end in _elements(data, 0, len(data)):
+        if entry != TRACK_ENTRY:
+            continue
+        track_type = track_number = codec = None
+        width = height = None
+        for child, child_start, child_end in _elements(data, start, end):
+            if child == TRACK_TYPE:
+                track_type = _uint(data, child_start, child_end)
+            elif child == TRACK_NUMBER:
+                track_number = _uint(data, child_start, child_end)
+            elif child == CODEC_ID:
+                codec = data[child_start:child_end].rstrip(b"\0").decode("ascii", "replace")
+            elif child == VIDEO:
+                for video_child, video_start, video_end in _elements(data, child_start, child_end):
+                    if video_child == PIXEL_WIDTH:
+                        width = _uint(data, video_start, video_end)
+                    elif video_child == PIXEL_HEIGHT:
+                        height = _uint(data, video_start, video_end)
+        if not codec:
+            continue
+        name = MKV_CODECS.get(codec) or MKV_CODECS.get(codec.split("/", 1)[0]) or codec.lower()
+        if codec.startswith("A_PCM"):
+            name = "pcm"
+        if track_type == 1 and not result.get("video_codec"):
+            result["video_codec"] = name
+            result["width"], result["height"] = width, height
+            result["_video_track"] = track_number
+        elif track_type == 2 and not result.get("audio_codec"):
+            result["audio_codec"] = name
+
+
+
+def _matroska_keyframe_interval(data, result):
+    """
+    Cues 中视频轨道相邻索引点的最大间隔。索引点只设在关键帧上，但不一定每个关键帧都有，
+    所以结果不小于实际的最大关键帧间隔（用于判断能否复制编码时偏保守）。
+    """
+    times = []
+    for point, start, end in _elements(data, 0, len(data)):
+        if point != CUE_POINT:
+            continue
+        cue_time = None
+        tracks = set()
+        for child, child_start, child_end in _elements(data, start, end):
+            if child == CUE_TIME:
+                cue_time = _uint(data, child_start, child_end)
+            elif child == CUE_TRACK_POSITIONS:
+                for position, position_start, position_end in _elements(data, child_start, child_end):
+                    if position == CUE_TRACK:
+                        tracks.add(_uint(data, position_start, position_end))
+        if cue_time is not None and result["_video_track"] in tracks:
+            times.append(cue_time)
+    if not times:
+        return None
+    scale = result.get("_scale", 1000000) / 1e9
+    times.sort()
+    gaps = [(b - a) * scale for a, b in zip(times, times[1:])]
+    if result.get("duration"):
+        gaps.append(result["duration"] - times[-1] * scale)
+    return round(max(gaps), 3) if gaps else None
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    import time
+
+    for path in sys.argv[1:]:
+        started = time.perf_counter()
+        info = probe(path)
+        print(f"{path} ({(time.perf_counter() - started) * 1000:.2f}ms): {json.dumps(info, ensure_ascii=False)}")
@@ -0,0 +1,175 @@
+"""
+按 RFC 7233 响应 Range 请求
+
+parse_ranges 解析 Range 头（含后缀范围 bytes=-N、多个范围），RangeFileResponse 发送
+200 整个文件 / 206 单个范围 / 206 multipart/byteranges / 416。
+
+文件内容的发送方式按以下顺序选择：
+  1. ASGI 服务器提供 http.response.zerocopysend 扩展时，交给服务器用 os.sendfile 直接从页缓存发往 socket；
+  2. 整个文件（200）且服务器提供 http.response.pathsend 扩展时，只把路径交给服务器；
+  3. 否则在线程池中用 os.pread 按块读取后发送（uvicorn 走这条路径）。
+uvicorn 不提供上面两个扩展，要真正零拷贝需要部署在 nginx 后面并使用 X-Accel-Redirect（见 main.py）。
+"""
+import os
+import secrets
+from functools import partial
+
+import anyio
+from starlette.responses import Response
+
+# 单个请求最多允许的范围数，超出时按不可满足处理，避免被大量小范围拖垮
+MAX_RANGES = 16
+CHUNK_SIZE = 1024 * 1024
+# 间隔小于该字节数的两个范围合并为一个，分开发送的 multipart 头部开销反而更大
+COALESCE_GAP = 80
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header, size):
+    """
+    返回按起点排序、合并过重叠与相邻部分的 [(start, end)]（end 含）；
+    Range 头语法错误或不是 bytes 单位时返回 None（应忽略 Range，返回整个文件）；
+    语法正确但没有一个范围可满足，或范围数超过 MAX_RANGES 时抛出 RangeNotSatisfiable。
+    """
+    if not header:
+        return None
+    unit, sep, spec = header.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+    items = [item.strip() for item in spec.split(",")]
+    items = [item for item in items if item]
+    if not items:
+        return None
+    if len(items) > MAX_RANGES:
+        raise RangeNotSatisfiable()
+    ranges = []
+    for item in items:
+        first, dash, last = item.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+        if first == "":
+            # 后缀范围：最后 N 个字节
+            if last == "":
+                return None
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1 + COALESCE_GAP:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    从 path 发送整个文件或 ranges 指定的部分。调用方先用 parse_ranges 解析（并处理 416），
+    headers 中的校验头等原样附加。
+    """
+
+    def __init__(self, path, size, ranges=None, media_type="application/octet-stream", headers=None, method="GET"):
+        self.path = str(path)
+        self.size = size
+        self.ranges = ranges
+        self.media_type = media_type
+        self.send_body = method != "HEAD"
+        self.background = None
+        self.boundary = None
+        self.parts = []
+        if not ranges:
+            self.status_code = 200
+            length = size
+            self.parts = [(None, 0, size)]
+        else:
+            self.status_code = 206
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                length = end - start + 1
+                self.parts = [(None, start, length)]
+            else:
+                self.boundary = secrets.token_hex(16)
+                length = 0
+                for start, end in ranges:
+                    head = (f"--{self.boundary}\r\nContent-Type: {media_type}\r\n"
+                            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+                    self.parts.append((head, start, end - start + 1))
+                    length += len(head) + end - start + 1 + 2
+                length += len(f"--{self.boundary}--\r\n")
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(length)
+        if self.boundary:
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+        else:
+            self.headers["content-type"] = media_type
+            if ranges:
+                start, end = ranges[0]
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    async def listen_for_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+
+    async def send_file(self, send, extensions):
+        with open(self.path, "rb") as file:
+            for i, (head, offset, count) in enumerate(self.parts):
+                last = i == len(self.parts) - 1 and self.boundary is None
+                if head:
+                    await send({"type": "http.response.body", "body": head, "more_body": True})
+                if "http.response.zerocopysend" in extensions:
+                    await send({"type": "http.response.zerocopysend", "file": file, "offset": offset,
+                                "count": count, "more_body": not last})
+                else:
+                    fd = file.fileno()
+                    end = offset + count
+                    while offset < end:
+                        chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, end - offset), offset)
+                        if not chunk:
+                            # 文件在发送过程中被截断，已声明的 Content-Length 无法满足，只能断开
+                            raise OSError(f"{self.path} 在发送过程中被截断")
+                        offset += len(chunk)
+                        await send({"type": "http.response.body", "body": chunk,
+                                    "more_body": not (last and offset >= end)})
+                if self.boundary:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            if self.boundary:
+                await send({"type": "http.response.body", "body": f"--{self.boundary}--\r\n".encode("latin-1"),
+                            "more_body": False})
+
+    async def stream_response(self, send, extensions):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            await self.send_file(send, extensions)
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        # 客户端拖动进度条时会中断上一个请求，监听断开事件以便及时停止读盘
+        async with anyio.create_task_group() as task_group:
+            async def wrap(func):
+                await func()
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(wrap, partial(self.stream_response, send, extensions))
+            await wrap(partial(self.listen_for_disconnect, receive))
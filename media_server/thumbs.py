@@ -0,0 +1,237 @@
+"""
+视频缩略图
+
+用本地 ffmpeg 从每个视频中取一帧有代表性的画面（跳到片头之后，用 thumbnail 滤镜在若干帧中挑选），
+缩放并编码为 JPEG，保存在本地磁盘的缓存目录中。缓存按 (相对路径, 大小, mtime) 的哈希寻址：
+文件被替换后自动生成新的缩略图，旧的在下次整理时删除。
+
+生成在后台进行：每个任务是一个独立的 ffmpeg 进程，由 WORKERS 个线程各自同时最多运行一个，
+限制并发数以免拖慢外置硬盘上的视频播放。任务按优先级排队：
+页面上正在显示的视频（请求缩略图或 prefetch）优先于后台的全量预生成。
+请求时只查内存 LRU 与缓存文件，不在请求路径上解码视频。
+"""
+import hashlib
+import heapq
+import itertools
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+THUMB_DIR = os.environ.get("MEDIA_THUMB_DIR", "./thumb_cache")
+FFMPEG = os.environ.get("MEDIA_FFMPEG") or shutil.which("ffmpeg")
+WORKERS = max(1, (os.cpu_count() or 2) // 2)
+WIDTH = 320
+# 取帧位置：有时长时取 10% 处，否则取第 SEEK_SECONDS 秒；太短的视频取不到帧时从头取
+SEEK_SECONDS = 10
+FFMPEG_TIMEOUT = 60
+# 内存中缓存的缩略图数量（每张约 10~20KB）
+MEMORY_ITEMS = 2000
+# 后台检查视频库是否有变化的间隔
+SYNC_SECONDS = 5
+
+URGENT, BACKGROUND = 0, 1
+
+
+def cache_key(rel, record):
+    return hashlib.sha1(f"{rel}\0{record['size']}\0{record['mtime_ns']}".encode("utf-8")).hexdigest()
+
+
+class ThumbnailPipeline:
+    def __init__(self, library, cache_dir=THUMB_DIR, workers=WORKERS):
+        self.library = library
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.queue = []
+        self.counter = itertools.count()
+        self.pending = {}
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.stopping = False
+        self.threads = []
+        self.generated = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return FFMPEG is not None
+
+    def start(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if not self.enabled:
+            print("未找到 ffmpeg，不生成缩略图（可用 MEDIA_FFMPEG 指定路径）")
+            return
+        targets = [self._worker] * self.workers + [self._sync_loop]
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            self.ready.notify_all()
+
+    def _path(self, key, suffix=".jpg"):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    # ---- 读取 ----
+
+    def cached(self, key):
+        """
+        已生成的缩略图字节；尚未生成返回 None，生成失败过（无法解码的视频）返回 b""。
+        """
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            if not os.path.exists(self._path(key, ".fail")):
+                return None
+            data = b""
+        with self.lock:
+            self.memory[key] = data
+            while len(self.memory) > MEMORY_ITEMS:
+                self.memory.popitem(last=False)
+        return data
+
+    def request(self, rel, record, priority=URGENT):
+        """排队生成缩略图，返回完成时结果为字节（失败为 b""）的 Future；同一缩略图只生成一次"""
+        key = cache_key(rel, record)
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is not None:
+                future, queued_priority = entry
+                if priority >= queued_priority:
+                    return future
+                # 已在后台队列中：以更高优先级再排一次，先被取到的那次生成，另一次取到时跳过
+            else:
+                future = Future()
+            self.pending[key] = (future, priority)
+            heapq.heappush(self.queue, (priority, next(self.counter), key, rel, record))
+            self.ready.notify()
+        return future
+
+    # ---- 生成 ----
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.stopping:
+                    self.ready.wait()
+                if self.stopping:
+                    return
+                _, _, key, rel, record = heapq.heappop(self.queue)
+                entry = self.pending.get(key)
+            if entry is None:
+                continue
+            future = entry[0]
+            try:
+                data = self.cached(key)
+                if data is None:
+                    data = self._generate(key, rel, record)
+            except OSError as e:  # 缓存目录不可写等，不记为失败，之后还会重试
+                print(f"缩略图生成失败 {rel}: {e}")
+                data = b""
+            with self.lock:
+                self.pending.pop(key, None)
+            future.set_result(data)
+
+    def _generate(self, key, rel, record):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        duration = record.get("duration")
+        seek = duration * 0.1 if duration else SEEK_SECONDS
+        data = b""
+        try:
+            for offset in (seek, 0):
+                command = [
+                    FFMPEG, "-nostdin", "-v", "error", "-y",
+                    "-ss", f"{offset:.3f}", "-i", str(self.library.root / rel),
+                    "-an", "-sn", "-frames:v", "1",
+                    "-vf", f"thumbnail=50,scale={WIDTH}:-2", "-q:v", "5", "-f", "image2", "-update", "1", "-c:v", "mjpeg", tmp,
+                ]
+                try:
+                    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   timeout=FFMPEG_TIMEOUT, check=True)
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                    print(f"缩略图生成失败 {rel}: {e}")
+                    break
+                if os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                    with open(tmp, "rb") as f:
+                        data = f.read()
+                    os.replace(tmp, path)
+                    break
+                # 跳转位置超过视频长度时 ffmpeg 正常退出但没有输出，改为从头取帧
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if data:
+            self.generated += 1
+        else:
+            # 记录失败，避免每次扫描都重新尝试无法解码的文件；文件变化后 key 改变会重新尝试
+            self.failed += 1
+            open(self._path(key, ".fail"), "wb").close()
+        with self.lock:
+            self.memory[key] = data
+            while len(self.memory) > MEMORY_ITEMS:
+                self.memory.popitem(last=False)
+        return data
+
+    # ---- 后台预生成 ----
+
+    def _sync_loop(self):
+        version = None
+        while True:
+            with self.lock:
+                if self.stopping:
+                    return
+            current = self.library.version
+            if current != version and self.library.last_scan:
+                try:
+                    self.sync()
+                    version = current
+                except Exception as e:
+                    print(f"缩略图预生成失败: {e}")
+            time.sleep(SYNC_SECONDS)
+
+    def sync(self):
+        """为尚无缩略图的视频排队后台生成，并删除已不对应任何视频的缓存文件"""
+        keys = set()
+        for video in self.library.videos():
+            record = self.library.get(video["path"])
+            if record is None:
+                continue
+            key = cache_key(video["path"], record)
+            keys.add(key)
+            if not (os.path.exists(self._path(key)) or os.path.exists(self._path(key, ".fail"))):
+                self.request(video["path"], record, BACKGROUND)
+        removed = 0
+        for sub in os.listdir(self.cache_dir):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith(".tmp") or name.split(".", 1)[0] in keys:
+                    continue
+                try:
+                    os.remove(os.path.join(sub_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        with self.lock:
+            queued = len(self.pending)
+        return {"enabled": self.enabled, "queued": queued, "generated": self.generated, "failed": self.failed,
+                "memory": len(self.memory)}
@@ -0,0 +1,131 @@
+"""
+视频目录监听
+
+用 watchdog（Linux 上为 inotify，macOS 上为 FSEvents）监听 VIDEO_DIR，把新增、删除、改名、写入事件
+攒成一批（DEBOUNCE_SECONDS 内的事件合并）后交给 Library.apply_changes，只处理涉及的文件和目录，
+新视频在一秒内出现在列表中。事件可能丢失（如 inotify 队列溢出、外置硬盘重新挂载），
+所以另有一个线程定期做增量扫描兜底；未安装 watchdog 或监听启动失败时缩短扫描间隔。
+"""
+import os
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog 是可选依赖，没有时只靠定期扫描
+    Observer = None
+    FileSystemEventHandler = object
+
+DEBOUNCE_SECONDS = 0.3
+# 有事件监听时的兜底扫描间隔，以及无法监听时的轮询间隔
+RECONCILE_SECONDS = 600
+POLL_SECONDS = 30
+# 只关心会改变目录内容或文件大小的事件，忽略 opened / closed_no_write 等读取产生的事件
+EVENT_TYPES = {"created", "deleted", "moved", "modified", "closed"}
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in EVENT_TYPES:
+            return
+        # 目录的 modified 事件只表示其子项有变化，子项自己也会产生事件
+        if event.is_directory and event.event_type in ("modified", "closed"):
+            return
+        paths = [event.src_path]
+        if event.event_type == "moved":
+            paths.append(event.dest_path)
+        for path in paths:
+            self.watcher.add(os.fsdecode(path), event.is_directory)
+
+
+class LibraryWatcher:
+    def __init__(self, library):
+        self.library = library
+        self.root = os.path.abspath(library.root)
+        self.observer = None
+        self.pending_files = set()
+        self.pending_dirs = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.events = 0
+        self.batches = 0
+
+    @property
+    def watching(self):
+        return self.observer is not None and self.observer.is_alive()
+
+    def start(self):
+        """启动事件监听与兜底扫描线程；首次扫描在扫描线程中立即进行"""
+        if Observer is not None:
+            observer = Observer()
+            try:
+                observer.schedule(_Handler(self), self.root, recursive=True)
+                observer.start()
+                self.observer = observer
+            except Exception as e:  # 目录不存在、inotify watch 数量达到上限等
+                print(f"目录监听启动失败，改为每 {POLL_SECONDS} 秒扫描一次: {e}")
+        else:
+            print(f"未安装 watchdog，改为每 {POLL_SECONDS} 秒扫描一次")
+        for target in (self._apply_loop, self._reconcile_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout=5)
+
+    def add(self, path, is_directory):
+        rel = os.path.relpath(path, self.root)
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return
+        with self.lock:
+            (self.pending_dirs if is_directory else self.pending_files).add(rel)
+            self.events += 1
+        self.wakeup.set()
+
+    def _apply_loop(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait()
+            # 拷贝一个大文件会连续产生大量 modified 事件，等一小段时间合并成一批
+            if self.stopping.wait(DEBOUNCE_SECONDS):
+                return
+            with self.lock:
+                self.wakeup.clear()
+                files, dirs = self.pending_files, self.pending_dirs
+                self.pending_files, self.pending_dirs = set(), set()
+            try:
+                stats = self.library.apply_changes(files, dirs)
+                self.batches += 1
+                if stats["added"] or stats["updated"] or stats["removed"]:
+                    print(f"视频库更新（事件）: {stats}")
+            except Exception as e:
+                print(f"视频库事件处理失败: {e}")
+
+    def _reconcile_loop(self):
+        interval = 0
+        while not self.stopping.wait(interval):
+            try:
+                stats = self.library.rescan()
+                if stats["added"] or stats["updated"] or stats["removed"]:
+                    print(f"视频库更新（扫描）: {stats}")
+            except Exception as e:
+                print(f"视频库扫描失败: {e}")
+            interval = RECONCILE_SECONDS if self.watching else POLL_SECONDS
+
+    def stats(self):
+        return {
+            "watching": self.watching,
+            "events": self.events,
+            "batches": self.batches,
+            "last_scan": self.library.last_scan,
+            "last_scan_stats": self.library.last_stats,
+        }